@@ -0,0 +1,79 @@
+# Regression check of the batched ABC against the reference implementation (one callback per side,
+# history kept in a list of arrays), for several orderings of the sides, plus timings.
+# Run from the repository root with: python -m benchmarks.abc_regression
+# Exits with a non zero status if the fields differ.
+
+import sys
+from datetime import datetime as dt
+import numpy
+import engine.solver as FDTD
+import engine.boundaries as bounds
+import engine.sources as sources
+
+
+class ReferenceABC(bounds.Boundary):
+    """
+    ABC as originally implemented, cf. http://www.eecs.wsu.edu/~schneidj/ufdtd/chap6.pdf eq. 6.32-33
+    """
+    def __init__(self, grid, side):
+        bounds.Boundary.__init__(self, grid, side)
+        t1 = grid.C
+        t2 = 1. / t1 + 2. + t1
+        self._coef0 = - (1. / t1 - 2. + t1) / t2
+        self._coef1 = - 2. * (t1 - 1. / t1) / t2
+        self._coef2 = 4. * (t1 + 1. / t1) / t2
+
+        size = grid.shape[1] if 'x' in side else grid.shape[0]
+        self._auxfield = [numpy.zeros((3, size)), numpy.zeros((3, size))]
+
+        if side == 'xm':
+            self._realfield = grid._Fz._data[0:3,:]
+        elif side == 'xp':
+            self._realfield = grid._Fz._data[-1:-4:-1,:]
+        elif side == 'ym':
+            self._realfield = numpy.transpose(grid._Fz._data[:,0:3])
+        elif side == 'yp':
+            self._realfield = numpy.transpose(grid._Fz._data[:,-1:-4:-1])
+
+    def __call__(self, *args):
+        update = (
+            self._coef0 * (self._realfield[2,:] + self._auxfield[1][0,:]) +
+            self._coef1 * (self._auxfield[0][0,:] + self._auxfield[0][2,:] -
+                           self._realfield[1,:] - self._auxfield[1][1,:]) +
+            self._coef2 * self._auxfield[0][1,:] -
+            self._auxfield[1][2,:]
+        )
+        self._auxfield.pop()
+        self._auxfield.insert(0, numpy.array([update, self._realfield[1,:].copy(), self._realfield[2,:].copy()]))
+
+        self._realfield[0,:] = update
+
+
+def to_msec(x):
+    return x.seconds * 1000 + x.microseconds/1000
+
+SIDES = ('xm', 'xp', 'ym', 'yp')
+
+def simulate(order, boundary, shape=(120, 90), nsteps=600):
+    g = FDTD.Grid(*shape)
+    g.set_boundaries(**{side: boundary if side in order else bounds.PEC for side in order + SIDES})
+    # Sources close to two corners, so that the corner nodes are well excited
+    sources.SourceDipole(g, (5, 6), sources.PulseGaussian(1, 4e-15, 1e-15, 1.8e15))
+    sources.SourceDipole(g, (shape[0] - 4, shape[1] - 7), sources.PulseGaussian(1, 6e-15, 1e-15, 1.2e15))
+    sources.SourceDipole(g, (shape[0] // 2, shape[1] // 3), sources.PulseGaussian(1, 5e-15, 1e-15, 1.5e15))
+    g.build()
+    start = dt.now()
+    for i in range(nsteps):
+        g.step(i)
+    return g._Fz._data, to_msec(dt.now() - start)
+
+if __name__ == '__main__':
+    failed = False
+    for order in (('xm', 'xp', 'ym', 'yp'), ('xm', 'ym', 'xp', 'yp'), ('yp', 'xm', 'ym', 'xp'), ('ym', 'yp')):
+        ref, t_ref = simulate(order, ReferenceABC)
+        new, t_new = simulate(order, bounds.ABC)
+        same = numpy.array_equal(ref, new)
+        failed = failed or not same
+        print("{:>16s}: {:9s} max. diff. {:.2e}, {:.0f} ms (reference {:.0f} ms)".format(
+            ",".join(order), "identical" if same else "DIFFERENT", numpy.abs(ref - new).max(), t_new, t_ref))
+    sys.exit(1 if failed else 0)
@@ -0,0 +1,59 @@
+# Active-region tracking (Grid(..., track_active=True)): ms per step with and without it on a
+# large grid, over consecutive windows of steps from the start, for a dipole in the middle of
+# the grid and for a small TFSF box. The tracked box grows from the sources by one node per
+# half step, so the speedup is largest early on and fades once the box covers the grid. The
+# fields of the two runs are compared at the end of every window.
+# Run from the repository root with: python -m benchmarks.active_region
+
+from datetime import datetime as dt
+import numpy
+import engine.solver as FDTD
+import engine.boundaries as bounds
+import engine.sources as sources
+
+SIZE = 1000
+WINDOWS = [50, 50, 100, 100, 200]
+
+
+def to_msec(x):
+    return x.seconds * 1000 + x.microseconds/1000
+
+def make(case, update, track):
+    g = FDTD.Grid(SIZE, SIZE, update=update, track_active=track)
+    g.set_boundaries(xm=bounds.ABC, xp=bounds.ABC, ym=bounds.ABC, yp=bounds.ABC)
+    pulse = sources.PulseGaussian(1, 10e-15, 2e-15, 1.8e15)
+    if case == "dipole":
+        sources.SourceDipole(g, (SIZE // 2, SIZE // 2), pulse)
+    else:
+        c = SIZE // 2
+        sources.SourceTFSF(g, (c - 50, c - 50), (c + 50, c + 50), pulse, phi=0.3)
+    g.build()
+    return g
+
+def compare(case, update):
+    """
+    :return: list of (last step, ms/step untracked, ms/step tracked, identical) for each window
+    """
+    grids = [make(case, update, track) for track in (False, True)]
+    results, start = [], 0
+    for n in WINDOWS:
+        times = []
+        for g in grids:
+            begin = dt.now()
+            g.run(n, start=start)
+            times.append(to_msec(dt.now() - begin) / n)
+        start += n
+        same = all(numpy.array_equal(grids[0].get_field(c)._data, grids[1].get_field(c)._data) for c in "zxy")
+        results.append((start, times[0], times[1], same))
+    for g in grids:
+        g.close()
+    return results
+
+if __name__ == '__main__':
+    for update in ('fused', 'threads'):
+        for case in ('dipole', 'tfsf'):
+            print("{} on a {}x{} grid, '{}' engine".format(case, SIZE, SIZE, update))
+            print("{:>8s} {:>11s} {:>11s} {:>9s} {:>10s}".format("steps", "full", "tracked", "speedup", "fields"))
+            for steps, full, tracked, same in compare(case, update):
+                print("{:>8s} {:11.2f} {:11.2f} {:9.1f} {:>10s}".format(
+                    "..{}".format(steps), full, tracked, full / tracked, "identical" if same else "DIFFERENT"))
@@ -0,0 +1,98 @@
+# Dispersive materials (DispersiveMaterial with Drude and Lorentz poles):
+# * reflection of a plane wave at normal incidence on a thick slab of a Drude metal and of a
+#   Lorentz dielectric, against the Fresnel coefficient |(1 - n) / (1 + n)| with n^2 = epsr(w),
+#   for TE and TM. The reflected pulse is recorded in front of the slab before the echoes of
+#   the other faces of the slab arrive
+# * cost per step against the area of the material, with the pole arrays allocated over the
+#   bounding box of the material only
+# Run from the repository root with: python -m benchmarks.dispersive
+
+from datetime import datetime as dt
+import numpy
+import engine.solver as FDTD
+import engine.boundaries as bounds
+import engine.sources as sources
+import engine.materials as materials
+from engine.monitors import Monitor
+
+OMEGA = 3e15
+OMEGAS = numpy.linspace(OMEGA - 1.5e15, OMEGA + 1.5e15, 7)
+MATERIALS = {
+    "Drude": (1., [materials.Drude(3e15, 1e14)]),
+    "Lorentz": (2., [materials.Lorentz(2., 2.5e15, 1e14)]),
+}
+
+
+def to_msec(x):
+    return x.seconds * 1000 + x.microseconds/1000
+
+def epsr(eps_inf, poles, omega):
+    value = eps_inf + 0j
+    for pole in poles:
+        if isinstance(pole, materials.Drude):
+            value -= pole.omega_p ** 2 / (omega ** 2 + 1j * pole.gamma * omega)
+        else:
+            value += pole.delta_eps * pole.omega_0 ** 2 / (pole.omega_0 ** 2 - 2j * pole.delta * omega - omega ** 2)
+    return value
+
+def reflection(polarization, material=None):
+    """
+    :return: DFT at the frequencies OMEGAS of the field in front of the slab
+    """
+    g = FDTD.Grid(300, 1000, update='fused', polarization=polarization)
+    g.set_boundaries(xm=bounds.ABC, xp=bounds.ABC, ym=bounds.ABC, yp=bounds.ABC)
+    sources.SourceTFSF(g, (20, 20), (279, 979), sources.PulseGaussian(1, 3.2e-15, 0.8e-15, OMEGA))
+    if material is not None:
+        eps_inf, poles = MATERIALS[material]
+        materials.DispersiveMaterial(g, eps_inf, poles, (150, 30), (270, 969))
+    probe = Monitor(g, points=[(80, 500)], length=700, frequencies=OMEGAS / (2 * numpy.pi))
+    g.build()
+    g.run(700)
+    return probe.dft[:, 0]
+
+def cost(fraction, nsteps=300):
+    """
+    :return: best ms per step over three runs and MB of pole arrays, with a Drude-Lorentz
+        material covering a fraction of a 500x500 grid
+    """
+    g = FDTD.Grid(500, 500, update='fused')
+    g.set_boundaries(xm=bounds.PEC, xp=bounds.PEC, ym=bounds.PEC, yp=bounds.PEC)
+    sources.SourceDipole(g, (250, 250), sources.PulseGaussian(1, 10e-15, 2e-15, 1.8e15))
+    mb = 0.
+    if fraction:
+        side = int(498 * numpy.sqrt(fraction))
+        start = 250 - side // 2
+        material = materials.DispersiveMaterial(
+            g, 1., [materials.Drude(3e15, 1e14), materials.Lorentz(2., 2.5e15, 1e14)],
+            (start, start), (start + side - 1, start + side - 1))
+    g.build()
+    if fraction:
+        mb = sum(a.nbytes for e, states, out, tmp in material._targets for s in states for a in s) / 2**20
+    g.run(10)
+    best = None
+    for repeat in range(3):
+        start = dt.now()
+        g.run(nsteps)
+        elapsed = to_msec(dt.now() - start)
+        best = elapsed if best is None else min(best, elapsed)
+    return best / nsteps, mb
+
+if __name__ == '__main__':
+    for polarization in ('te', 'tm'):
+        incident = reflection(polarization)
+        for material, (eps_inf, poles) in MATERIALS.items():
+            measured = numpy.abs(reflection(polarization, material) - incident) / numpy.abs(incident)
+            n = numpy.sqrt(epsr(eps_inf, poles, OMEGAS))
+            expected = numpy.abs((1 - n) / (1 + n))
+            print("{} {:>8s} |r|:".format(polarization.upper(), material))
+            print("  {:>12s} {}".format("w (rad/s)", " ".join("{:7.2e}".format(w) for w in OMEGAS)))
+            print("  {:>12s} {}".format("FDTD", " ".join("{:7.3f}".format(r) for r in measured)))
+            print("  {:>12s} {}".format("Fresnel", " ".join("{:7.3f}".format(r) for r in expected)))
+
+    print("\nDrude-Lorentz material on a 500x500 grid")
+    print("{:>9s} {:>9s} {:>10s} {:>13s}".format("area (%)", "ms/step", "overhead", "poles (MB)"))
+    base, mb = cost(0)
+    print("{:9.0f} {:9.2f} {:>10s} {:13.2f}".format(0, base, "", mb))
+    for fraction in (0.01, 0.1, 0.25, 1.):
+        time, mb = cost(fraction)
+        print("{:9.0f} {:9.2f} {:9.0f}% {:13.2f}".format(100 * fraction, time, 100 * (time / base - 1), mb))
@@ -0,0 +1,66 @@
+# Throughput of an Ensemble of small grids against the same grids run one after the other, and
+# check that the results are the same. Updates is the share of the time of the separate runs spent
+# in their bulk updates. Small grids are bound by the Python calls, which the ensemble merges; from
+# 100x100 most of the time goes to the arithmetic of the bulk updates, which stacking does not
+# reduce, and the speedup is bounded by 100 / updates.
+# Run from the repository root with: python -m benchmarks.ensemble
+
+from datetime import datetime as dt
+import numpy
+import engine.solver as FDTD
+import engine.boundaries as bounds
+import engine.sources as sources
+import engine.materials as materials
+from engine.ensemble import Ensemble
+
+NSTEPS = 200
+
+
+def to_msec(x):
+    return x.seconds * 1000 + x.microseconds/1000
+
+def make_grid(size, k):
+    g = FDTD.Grid(size, size, update='fused')
+    g.set_boundaries(xm=bounds.ABC, xp=bounds.ABC, ym=bounds.ABC, yp=bounds.PEC)
+    # Each member has its own material and pulse
+    materials.PassiveMaterial(g, 1.2 + 0.01 * k, (size // 2, size // 4), (size * 3 // 4, size * 3 // 4),
+                              sigma=1e3 * (k % 2))
+    sources.SourceDipole(g, (size // 4, size // 2), sources.PulseGaussian(10, 10e-15, 2e-15, 1.2e15 + 1e13 * k))
+    sources.SourceDipole(g, (size // 3, 5 + k % (size // 2)), sources.PulseGaussian(1, 12e-15, 3e-15, 1.8e15))
+    return g
+
+def separate(size, n):
+    grids = [make_grid(size, k) for k in range(n)]
+    start = dt.now()
+    for g in grids:
+        g.build()
+        g.run(NSTEPS)
+    return to_msec(dt.now() - start), numpy.array([g._Fz._data for g in grids])
+
+def kernels(size, n):
+    grids = [make_grid(size, k) for k in range(n)]
+    for g in grids:
+        g.build()
+    start = dt.now()
+    for g in grids:
+        for t in range(NSTEPS):
+            g._update.step_h(t)
+            g._update.step_e(t)
+    return to_msec(dt.now() - start)
+
+def stacked(size, n):
+    ensemble = Ensemble([make_grid(size, k) for k in range(n)])
+    start = dt.now()
+    ensemble.build()
+    ensemble.run(NSTEPS)
+    return to_msec(dt.now() - start), ensemble.get_field('z')
+
+if __name__ == '__main__':
+    print("{:>6s} {:>8s} {:>14s} {:>14s} {:>9s} {:>11s} {:>12s}".format(
+        "size", "members", "separate (ms)", "ensemble (ms)", "speedup", "updates (%)", "max. diff."))
+    for size in (32, 100):
+        for n in (1, 10, 100, 400):
+            t0, ref = separate(size, n)
+            t1, res = stacked(size, n)
+            print("{:6d} {:8d} {:14.0f} {:14.0f} {:9.2f} {:11.0f} {:12.2e}".format(
+                size, n, t0, t1, t0 / t1, 100 * kernels(size, n) / t0, numpy.abs(res - ref).max()))
@@ -0,0 +1,86 @@
+# Near-to-far-field transformation (engine.monitors.FarFieldMonitor):
+# * a dielectric block lit by a plane wave, with the contour just outside the TFSF box: the far
+#   field pattern against the DFT of the scattered field at a ring of probes at RADIUS cells,
+#   scaled by sqrt(rho) exp(i k rho), for TE and TM. The probes are not quite in the far field
+#   of the contour: the residual differences are mostly the phase k r'^2 / (2 rho) neglected by
+#   the far field approximation, which halves when the radius doubles
+# * cost per step of the monitor against the number of frequencies, on a 1000x1000 grid
+# Run from the repository root with: python -m benchmarks.far_field
+
+from datetime import datetime as dt
+import numpy
+import engine.solver as FDTD
+import engine.boundaries as bounds
+import engine.sources as sources
+import engine.materials as materials
+from engine.monitors import FarFieldMonitor, Monitor
+
+SIZE = 700
+RADIUS = 280
+BOX = 40
+NSTEPS = 2200
+FREQUENCIES = numpy.array([4e14, 6e14])
+ANGLES = numpy.linspace(0, 2 * numpy.pi, 12, endpoint=False)
+
+
+def to_msec(x):
+    return x.seconds * 1000 + x.microseconds/1000
+
+def scattering(polarization):
+    """
+    :return: (pattern of the monitor, pattern measured at the probes), at the angles of the probes
+    """
+    c = SIZE // 2
+    g = FDTD.Grid(SIZE, SIZE, update='fused', polarization=polarization)
+    g.set_boundaries(xm=bounds.CPML, xp=bounds.CPML, ym=bounds.CPML, yp=bounds.CPML)
+    pulse = sources.PulseGaussian(1, 16e-15, 4e-15, 2 * numpy.pi * FREQUENCIES.mean())
+    sources.SourceTFSF(g, (c - BOX, c - BOX), (c + BOX, c + BOX), pulse, phi=0.4)
+    materials.PassiveMaterial(g, 2., (c - 15, c - 25), (c + 10, c + 5))
+    far = FarFieldMonitor(g, FREQUENCIES, (c - BOX - 2, c - BOX - 2), (c + BOX + 2, c + BOX + 2))
+    nodes = numpy.rint(c + RADIUS * numpy.stack((numpy.cos(ANGLES), numpy.sin(ANGLES)), axis=-1)).astype(int)
+    probes = Monitor(g, points=nodes, length=1, ring=True, frequencies=FREQUENCIES)
+    g.build()
+    g.run(NSTEPS)
+
+    x, y = (nodes - far.origin).T * g.dx
+    rho = numpy.hypot(x, y)
+    k = 2 * numpy.pi * FREQUENCIES[:, None] / g.c
+    measured = probes.dft * numpy.sqrt(rho) * numpy.exp(1j * k * rho)
+    return far.pattern(numpy.arctan2(y, x)), measured
+
+def cost(nfreq, nsteps=200):
+    """
+    :return: best ms per step over three runs, with a monitor at nfreq frequencies (none if 0)
+    """
+    g = FDTD.Grid(1000, 1000, update='fused')
+    g.set_boundaries(xm=bounds.ABC, xp=bounds.ABC, ym=bounds.ABC, yp=bounds.ABC)
+    sources.SourceDipole(g, (500, 500), sources.PulseGaussian(1, 10e-15, 2e-15, 1.8e15))
+    if nfreq:
+        FarFieldMonitor(g, numpy.linspace(2e14, 4e14, nfreq), (300, 300), (700, 700))
+    g.build()
+    best = None
+    for repeat in range(3):
+        start = dt.now()
+        g.run(nsteps)
+        elapsed = to_msec(dt.now() - start)
+        best = elapsed if best is None else min(best, elapsed)
+    return best / nsteps
+
+if __name__ == '__main__':
+    for polarization in ('te', 'tm'):
+        predicted, measured = scattering(polarization)
+        print("{} far field of a dielectric block, probes at {} cells".format(polarization.upper(), RADIUS))
+        print("  {:>14s} {}".format("phi (deg)", " ".join("{:6.0f}".format(a) for a in numpy.degrees(ANGLES))))
+        for f, p, m in zip(FREQUENCIES, predicted, measured):
+            scale = numpy.abs(m).max()
+            print("  {:>5.1e} Hz |P| {}".format(f, " ".join("{:6.3f}".format(v) for v in numpy.abs(p) / scale)))
+            print("  {:>14s} {}".format("probes", " ".join("{:6.3f}".format(v) for v in numpy.abs(m) / scale)))
+            print("  {:>14s} {:.3f}".format("max. rel. error", numpy.abs(p - m).max() / scale))
+
+    print("\nFarFieldMonitor on the 1604 nodes of a contour in a 1000x1000 grid")
+    print("{:>6s} {:>9s} {:>10s}".format("nfreq", "ms/step", "overhead"))
+    base = cost(0)
+    print("{:6d} {:9.2f}".format(0, base))
+    for nfreq in (1, 10, 50):
+        time = cost(nfreq)
+        print("{:6d} {:9.2f} {:9.0f}%".format(nfreq, time, 100 * (time / base - 1)))
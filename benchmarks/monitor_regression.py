@@ -0,0 +1,53 @@
+# Regression check of the running DFT of Monitor: the same probes with buffers of different
+# lengths, filled up and overwritten (ring), emptied (on_full) or left full, must give the same
+# DFT over the whole run, for each precision.
+# Run from the repository root with: python -m benchmarks.monitor_regression
+# Exits with a non zero status if the DFTs differ.
+
+import sys
+import numpy
+import engine.solver as FDTD
+import engine.boundaries as bounds
+import engine.sources as sources
+from engine.monitors import Monitor
+
+NSTEPS = 600
+FREQUENCIES = [2e14, 3e14, 4e14]
+BUFFERS = [
+    dict(length=NSTEPS),
+    dict(length=10),
+    dict(length=10, ring=True),
+    dict(length=10, on_full=lambda records: None),
+    dict(length=NSTEPS, every=3),
+    dict(length=7, every=3),
+]
+
+
+def simulate(dtype, buffer):
+    g = FDTD.Grid(120, 90, update='fused', dtype=dtype)
+    g.set_boundaries(xm=bounds.ABC, xp=bounds.ABC, ym=bounds.ABC, yp=bounds.ABC)
+    sources.SourceDipole(g, (40, 45), sources.PulseGaussian(1, 4e-15, 1e-15, 1.8e15))
+    monitor = Monitor(g, points=[(80, 45), (60, 20)], lines=[((10, 70), (110, 70))],
+                      frequencies=FREQUENCIES, **buffer)
+    g.build()
+    g.run(NSTEPS)
+    return monitor.dft
+
+if __name__ == '__main__':
+    failed = False
+    for dtype in ('double', 'single', 'mixed'):
+        reference = {}
+        for buffer in BUFFERS:
+            every = buffer.get("every", 1)
+            dft = simulate(dtype, buffer)
+            if every not in reference:
+                reference[every] = dft
+                continue
+            same = numpy.array_equal(dft, reference[every])
+            failed = failed or not same
+            options = ", ".join("{}={}".format(k, "flush" if k == "on_full" else v) for k, v in buffer.items())
+            result = "identical"
+            if not same:
+                result = "DIFFERENT (max. {:g})".format(numpy.abs(dft - reference[every]).max())
+            print("{:>6s} {:32s} {}".format(dtype, options, result))
+    sys.exit(1 if failed else 0)
@@ -0,0 +1,46 @@
+# Reflections of the absorbing boundaries. A dipole radiates a short pulse close to the boundary of
+# a small domain; the field recorded along a line near the boundary is compared with the one of
+# a domain large enough for reflections not to come back within the run.
+# Run from the repository root with: python -m benchmarks.pml_reflection
+
+import functools
+from datetime import datetime as dt
+import numpy
+import engine.solver as FDTD
+import engine.boundaries as bounds
+import engine.sources as sources
+from engine.monitors import Monitor
+
+
+def to_msec(x):
+    return x.seconds * 1000 + x.microseconds/1000
+
+def record(size, boundary, nsteps, offset=0):
+    g = FDTD.Grid(size, size)
+    g.set_boundaries(xm=boundary, xp=boundary, ym=boundary, yp=boundary)
+    center = size // 2
+    sources.SourceDipole(g, (center, center), sources.PulseGaussian(1, 4e-15, 1e-15, 1.8e15))
+    # Line probe 25 cells away from the xp side of the small domain, outside of any layer
+    x = offset + SIZE - 26
+    monitor = Monitor(g, lines=[((x, center - 20), (x, center + 20))], length=nsteps)
+    g.build()
+    start = dt.now()
+    g.run(nsteps)
+    return monitor.data, to_msec(dt.now() - start)
+
+SIZE = 120
+
+if __name__ == '__main__':
+    nsteps = 600
+    ref, elapsed = record(SIZE + 2 * nsteps, bounds.PEC, nsteps, offset=nsteps)
+    norm = numpy.abs(ref).max()
+    print("{:>24s} {:>16s} {:>14s} {:>10s}".format("boundary", "max. rel. error", "error (dB)", "time (ms)"))
+    cases = [("ABC", bounds.ABC)] + [
+        ("CPML ({} cells)".format(n), functools.partial(bounds.CPML, thickness=n)) for n in (5, 10, 20)
+    ] + [
+        ("CPML (10 cells, kappa 5)", functools.partial(bounds.CPML, thickness=10, kappa_max=5., alpha_max=0.01))
+    ]
+    for name, boundary in cases:
+        data, elapsed = record(SIZE, boundary, nsteps)
+        error = numpy.abs(data - ref).max() / norm
+        print("{:>24s} {:16.2e} {:14.1f} {:10.0f}".format(name, error, 20 * numpy.log10(error), elapsed))
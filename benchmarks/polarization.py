@@ -0,0 +1,67 @@
+# TE and TM on the same geometry stepped together (Ensemble.unpolarized) against the two
+# polarizations run one after the other, and check that the results are the same. Also checks
+# the duality of the TM solver: in vacuum, Hz of TM equals Ez of TE for the same sources.
+# Run from the repository root with: python -m benchmarks.polarization
+
+import functools
+from datetime import datetime as dt
+import numpy
+import engine.solver as FDTD
+import engine.boundaries as bounds
+import engine.sources as sources
+import engine.materials as materials
+from engine.ensemble import Ensemble
+
+NSTEPS = 200
+
+
+def to_msec(x):
+    return x.seconds * 1000 + x.microseconds/1000
+
+def setup(g, vacuum=False):
+    size = g.shape[0]
+    g.set_boundaries(xm=bounds.ABC, xp=bounds.ABC, ym=bounds.ABC,
+                     yp=functools.partial(bounds.CPML, thickness=10))
+    sources.SourceTFSF(g, (size // 5, size // 5), (size * 3 // 4, size * 3 // 4),
+                       sources.PulseGaussian(1, 10e-15, 2e-15, 1.257e15), phi=0.4)
+    sources.SourceDipole(g, (size // 3, size // 3), sources.PulseGaussian(10, 10e-15, 2e-15, 1.8e15))
+    if not vacuum:
+        materials.PassiveMaterial(g, 1.5, (size // 4, size // 2), (size // 2, size * 2 // 3), sigma=1e4)
+        materials.PassiveMaterial(g, 2.2, (size // 2 + 1, size // 4), (size * 3 // 5, size // 2 - 1))
+
+def separate(size):
+    grids = [FDTD.Grid(size, size, update='fused', polarization=p) for p in ('te', 'tm')]
+    for g in grids:
+        setup(g)
+    start = dt.now()
+    for g in grids:
+        g.build()
+        g.run(NSTEPS)
+    return to_msec(dt.now() - start), numpy.array([g._Fz._data for g in grids])
+
+def joint(size):
+    ensemble = Ensemble.unpolarized(setup, size, size)
+    start = dt.now()
+    ensemble.build()
+    ensemble.run(NSTEPS)
+    return to_msec(dt.now() - start), ensemble.get_field('z')
+
+def duality(size):
+    fields = []
+    for polarization in ('te', 'tm'):
+        g = FDTD.Grid(size, size, update='fused', polarization=polarization)
+        setup(g, vacuum=True)
+        g.build()
+        g.run(NSTEPS)
+        fields.append(g._Fz._data)
+    return numpy.abs(fields[1] - fields[0]).max() / numpy.abs(fields[0]).max()
+
+if __name__ == '__main__':
+    print("Duality in vacuum, max. rel. diff. of Hz (TM) and Ez (TE): {:.2e}".format(duality(100)))
+    print("{:>6s} {:>14s} {:>11s} {:>9s} {:>12s}".format(
+        "size", "separate (ms)", "joint (ms)", "speedup", "max. diff."))
+    for size in (50, 100, 200, 500, 1000):
+        t0, ref = separate(size)
+        t1, res = joint(size)
+        print("{:6d} {:14.0f} {:11.0f} {:9.2f} {:12.2e}".format(
+            size, t0, t1, t0 / t1, numpy.abs(res - ref).max()))
@@ -0,0 +1,57 @@
+# Accuracy and speed of the single and mixed precision modes against double precision, on a
+# scenario with a TFSF box, dipoles, dielectrics, a lossy material and ABC/CPML boundaries.
+# Errors are relative to the largest value of the double precision result.
+# Run from the repository root with: python -m benchmarks.precision
+
+import functools
+from datetime import datetime as dt
+import numpy
+import engine.solver as FDTD
+import engine.boundaries as bounds
+import engine.sources as sources
+import engine.materials as materials
+from engine.monitors import FrequencyMonitor, Monitor
+
+SIZE = 400
+NSTEPS = 2000
+
+
+def to_msec(x):
+    return x.seconds * 1000 + x.microseconds/1000
+
+def simulate(dtype, update):
+    g = FDTD.Grid(SIZE, SIZE, update=update, dtype=dtype)
+    g.set_boundaries(xm=bounds.ABC, xp=bounds.ABC, ym=bounds.ABC,
+                     yp=functools.partial(bounds.CPML, thickness=20))
+    sources.SourceTFSF(g, (40, 40), (SIZE - 60, SIZE - 60), sources.PulseGaussian(1, 10e-15, 2e-15, 1.257e15))
+    sources.SourceDipole(g, (SIZE // 3, SIZE // 2), sources.PulseGaussian(10, 10e-15, 2e-15, 1.8e15))
+    materials.PassiveMaterial(g, 2.3, (100, 120), (140, 180))
+    materials.PassiveMaterial(g, 1.5, (200, 100), (260, 300), sigma=2e4)
+    probes = Monitor(g, points=[(SIZE // 2, SIZE // 2), (300, 200), (80, 300), (150, 150)], length=NSTEPS)
+    dft = FrequencyMonitor(g, [2e14, 2.9e14], region=((150, 150), (250, 250)))
+    g.build()
+
+    start = dt.now()
+    g.run(NSTEPS)
+    elapsed = to_msec(dt.now() - start)
+    g.close()
+    return elapsed / NSTEPS, g, probes.data, dft.dft["z"]
+
+def error(value, reference):
+    scale = numpy.abs(reference).max()
+    diff = numpy.abs(value.astype(reference.dtype) - reference)
+    return diff.max() / scale, numpy.sqrt((diff**2).mean()) / scale
+
+if __name__ == '__main__':
+    for update in ('default', 'fused'):
+        ref_time, ref, ref_probes, ref_dft = simulate('double', update)
+        print("update={}, {} steps on {}x{}".format(update, NSTEPS, SIZE, SIZE))
+        print("{:>8s} {:>10s} {:>8s} {:>9s} {:>11s} {:>11s} {:>11s} {:>11s} {:>11s}".format(
+            "dtype", "ms/step", "speedup", "fields MB", "Ez max", "Ez rms", "probes max", "probes rms",
+            "DFT max"))
+        for dtype in ('double', 'single', 'mixed'):
+            time, g, probes, dft = simulate(dtype, update)
+            mb = sum(g.get_field(c)._data.nbytes for c in 'xyz') / 2**20
+            print("{:>8s} {:10.2f} {:8.2f} {:9.1f} {:11.2e} {:11.2e} {:11.2e} {:11.2e} {:11.2e}".format(
+                dtype, time, ref_time / time, mb, *error(g._Fz._data, ref._Fz._data),
+                *error(probes, ref_probes), error(dft, ref_dft)[0]))
@@ -0,0 +1,69 @@
+# Cost of Grid.run called in short pieces (as by Ensemble.step, LiveSolver, Subgrid or headless
+# runs with a small output period) against Grid.step and a single Grid.run, for dipoles and a
+# TFSF box whose pulses are tabulated by chunks of steps. The tables are kept across runs, so
+# run(1) should cost about the same as step: the script exits with an error if it costs more
+# than TOLERANCE times as much, or if the fields differ from the ones of a single run.
+# Run from the repository root with: python -m benchmarks.run_pieces
+
+import sys
+from datetime import datetime as dt
+import numpy
+import engine.solver as FDTD
+import engine.boundaries as bounds
+import engine.sources as sources
+
+SIZE = 100
+NSTEPS = 2000
+TOLERANCE = 1.3
+
+
+def to_msec(x):
+    return x.seconds * 1000 + x.microseconds/1000
+
+def make(case):
+    g = FDTD.Grid(SIZE, SIZE, update='fused')
+    g.set_boundaries(xm=bounds.ABC, xp=bounds.ABC, ym=bounds.ABC, yp=bounds.ABC)
+    if case == "dipoles":
+        for k in range(3):
+            sources.SourceDipole(g, (30 + 20 * k, 50), sources.PulseGaussian(1, 10e-15, 2e-15, 1.2e15 + 3e14 * k))
+    else:
+        sources.SourceTFSF(g, (30, 30), (70, 70), sources.PulseGaussian(1, 10e-15, 2e-15, 1.8e15), phi=0.3)
+    g.build()
+    return g
+
+def timed(case, pieces, repeat=3):
+    """
+    :param pieces: steps per call of run, 0 to call step instead
+    :return: best ms over the repeats for NSTEPS steps, and the final Fz
+    """
+    best = None
+    for r in range(repeat):
+        g = make(case)
+        start = dt.now()
+        if pieces:
+            for k in range(NSTEPS // pieces):
+                g.run(pieces)
+        else:
+            for t in range(NSTEPS):
+                g.step(t)
+        elapsed = to_msec(dt.now() - start)
+        best = elapsed if best is None else min(best, elapsed)
+    return best, g._Fz._data
+
+if __name__ == '__main__':
+    failed = False
+    for case in ("dipoles", "tfsf"):
+        print("{} on a {}x{} grid, {} steps".format(case, SIZE, SIZE, NSTEPS))
+        print("{:>10s} {:>9s} {:>10s} {:>10s}".format("calls", "ms", "vs. step", "fields"))
+        reference = timed(case, NSTEPS)[1]
+        base = None
+        for pieces in (0, 1, 10, NSTEPS):
+            ms, data = timed(case, pieces)
+            base = ms if base is None else base
+            same = numpy.array_equal(data, reference)
+            slow = pieces == 1 and ms > TOLERANCE * base
+            failed |= slow or not same
+            label = "step" if not pieces else "run({})".format(pieces)
+            print("{:>10s} {:9.0f} {:10.2f} {:>10s}{}".format(
+                label, ms, ms / base, "identical" if same else "DIFFERENT", " SLOW" if slow else ""))
+    sys.exit(1 if failed else 0)
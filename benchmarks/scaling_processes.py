@@ -0,0 +1,42 @@
+# Strong scaling of the domain decomposed update engine: fixed grid, growing number of workers.
+# Run from the repository root with: python -m benchmarks.scaling_processes [size] [nsteps]
+
+import multiprocessing
+import sys
+from datetime import datetime as dt
+import numpy
+import engine.solver as FDTD
+import engine.boundaries as bounds
+import engine.materials as materials
+
+
+def to_msec(x):
+    return x.seconds * 1000 + x.microseconds/1000
+
+def bench(size, nsteps, update, workers=None):
+    g = FDTD.Grid(size, size, update=update, workers=workers)
+    g.set_boundaries(xm=bounds.ABC, xp=bounds.ABC, ym=bounds.ABC, yp=bounds.ABC)
+    materials.PassiveMaterial(g, 1.5, (size//4, size//4), (size//2, size//2))
+    g.build()
+    g._Fz._data[:] = numpy.random.RandomState(0).random_sample(g.shape)
+    g.run(1)
+    start = dt.now()
+    g.run(nsteps)
+    rate = nsteps / to_msec(dt.now() - start) * 1000
+    result = g._Fz._data.copy()
+    g.close()
+    return rate, result
+
+if __name__ == '__main__':
+    size = int(sys.argv[1]) if len(sys.argv) > 1 else 4000
+    nsteps = int(sys.argv[2]) if len(sys.argv) > 2 else 20
+
+    serial, ref = bench(size, nsteps, 'fused')
+    print("{}x{} grid, {} steps, serial (fused): {:.2f} steps/s".format(size, size, nsteps, serial))
+    print("{:>8s} {:>10s} {:>9s} {:>11s} {:>10s}".format("workers", "steps/s", "speedup", "efficiency", "identical"))
+    workers = 1
+    while workers <= multiprocessing.cpu_count():
+        rate, result = bench(size, nsteps, 'processes', workers)
+        print("{:8d} {:10.2f} {:9.2f} {:10.0f}% {:>10s}".format(
+            workers, rate, rate / serial, 100 * rate / serial / workers, str(numpy.array_equal(result, ref))))
+        workers *= 2
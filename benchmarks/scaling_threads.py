@@ -0,0 +1,44 @@
+# Scaling of the threaded update engine with the number of threads, for several grid sizes.
+# Run from the repository root with:
+#     python -m benchmarks.scaling_threads [sizes] [workers] [tile rows] [nsteps]
+# e.g. python -m benchmarks.scaling_threads 1000,2000,4000,8000 1,4,8,16,32 64 20
+
+import sys
+from datetime import datetime as dt
+import numpy
+import engine.solver as FDTD
+import engine.boundaries as bounds
+
+
+def to_msec(x):
+    return x.seconds * 1000 + x.microseconds/1000
+
+def bench(size, nsteps, update, workers=None, tile=None):
+    g = FDTD.Grid(size, size, update=update, workers=workers, tile=tile)
+    g.set_boundaries(xm=bounds.ABC, xp=bounds.ABC, ym=bounds.ABC, yp=bounds.ABC)
+    g.build()
+    g._Fz._data[:] = numpy.random.RandomState(0).random_sample(g.shape)
+    g.run(1)
+    start = dt.now()
+    g.run(nsteps)
+    rate = nsteps / to_msec(dt.now() - start) * 1000
+    result = g._Fz._data.copy()
+    g.close()
+    return rate, result
+
+if __name__ == '__main__':
+    sizes = [int(n) for n in sys.argv[1].split(',')] if len(sys.argv) > 1 else [1000, 2000, 4000]
+    workers = [int(n) for n in sys.argv[2].split(',')] if len(sys.argv) > 2 else [1, 2, 4, 8, 16, 32]
+    rows = int(sys.argv[3]) if len(sys.argv) > 3 else 64
+    nsteps = int(sys.argv[4]) if len(sys.argv) > 4 else 20
+
+    print("{:>6s} {:>8s} {:>10s} {:>12s} {:>9s} {:>10s}".format(
+        "size", "threads", "steps/s", "Mcells/s", "speedup", "identical"))
+    for size in sizes:
+        serial, ref = bench(size, nsteps, 'fused')
+        print("{:6d} {:>8s} {:10.2f} {:12.1f} {:9.2f} {:>10s}".format(
+            size, "fused", serial, serial * size**2 / 1e6, 1, "-"))
+        for n in workers:
+            rate, result = bench(size, nsteps, 'threads', n, (rows, size))
+            print("{:6d} {:8d} {:10.2f} {:12.1f} {:9.2f} {:>10s}".format(
+                size, n, rate, rate * size**2 / 1e6, rate / serial, str(numpy.array_equal(result, ref))))
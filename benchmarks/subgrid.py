@@ -0,0 +1,78 @@
+# A layer a fraction of a cell thick, lit by a plane wave, solved on a coarse grid, on the same
+# grid with a refined patch around the layer (engine.subgrid) and on a grid refined everywhere,
+# which is the reference. Errors are on the field scattered by the layer (the difference of the
+# runs with and without it) at probes in front of it, behind it and beside it, relative to the
+# largest scattered value of the reference at each probe.
+# Run from the repository root with: python -m benchmarks.subgrid
+
+from datetime import datetime as dt
+import numpy
+import engine.solver as FDTD
+import engine.boundaries as bounds
+import engine.sources as sources
+import engine.materials as materials
+from engine.monitors import Monitor
+from engine.subgrid import Subgrid
+
+SIZE = 160
+NSTEPS = 900
+FACTOR = 5
+# Layer of index N, THICKNESS fine cells thick, starting at coarse node LAYER
+N = 3.5
+THICKNESS = 3
+LAYER = (85, 60), (85, 100)
+PATCH = (75, 50), (95, 110)
+PROBES = [(5, 80), (120, 80), (85, 130), (40, 40)]
+
+
+def to_msec(x):
+    return x.seconds * 1000 + x.microseconds/1000
+
+def simulate(kind, n):
+    """
+    :param kind: 'coarse', 'subgrid' or 'fine'
+    :param n: index of the layer
+    :return: (ms per coarse step, number of cells, probe records)
+    """
+    f = FACTOR if kind == 'fine' else 1
+    size = (SIZE - 1) * f + 1
+    g = FDTD.Grid(size, size, dx=10e-9 / f, update='fused')
+    g.set_boundaries(xm=bounds.ABC, xp=bounds.ABC, ym=bounds.ABC, yp=bounds.ABC)
+    sources.SourceTFSF(g, (10 * f, 10 * f), (size - 1 - 10 * f, size - 1 - 10 * f),
+                       sources.PulseGaussian(1, 30e-15, 6e-15, 6e14))
+    cells = size ** 2
+    (x0, y0), (x1, y1) = LAYER
+    if kind == 'fine':
+        materials.PassiveMaterial(g, n, (x0 * f, y0 * f), (x0 * f + THICKNESS - 1, y1 * f))
+    elif kind == 'subgrid':
+        sub = Subgrid(g, *PATCH, factor=FACTOR)
+        bleft, tright = sub.to_fine((x0, y0)), sub.to_fine((x0, y1))
+        materials.PassiveMaterial(sub.fine, n, bleft, (bleft[0] + THICKNESS - 1, tright[1]))
+        cells += sub.fine.shape[0] * sub.fine.shape[1]
+    else:
+        # The thinnest layer the coarse grid can hold
+        materials.PassiveMaterial(g, n, (x0, y0), (x0, y1))
+    probes = Monitor(g, points=[(x * f, y * f) for x, y in PROBES], length=NSTEPS * f)
+    g.build()
+
+    start = dt.now()
+    g.run(NSTEPS * f)
+    elapsed = to_msec(dt.now() - start)
+    # The fine grid reaches the times of the coarse steps every f steps
+    return elapsed / NSTEPS, cells, probes.data[f - 1::f]
+
+if __name__ == '__main__':
+    print("Layer of n = {} and {} nm on a {}x{} grid of 10 nm cells, refinement factor {}".format(
+        N, THICKNESS * 10 / FACTOR, SIZE, SIZE, FACTOR))
+    print("{:>8s} {:>9s} {:>14s} {:>9s}   {}".format("grid", "cells", "ms/step", "speedup",
+                                                   "max. rel. error at the probes"))
+    results = {}
+    for kind in ('fine', 'subgrid', 'coarse'):
+        time, cells, with_layer = simulate(kind, N)
+        scattered = with_layer - simulate(kind, 1)[2]
+        results[kind] = time, cells, scattered
+    ref_time, ref_cells, ref = results['fine']
+    for kind, (time, cells, scattered) in results.items():
+        error = numpy.abs(scattered - ref).max(axis=0) / numpy.abs(ref).max(axis=0)
+        print("{:>8s} {:9d} {:14.2f} {:9.1f}   {}".format(
+            kind, cells, time, ref_time / time, " ".join("{:.3f}".format(e) for e in error)))
@@ -0,0 +1,187 @@
+# Benchmark suite of the solver hot paths. Each case is timed for Grid.build, Grid.step (with the
+# time spent in the bulk updates and in each class of step callbacks, through the profiling of
+# Grid) and Grid.run, and reported in steps/s and cells/s. Results can be saved as a baseline and
+# later compared against it, the script exiting with an error if any case got slower than the
+# baseline by more than a tolerance.
+# Run from the repository root with:
+#   python -m benchmarks.suite [--cases 100-pec,500-abc-dipoles] [--update fused] [--repeat 3]
+#                              [--save baseline.json] [--baseline baseline.json] [--tolerance 0.2]
+
+import argparse
+import json
+import platform
+import sys
+import time
+from collections import OrderedDict
+import numpy
+import engine.solver as FDTD
+import engine.boundaries as bounds
+import engine.sources as sources
+import engine.materials as materials
+
+# name: size of the grid, boundaries, TFSF box or not, number of materials, number of dipoles
+CASES = OrderedDict([
+    ("100-pec", dict(size=100, boundary="PEC", tfsf=False, nmaterials=0, dipoles=1)),
+    ("100-abc-tfsf", dict(size=100, boundary="ABC", tfsf=True, nmaterials=0, dipoles=0)),
+    ("500-abc-tfsf", dict(size=500, boundary="ABC", tfsf=True, nmaterials=4, dipoles=1)),
+    ("500-abc-materials", dict(size=500, boundary="ABC", tfsf=False, nmaterials=400, dipoles=1)),
+    ("500-abc-dipoles", dict(size=500, boundary="ABC", tfsf=False, nmaterials=0, dipoles=500)),
+    ("1000-abc-tfsf", dict(size=1000, boundary="ABC", tfsf=True, nmaterials=16, dipoles=5)),
+    ("2000-pec", dict(size=2000, boundary="PEC", tfsf=False, nmaterials=0, dipoles=1)),
+    ("2000-abc-tfsf", dict(size=2000, boundary="ABC", tfsf=True, nmaterials=16, dipoles=5)),
+    ("4000-abc-tfsf", dict(size=4000, boundary="ABC", tfsf=True, nmaterials=16, dipoles=5)),
+])
+
+# Metrics compared against the baseline, and whether larger is better
+METRICS = {"build_s": False, "step_steps_per_s": True, "run_steps_per_s": True}
+# Builds shorter than this are too noisy to be compared (s)
+BUILD_FLOOR = 0.05
+
+
+def make_grid(size, boundary, tfsf, nmaterials, dipoles, update):
+    g = FDTD.Grid(size, size, update=update)
+    side = getattr(bounds, boundary)
+    g.set_boundaries(xm=side, xp=side, ym=side, yp=side)
+
+    rs = numpy.random.RandomState(0)
+    if tfsf:
+        sources.SourceTFSF(g, (size // 10, size // 10), (size - size // 10, size - size // 10),
+                           sources.PulseGaussian(1, 10e-15, 2e-15, 1.257e15))
+    # Grid of non overlapping squares over the central part of the grid
+    n = int(numpy.ceil(numpy.sqrt(nmaterials)))
+    pitch = size // 2 // max(n, 1)
+    for k in range(nmaterials):
+        i, j = divmod(k, n)
+        corner = (size // 4 + i * pitch, size // 4 + j * pitch)
+        materials.PassiveMaterial(g, 1 + rs.random_sample(), corner,
+                                  (corner[0] + pitch // 2, corner[1] + pitch // 2))
+    if dipoles:
+        positions = rs.randint(size // 10, size - size // 10, (dipoles, 2))
+        for position in positions:
+            sources.SourceDipole(g, tuple(position), sources.PulseGaussian(1, 10e-15, 2e-15, 1.8e15))
+    return g
+
+
+def nsteps_for(size):
+    """Number of timed steps, about 2e7 cell updates per case"""
+    return int(min(500, max(10, 2e7 // size**2)))
+
+
+def profile_step(g, nsteps, start):
+    """
+    Time nsteps calls to Grid.step, splitting the time among the bulk updates and the classes of
+    step callbacks (see Grid.enable_profiling)
+    :return: total time (s), dictionary of category -> time (s)
+    """
+    g.enable_profiling()
+    try:
+        for t in range(start, start + nsteps):
+            g.step(t)
+        stats = g.profile_stats()
+    finally:
+        g.disable_profiling()
+    elapsed = stats.pop("step")["total_s"]
+    return elapsed, {name: values["total_s"] for name, values in stats.items()}
+
+
+def bench(case, update, repeat):
+    params = CASES[case]
+    size = params["size"]
+    nsteps = nsteps_for(size)
+
+    g = make_grid(update=update, **params)
+    start = time.perf_counter()
+    g.build()
+    build = time.perf_counter() - start
+
+    # One step for warming up, then the timed steps. The best of the repeats is kept, as the
+    # least disturbed by the rest of the machine
+    g.step(0)
+    done = 1
+    elapsed = run = float('inf')
+    for i in range(repeat):
+        e, t = profile_step(g, nsteps, done)
+        if e < elapsed:
+            elapsed, totals = e, t
+        done += nsteps
+        start = time.perf_counter()
+        g.run(nsteps)
+        run = min(run, time.perf_counter() - start)
+        done += nsteps
+    g.close()
+
+    return OrderedDict([
+        ("size", size),
+        ("nsteps", nsteps),
+        ("build_s", build),
+        ("step_steps_per_s", nsteps / elapsed),
+        ("run_steps_per_s", nsteps / run),
+        ("run_cells_per_s", nsteps * size**2 / run),
+        ("ms_per_step", OrderedDict((k, v / nsteps * 1000) for k, v in sorted(totals.items()))),
+    ])
+
+
+def compare(results, baseline, tolerance):
+    """
+    :return: list of (case, metric, value, reference) for the metrics worse than the baseline
+        by more than the tolerance
+    """
+    regressions = []
+    for case, result in results.items():
+        reference = baseline.get("cases", {}).get(case)
+        if reference is None:
+            continue
+        for metric, higher in METRICS.items():
+            value, ref = result[metric], reference[metric]
+            if metric == "build_s" and max(value, ref) < BUILD_FLOOR:
+                continue
+            ratio = value / ref if higher else ref / value
+            if ratio < 1 - tolerance:
+                regressions.append((case, metric, value, ref))
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark suite of the FDTD solver")
+    parser.add_argument("--cases", default=None, help="comma separated cases (default: all)")
+    parser.add_argument("--update", default="default", help="update engine")
+    parser.add_argument("--save", default=None, help="write the results to a baseline file")
+    parser.add_argument("--baseline", default=None, help="baseline file to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="allowed relative slowdown")
+    parser.add_argument("--repeat", type=int, default=3, help="timings per case, the best is kept")
+    args = parser.parse_args(argv)
+
+    cases = args.cases.split(",") if args.cases else list(CASES)
+    for case in cases:
+        if case not in CASES:
+            raise Exception("Error: unknown case {}, available: {}".format(case, ", ".join(CASES)))
+
+    print("{:>18s} {:>7s} {:>9s} {:>11s} {:>11s} {:>12s}".format(
+        "case", "steps", "build (s)", "step (st/s)", "run (st/s)", "run (cell/s)"))
+    results = OrderedDict()
+    for case in cases:
+        result = results[case] = bench(case, args.update, args.repeat)
+        print("{:>18s} {:7d} {:9.3f} {:11.1f} {:11.1f} {:12.3e}".format(
+            case, result["nsteps"], result["build_s"], result["step_steps_per_s"],
+            result["run_steps_per_s"], result["run_cells_per_s"]))
+        for name, ms in result["ms_per_step"].items():
+            print("{:>18s}   {:<28s} {:9.3f} ms/step".format("", name, ms))
+
+    if args.save:
+        with open(args.save, "w") as f:
+            json.dump({"update": args.update, "machine": platform.platform(), "numpy": numpy.__version__,
+                       "cases": results}, f, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline, args.tolerance)
+        for case, metric, value, ref in regressions:
+            print("REGRESSION {} {}: {:.4g} (baseline {:.4g})".format(case, metric, value, ref))
+        if regressions:
+            sys.exit(1)
+        print("No regression against {} (tolerance {:.0%})".format(args.baseline, args.tolerance))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,48 @@
+# Leakage of the TFSF box for several directions of propagation. Without any scatterer the field
+# outside of the box should vanish: the table gives the largest field ever seen outside of the
+# box relative to the largest one inside, and the time per step.
+# Run from the repository root with: python -m benchmarks.tfsf_leakage
+
+import functools
+from datetime import datetime as dt
+import numpy
+import engine.solver as FDTD
+import engine.boundaries as bounds
+import engine.sources as sources
+
+SIZE = 240
+BOX = (70, 170)
+NSTEPS = 700
+
+
+def to_msec(x):
+    return x.seconds * 1000 + x.microseconds/1000
+
+def leakage(phi):
+    g = FDTD.Grid(SIZE, SIZE, update='fused')
+    pml = functools.partial(bounds.CPML, thickness=20)
+    g.set_boundaries(xm=pml, xp=pml, ym=pml, yp=pml)
+    sources.SourceTFSF(g, (BOX[0], BOX[0]), (BOX[1], BOX[1]),
+                       sources.PulseGaussian(1, 10e-15, 2e-15, 1.257e15), phi=phi)
+    g.build()
+
+    inside = numpy.zeros(g.shape, dtype=bool)
+    inside[BOX[0]:BOX[1] + 1, BOX[0]:BOX[1] + 1] = True
+    # Scattered field region, away from the PML
+    outside = ~inside
+    outside[:25] = outside[-25:] = outside[:, :25] = outside[:, -25:] = False
+
+    e_in = e_out = 0.
+    start = dt.now()
+    for i in range(NSTEPS):
+        g.step(i)
+        ez = numpy.abs(g._Fz._data)
+        e_in = max(e_in, ez[inside].max())
+        e_out = max(e_out, ez[outside].max())
+    return e_out / e_in, to_msec(dt.now() - start) / NSTEPS
+
+if __name__ == '__main__':
+    print("{:>8s} {:>14s} {:>10s} {:>12s}".format("phi (deg)", "leakage", "(dB)", "ms/step"))
+    for deg in (0, 15, 30, 45, 60, 90, 135, 180, 225, 300):
+        ratio, time = leakage(numpy.radians(deg))
+        print("{:9d} {:14.2e} {:10.1f} {:12.2f}".format(deg, ratio, 20 * numpy.log10(ratio), time))
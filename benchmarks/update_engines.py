@@ -0,0 +1,44 @@
+# Benchmark of the bulk update engines of Grid, in steps per second.
+# Run from the repository root with: python -m benchmarks.update_engines
+
+from datetime import datetime as dt
+import numpy
+import engine.solver as FDTD
+import engine.boundaries as bounds
+import engine.materials as materials
+from engine.updates import UPDATES
+
+
+def to_msec(x):
+    return x.seconds * 1000 + x.microseconds/1000
+
+def make_grid(size, update):
+    g = FDTD.Grid(size, size, update=update)
+    g.set_boundaries(xm=bounds.PEC, xp=bounds.PEC, ym=bounds.PEC, yp=bounds.PEC)
+    materials.PassiveMaterial(g, 1.5, (size//4, size//4), (size//2, size//2))
+    g.build()
+    # Some non trivial initial field
+    g._Fz._data[:] = numpy.random.RandomState(0).random_sample(g.shape)
+    return g
+
+def bench(size, update, nsteps):
+    g = make_grid(size, update)
+    # The field is copied out, as closing the parallel engines releases their shared memory
+    try:
+        g.step(0)
+        start = dt.now()
+        for i in range(1, nsteps + 1):
+            g.step(i)
+        return nsteps / to_msec(dt.now() - start) * 1000, g._Fz._data.copy()
+    finally:
+        g.close()
+
+if __name__ == '__main__':
+    nsteps = 50
+    print("{:>6s} {:>10s} {:>12s} {:>9s} {:>12s}".format("size", "update", "steps/s", "speedup", "max. diff."))
+    for size in (200, 800, 2000):
+        results = {update: bench(size, update, nsteps) for update in UPDATES}
+        ref_rate, ref = results['default']
+        for update, (rate, data) in results.items():
+            diff = numpy.abs(data - ref).max()
+            print("{:6d} {:>10s} {:12.1f} {:9.2f} {:12.2e}".format(size, update, rate, rate / ref_rate, diff))
@@ -15,46 +15,315 @@ class PEC(Boundary):
     def __call__(self, *args):
         pass
 
+    @classmethod
+    def batch(cls, bounds, grid, start, nsteps):
+        # Nothing to do at every step, the terminating nodes are never updated
+        return None
+
 class ABC(Boundary):
     """
     Differential equation based absorbing boundary conditions (ABC)
     cf. http://www.eecs.wsu.edu/~schneidj/ufdtd/chap6.pdf eq. 6.32-33
+    All the ABC sides of a grid are updated together by an _ABCGroup.
     """
     def __init__(self, grid, side):
+        if side not in ('xm', 'xp', 'ym', 'yp'):
+            raise Exception("Unrecognised side {}".format(side))
+        self.side = side
 
-        Boundary.__init__(self, grid, side)
+        group = getattr(grid, '_abc', None)
+        if group is None or group.grid is not grid:
+            group = grid._abc = _ABCGroup(grid)
+        group.add(self)
+
+    def __call__(self, *args):
+        raise Exception("Error: ABC sides are updated by the _ABCGroup of their grid")
+
+    def nodes(self, shape, skip=(0, 0)):
+        """
+        Flat indices in the Fz array of the boundary nodes and of the two rows next to them
+        :param shape: shape of Fz
+        :param skip: number of nodes left out at the start and at the end of the side, e.g. those
+            within the CPML of an adjacent side, which must stay PEC
+        :return: array of shape (3, size)
+        """
+        sx, sy = shape
+        if self.side[0] == 'x':
+            along = numpy.arange(skip[0], sy - skip[1])
+        else:
+            along = numpy.arange(skip[0], sx - skip[1])
+        n = len(along)
+        if self.side == 'xm':
+            rows = [(numpy.full(n, i), along) for i in (0, 1, 2)]
+        elif self.side == 'xp':
+            rows = [(numpy.full(n, sx - 1 - i), along) for i in (0, 1, 2)]
+        elif self.side == 'ym':
+            rows = [(along, numpy.full(n, i)) for i in (0, 1, 2)]
+        else:
+            rows = [(along, numpy.full(n, sy - 1 - i)) for i in (0, 1, 2)]
+        return numpy.array([numpy.ravel_multi_index(r, shape) for r in rows])
+
+
+class _ABCGroup(object):
+    """
+    Batched update of all the ABC sides of a grid. The two steps of history needed by the ABC are
+    kept in a preallocated (2, 3, size) ring buffer indexed by the parity of the step, and the
+    update makes no allocation.
+    Sides are updated in stages of consecutive sides along the same axis (e.g. xm and xp, then ym
+    and yp), each stage being one vectorized operation, so that the corner nodes get the same
+    values as with the sides updated one after the other.
+    """
+    def __init__(self, grid):
+        self.grid = grid
+        self.sides = []
         t1 = grid.C
         t2 = 1. / t1 + 2. + t1
         self._coef0 = - (1. / t1 - 2. + t1) / t2
         self._coef1 = - 2. * (t1 - 1. / t1) / t2
         self._coef2 = 4. * (t1 + 1. / t1) / t2
+        grid.register_step_callback('post', 'e', self)
+        grid.register_build_callback(self.build)
+
+    def add(self, side):
+        self.sides.append(side)
+
+    def build(self, grid):
+        data = grid._Fz._data
+        # The ABC is unstable within the layer of an adjacent CPML
+        layers = getattr(grid, '_cpml', None) or {}
+
+        stages = []
+        for side in self.sides:
+            axis = side.side[0]
+            if stages and stages[-1][0] == axis:
+                stages[-1][1].append(side)
+            else:
+                stages.append((axis, [side]))
+
+        index = []
+        for axis, sides in stages:
+            across = ('ym', 'yp') if axis == 'x' else ('xm', 'xp')
+            skip = tuple(layers.get(side, 0) for side in across)
+            index.append(numpy.concatenate([s.nodes(data.shape, skip) for s in sides], axis=1))
+        self._prepare(data.reshape(-1), index)
+
+    @classmethod
+    def stack(cls, groups, data):
+        """
+        Single group updating the ABC sides of a stack of grids (e.g. the members of an
+        Ensemble) in one go
+        :param groups: built groups of the grids, with sides along the same axes in the same order
+        :param data: stacked Fz array, of shape (len(groups), sx, sy)
+        :return: _ABCGroup object
+        """
+        stacked = cls.__new__(cls)
+        stacked.grid = None
+        stacked.sides = [side for group in groups for side in group.sides]
+        stacked._coef0, stacked._coef1, stacked._coef2 = groups[0]._coef0, groups[0]._coef1, groups[0]._coef2
+
+        size = data[0].size
+        index = [numpy.concatenate([group._index[:, st] + k * size for k, group in enumerate(groups)], axis=1)
+                 for st in groups[0]._stages]
+        stacked._prepare(data.reshape(-1), index)
+        return stacked
+
+    def _prepare(self, flat, index):
+        """
+        Allocate the history and the views used at every step
+        :param flat: flat view of the Fz array
+        :param index: flat indices of the nodes of each stage, arrays of shape (3, size)
+        """
+        self._flat = flat
+        self._index = numpy.concatenate(index, axis=1)
+        bounds = numpy.cumsum([0] + [i.shape[1] for i in index])
+        self._stages = [slice(a, b) for a, b in zip(bounds[:-1], bounds[1:])]
+        size = self._index.shape[1]
+
+        self._history = numpy.zeros((2, 3, size), dtype=flat.dtype)
+        self._parity = 0
+        real = numpy.zeros((2, size), dtype=flat.dtype)
+        update = numpy.zeros(size, dtype=flat.dtype)
+        tmp = numpy.zeros(size, dtype=flat.dtype)
+
+        # Views used at every step, for each parity of the step and each stage
+        self._plans = []
+        for parity in (0, 1):
+            new, old = self._history[parity], self._history[1 - parity]
+            self._plans.append([
+                (self._index[0, st].copy(), self._index[1, st].copy(), self._index[2, st].copy(),
+                 real[0, st], real[1, st], update[st], tmp[st],
+                 new[0, st], new[1, st], new[2, st], old[0, st], old[1, st], old[2, st])
+                for st in self._stages
+            ])
+
+    def __call__(self, *args):
+        flat = self._flat
+        c0, c1, c2 = self._coef0, self._coef1, self._coef2
+        for i0, i1, i2, r1, r2, u, tmp, new0, new1, new2, old0, old1, old2 in self._plans[self._parity]:
+            numpy.take(flat, i1, out=r1, mode='clip')
+            numpy.take(flat, i2, out=r2, mode='clip')
 
+            numpy.add(r2, old0, out=u)
+            numpy.multiply(u, c0, out=u)
+            numpy.add(new0, new2, out=tmp)
+            numpy.subtract(tmp, r1, out=tmp)
+            numpy.subtract(tmp, old1, out=tmp)
+            numpy.multiply(tmp, c1, out=tmp)
+            numpy.add(u, tmp, out=u)
+            numpy.multiply(new1, c2, out=tmp)
+            numpy.add(u, tmp, out=u)
+            numpy.subtract(u, old2, out=u)
+
+            # The oldest step of history becomes the newest
+            old0[...] = u
+            old1[...] = r1
+            old2[...] = r2
+            numpy.put(flat, i0, u, mode='clip')
+        self._parity = 1 - self._parity
+
+    def get_state(self):
+        return {"history": self._history, "parity": numpy.array(self._parity)}
+
+    def set_state(self, state):
+        self._history[...] = state["history"]
+        self._parity = int(state["parity"])
+
+class CPML(Boundary):
+    """
+    Convolutional perfectly matched layer (CPML), terminated by a PEC wall. The nodes of an
+    adjacent ABC side within the layer are left PEC, as the ABC is unstable there, which makes
+    the absorption of waves running along the layer poorer than with CPML on all the sides.
+    The stretched coordinate derivatives are applied as corrections to the bulk updates, with the
+    auxiliary psi arrays only allocated and updated over the layer.
+    cf. Roden and Gedney, Microw. Opt. Technol. Lett. 27, 334 (2000)
+    Use e.g. functools.partial(CPML, thickness=20) to change the parameters of the layer.
+    """
+    def __init__(self, grid, side, thickness=10, order=3, sigma_factor=1., kappa_max=1., alpha_max=0.):
+        """
+        :param grid: FDTDPoC.engine.solver.Grid object
+        :param side: one of 'xm', 'xp', 'ym', 'yp'
+        :param thickness: number of cells of the layer
+        :param order: order of the polynomial grading of sigma and kappa
+        :param sigma_factor: maximum conductivity relative to the optimal 0.8 (order + 1) / (Z0 dx)
+        :param kappa_max: maximum of the real coordinate stretching
+        :param alpha_max: maximum of the complex frequency shift (S/m), linearly graded to zero
+        """
+        Boundary.__init__(self, grid, side)
+        grid.register_step_callback('post', 'h', self.step_h)
+        grid.register_build_callback(self.build)
+        # Thickness of the layers of the grid, for the ABCs of the adjacent sides
+        layers = getattr(grid, '_cpml', None)
+        if layers is None:
+            layers = grid._cpml = {}
+        layers[side] = thickness
+
+        if side not in ('xm', 'xp', 'ym', 'yp'):
+            raise Exception("Unrecognised side {}".format(side))
+        self.side = side
+        self.thickness = thickness
+        self.order = order
+        self.sigma_factor = sigma_factor
+        self.kappa_max = kappa_max
+        self.alpha_max = alpha_max
+
+        # Work along the first axis: for y sides use the transposed fields, where Hx plays the
+        # role of Hy with the opposite sign
         if 'x' in side:
-            size = grid.shape[1]
-        elif 'y' in side:
-            size = grid.shape[0]
+            self._e, self._h, sign = grid._Fz._data, grid._Fy._data, 1.
         else:
-            raise Exception("Unrecognised side {}".format(side))
+            self._e, self._h, sign = grid._Fz._data.T, grid._Fx._data.T, -1.
+
+        N = thickness
+        last = self._e.shape[0] - 1
+        if side[1] == 'm':
+            self._hrows = slice(0, N)
+            self._erows = slice(1, N)
+            hdepth = (N - (numpy.arange(0, N) + 0.5)) / N
+            edepth = (N - numpy.arange(1, N)) / N
+        else:
+            self._hrows = slice(last - N, last)
+            self._erows = slice(last - N + 1, last)
+            hdepth = (numpy.arange(last - N, last) + 0.5 - (last - N)) / N
+            edepth = (numpy.arange(last - N + 1, last) - (last - N)) / N
 
-        self._auxfield = [numpy.zeros((3, size))] * 2
+        # dt / eps0 in units of dx, see the coefficients of Field.step
+        dt_eps0 = grid.C * grid.Z0 * grid.dx
+        self._hcoef = self._coefficients(grid, hdepth, dt_eps0)
+        self._ecoef = self._coefficients(grid, edepth, dt_eps0)
+        self._sign = sign
+        self._hsign = sign * grid.C / grid.Z0
+        self._esign = sign * grid.C * grid.Z0
 
-        if side == 'xm':
-            self._realfield = grid._Fz._data[0:3,:]
-        elif side == 'xp':
-            self._realfield = grid._Fz._data[-1:-4:-1,:]
-        elif side == 'ym':
-            self._realfield = numpy.transpose(grid._Fz._data[:,0:3])
-        elif side == 'yp':
-            self._realfield = numpy.transpose(grid._Fz._data[:,-1:-4:-1])
+        width = self._e.shape[1]
+        dtype = grid.dtype
+        self._psi_h = numpy.zeros((len(hdepth), width), dtype=dtype)
+        self._psi_e = numpy.zeros((len(edepth), width - 2), dtype=dtype)
+        self._dh = numpy.zeros(self._psi_h.shape, dtype=dtype)
+        self._th = numpy.zeros(self._psi_h.shape, dtype=dtype)
+        self._de = numpy.zeros(self._psi_e.shape, dtype=dtype)
+        self._te = numpy.zeros(self._psi_e.shape, dtype=dtype)
 
-    def __call__(self, *args):
-        update = (
-            self._coef0 * (self._realfield[2,:] + self._auxfield[1][0,:]) +
-            self._coef1 * (self._auxfield[0][0,:] + self._auxfield[0][2,:] - self._realfield[1,:] - self._auxfield[1][1,:]) +
-            self._coef2 * self._auxfield[0][1,:] -
-            self._auxfield[1][2,:]
-        )
-        self._auxfield.pop()
-        self._auxfield.insert(0, numpy.array([update, self._realfield[1,:].copy(), self._realfield[2,:].copy()]))
-
-        self._realfield[0,:] = update
+    def _coefficients(self, grid, depth, dt_eps0):
+        grading = depth**self.order
+        sigma = self.sigma_factor * 0.8 * (self.order + 1) / (grid.Z0 * grid.dx) * grading
+        kappa = 1. + (self.kappa_max - 1.) * grading
+        alpha = self.alpha_max * (1. - depth)
+        b = numpy.exp(-(sigma / kappa + alpha) * dt_eps0)
+        with numpy.errstate(invalid='ignore', divide='ignore'):
+            a = numpy.where(sigma > 0, sigma / (sigma * kappa + kappa**2 * alpha) * (b - 1.), 0.)
+        return tuple(c[:, None].astype(grid.dtype) for c in (b, a, 1. / kappa - 1.))
+
+    def build(self, grid):
+        epsr = grid._epsr.T if 'y' in self.side else grid._epsr
+        if grid.polarization == 'tm':
+            # Coefficients of the dual updates (see Grid._bake_coefficients): -C Z0 / epsr on the
+            # nodes of the in-plane E component, -C / Z0 for Hz
+            rows = self._hrows
+            edges = (epsr[rows] + epsr[rows.start + 1:rows.stop + 1]) / 2
+            self._hsign = (-self._sign * grid.C * grid.Z0 / edges).astype(grid.dtype)
+            self._ce = -self._sign * grid.C / grid.Z0
+            return
+        self._ce = (self._esign / epsr[self._erows, 1:-1]).astype(grid.dtype)
+
+    def step_h(self, t):
+        rows = self._hrows
+        b, a, kinv = self._hcoef
+        d, tmp, psi = self._dh, self._th, self._psi_h
+        e, h = self._e, self._h
+
+        numpy.subtract(e[rows.start + 1:rows.stop + 1], e[rows], out=d)
+        numpy.multiply(psi, b, out=psi)
+        numpy.multiply(d, a, out=tmp)
+        numpy.add(psi, tmp, out=psi)
+        if self.kappa_max != 1.:
+            numpy.multiply(d, kinv, out=d)
+            numpy.add(d, psi, out=tmp)
+        else:
+            tmp[...] = psi
+        numpy.multiply(tmp, self._hsign, out=tmp)
+        numpy.add(h[rows], tmp, out=h[rows])
+
+    def __call__(self, t):
+        rows = self._erows
+        b, a, kinv = self._ecoef
+        d, tmp, psi = self._de, self._te, self._psi_e
+        e, h = self._e, self._h
+
+        numpy.subtract(h[rows, 1:-1], h[rows.start - 1:rows.stop - 1, 1:-1], out=d)
+        numpy.multiply(psi, b, out=psi)
+        numpy.multiply(d, a, out=tmp)
+        numpy.add(psi, tmp, out=psi)
+        if self.kappa_max != 1.:
+            numpy.multiply(d, kinv, out=d)
+            numpy.add(d, psi, out=tmp)
+        else:
+            tmp[...] = psi
+        numpy.multiply(tmp, self._ce, out=tmp)
+        numpy.add(e[rows, 1:-1], tmp, out=e[rows, 1:-1])
+
+    def get_state(self):
+        return {"psi_h": self._psi_h, "psi_e": self._psi_e}
+
+    def set_state(self, state):
+        self._psi_h[...] = state["psi_h"]
+        self._psi_e[...] = state["psi_e"]
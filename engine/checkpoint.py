@@ -0,0 +1,155 @@
+############################################################
+# Checkpoint/restart of the solver state                   #
+#                                                          #
+############################################################
+#           Copyright (c) 2018 Stefano Guazzotti           #
+############################################################
+
+"""
+A checkpoint is a directory holding one .npy file per array of the solver state and a
+checkpoint.json file with the step counters and the list of arrays. Arrays are written straight
+from the live buffers and read back memory mapped, so neither direction makes extra copies.
+
+Besides the fields, the state of every step callback providing get_state/set_state methods
+(e.g. ABC boundaries, TFSF boxes, monitors) is saved. Callbacks are matched by their position in
+the schedule of the grid, so a checkpoint can only be loaded into a grid set up like the one
+that wrote it.
+"""
+
+import json
+import os
+import shutil
+import threading
+import numpy
+
+
+def _stateful(grid):
+    objects = []
+    for phase in grid._schedule:
+        for callback in phase:
+            if hasattr(callback, 'get_state') and all(callback is not o for o in objects):
+                objects.append(callback)
+    return objects
+
+
+def get_state(grid):
+    """
+    Collect the state of a built grid
+    :param grid: FDTDPoC.engine.solver.Grid object
+    :return: (metadata, arrays) with arrays a dictionary of numpy arrays (not copies)
+    """
+    arrays = {
+        "Fx": grid._Fx._data,
+        "Fy": grid._Fy._data,
+        "Fz": grid._Fz._data,
+        "epsr": grid._epsr,
+    }
+    kinds = []
+    for i, obj in enumerate(_stateful(grid)):
+        kinds.append(type(obj).__name__)
+        for name, value in obj.get_state().items():
+            arrays["{}.{}".format(i, name)] = value
+
+    metadata = {
+        "shape": [int(n) for n in grid.shape],
+        "dx": float(grid.dx),
+        "polarization": grid.polarization,
+        "time": int(grid.time),
+        "next": int(grid._next),
+        "callbacks": kinds,
+        "arrays": sorted(arrays.keys()),
+    }
+    return metadata, arrays
+
+
+def set_state(grid, arrays, objects=None):
+    """
+    Restore into a built grid the arrays collected by get_state from a grid set up like it
+    :param grid: FDTDPoC.engine.solver.Grid object
+    :param arrays: dictionary of numpy arrays, as returned by get_state
+    :param objects: stateful step callbacks of the grid, looked up if None
+    """
+    # Copy into the existing buffers, as sources and boundaries hold views of them
+    grid._Fx._data[...] = arrays["Fx"]
+    grid._Fy._data[...] = arrays["Fy"]
+    grid._Fz._data[...] = arrays["Fz"]
+    grid._epsr[...] = arrays["epsr"]
+
+    for i, obj in enumerate(_stateful(grid) if objects is None else objects):
+        prefix = "{}.".format(i)
+        obj.set_state({name[len(prefix):]: value for name, value in arrays.items() if name.startswith(prefix)})
+    # The restored fields may be nonzero anywhere
+    if grid._active is not None:
+        grid._active.fill()
+
+
+def _write(path, metadata, arrays):
+    tmp = path + ".tmp"
+    if os.path.exists(tmp):
+        shutil.rmtree(tmp)
+    os.makedirs(tmp)
+    for name, value in arrays.items():
+        numpy.save(os.path.join(tmp, name + ".npy"), value)
+    with open(os.path.join(tmp, "checkpoint.json"), "w") as f:
+        json.dump(metadata, f, indent=2)
+
+    # Replace the previous checkpoint only once the new one is complete
+    if os.path.exists(path):
+        old = path + ".old"
+        if os.path.exists(old):
+            shutil.rmtree(old)
+        os.rename(path, old)
+        os.rename(tmp, path)
+        shutil.rmtree(old)
+    else:
+        os.rename(tmp, path)
+
+
+def save(grid, path, background=False, extra=None):
+    """
+    Write a checkpoint of a built grid
+    :param grid: FDTDPoC.engine.solver.Grid object
+    :param path: checkpoint directory. An existing checkpoint is replaced atomically
+    :param background: copy the state in memory and write it from a separate thread, so that
+        the time loop can go on in the meantime
+    :param extra: JSON serialisable data stored along with the checkpoint
+    :return: the writing thread if background, None otherwise
+    """
+    metadata, arrays = get_state(grid)
+    metadata["extra"] = extra
+    if not background:
+        _write(path, metadata, arrays)
+        return None
+
+    arrays = {name: numpy.array(value) for name, value in arrays.items()}
+    thread = threading.Thread(target=_write, args=(path, metadata, arrays))
+    thread.start()
+    return thread
+
+
+def load(grid, path):
+    """
+    Restore a checkpoint into a built grid, set up as the one that wrote it
+    :param grid: FDTDPoC.engine.solver.Grid object
+    :param path: checkpoint directory
+    :return: the extra data stored with the checkpoint
+    """
+    with open(os.path.join(path, "checkpoint.json")) as f:
+        metadata = json.load(f)
+
+    if tuple(metadata["shape"]) != tuple(grid.shape):
+        raise Exception("Error: checkpoint of a {} grid cannot be loaded into a {} one".format(
+            tuple(metadata["shape"]), tuple(grid.shape)))
+    # Checkpoints written before TM support are TE
+    if metadata.get("polarization", "te") != grid.polarization:
+        raise Exception("Error: checkpoint of a {} grid cannot be loaded into a {} one".format(
+            metadata.get("polarization", "te").upper(), grid.polarization.upper()))
+    objects = _stateful(grid)
+    if metadata["callbacks"] != [type(obj).__name__ for obj in objects]:
+        raise Exception("Error: step callbacks of {} do not match the checkpoint {}".format(grid, path))
+
+    set_state(grid, {name: numpy.load(os.path.join(path, name + ".npy"), mmap_mode="r")
+                     for name in metadata["arrays"]}, objects)
+    grid.time = metadata["time"]
+    grid._next = metadata["next"]
+    return metadata["extra"]
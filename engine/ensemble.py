@@ -0,0 +1,376 @@
+############################################################
+# Batched stepping of many small grids                     #
+#                                                          #
+############################################################
+#           Copyright (c) 2018 Stefano Guazzotti           #
+############################################################
+
+"""
+An Ensemble steps N grids of identical shape as a single stack of (N, sx, sy) field arrays, by
+blocks of members small enough for their fields to stay in cache: each block goes through the
+whole run, with one vectorized bulk update per half step for all of its members, before the next
+one. The members are ordinary Grid objects, set up as usual, whose fields become views into the
+stacks:
+
+    members = []
+    for n in indices:
+        g = Grid(100, 100)
+        g.set_boundaries(xm=ABC, xp=ABC, ym=ABC, yp=ABC)
+        SourceDipole(g, (30, 50), PulseGaussian(...))
+        PassiveMaterial(g, n, (60, 40), (70, 60))
+        members.append(g)
+    ensemble = Ensemble(members)
+    ensemble.build()
+    ensemble.run(1000)
+
+Each member has its own materials (and so its own epsr map), sources and pulse parameters, but
+all the members must be set up alike: same boundaries and same classes of step callbacks, in the
+same order (only the phases with dipoles or ABCs need to match exactly). Dipoles and ABCs of the
+members of a block are updated together, any other step callback runs member by member (through
+its batch classmethod if it has one), on the views of its member.
+
+Members may have different polarizations: Ensemble.unpolarized(setup, ...) gives the Ensemble of
+a TE and a TM grid set up alike, whose six field components are updated in the same passes.
+"""
+
+import numpy
+from engine.boundaries import PEC, _ABCGroup
+from engine.solver import Grid
+from engine.sources import Source, SourceDipole
+from engine.updates import Update, fused_e, fused_h
+
+
+class _MemberUpdate(Update):
+    """
+    Placeholder engine of the members of an Ensemble, handing out views into the stacked
+    field arrays. Members are only stepped through the ensemble
+    """
+    def __init__(self, grid, ensemble, k):
+        super().__init__(grid)
+        self.ensemble = ensemble
+        self.k = k
+        self._given = set()
+
+    def zeros(self, shape):
+        if shape in self._given:
+            return super().zeros(shape)
+        self._given.add(shape)
+        return self.ensemble._stack(shape)[self.k]
+
+    def step_h(self, t):
+        raise Exception("Error: members of an Ensemble are stepped through the ensemble")
+
+    step_e = step_h
+
+
+def _dipoles(groups, block, start, nsteps):
+    """
+    Single scatter-add per step for the dipoles of all the members of a block, with the pulses
+    tabulated for the whole run
+    """
+    data = block._stack(block.shape)
+    flat = data.reshape(-1)
+    index = numpy.concatenate([
+        numpy.ravel_multi_index((numpy.full(len(group), k),) + tuple(zip(*(d.position for d in group))), data.shape)
+        for k, group in enumerate(groups)
+    ])
+    samples = Source.samples([d for group in groups for d in group])
+
+    def inject(t):
+        numpy.add.at(flat, index, samples[t])
+
+    return inject
+
+
+def _abc(groups, block, start, nsteps):
+    return block._abc
+
+
+def _pec(groups, block, start, nsteps):
+    return None
+
+
+# Step callbacks updated across all the members of a block at once. Functions of (groups, block,
+# start, nsteps), groups being the list of the callbacks of each member of the _Block, returning
+# a callable of the step index, or None if there is nothing to do
+BATCHES = {
+    SourceDipole: _dipoles,
+    _ABCGroup: _abc,
+    PEC: _pec,
+}
+
+
+class Ensemble(object):
+    """
+    Stack of grids with the same shape and mesh, stepped together by blocks of members. The bulk
+    updates go through the kernels of FusedUpdate, and give the same results
+    """
+    @classmethod
+    def unpolarized(cls, setup, *args, **kwargs):
+        """
+        TE and TM on the same geometry, stepped together. The two polarizations are updated in
+        the same vectorized passes for grids small enough to share a block (see block in
+        Ensemble.__init__), one run after the other for larger ones
+        :param setup: function of a grid adding its boundaries, sources, materials and monitors.
+            It is called once for each polarization
+        :param args, kwargs: arguments of the Grid constructor, but the polarization
+        :return: Ensemble of the TE and of the TM grid, in this order
+        """
+        members = []
+        for polarization in ('te', 'tm'):
+            grid = Grid(*args, polarization=polarization, **kwargs)
+            setup(grid)
+            members.append(grid)
+        return cls(members)
+
+    def __init__(self, members, block=None):
+        """
+        :param members: FDTDPoC.engine.solver.Grid objects, not built yet
+        :param block: number of members stepped together. Each block goes through a whole run
+            before the next one, with one call of the bulk update kernels per half step, so
+            that its fields stay in cache over the run. By default blocks of about 64k nodes,
+            the fastest in benchmarks.ensemble from 32x32 to 100x100 grids
+        """
+        if not members:
+            raise Exception("Error: an Ensemble needs at least one member")
+        self.members = list(members)
+        self.shape = self.members[0].shape
+        self.block = block or max(1, 2**16 // (self.shape[0] * self.shape[1]))
+        for grid in self.members:
+            if grid.shape != self.shape or grid.dx != self.members[0].dx:
+                raise Exception("Error: members of an Ensemble must have the same shape and dx")
+            if getattr(grid, '_built', False):
+                raise Exception("Error: members of an Ensemble must not be built")
+            if grid.dtype != self.members[0].dtype:
+                raise Exception("Error: members of an Ensemble must have the same precision")
+
+        self._stacks = {}
+        for k, grid in enumerate(self.members):
+            grid._update = _MemberUpdate(grid, self, k)
+
+    def __repr__(self):
+        return "{}({} x Grid(sizex={}, sizey={}))".format("Ensemble", len(self.members), *self.shape)
+
+    def _stack(self, shape):
+        if shape not in self._stacks:
+            self._stacks[shape] = numpy.zeros((len(self.members),) + shape, dtype=self.members[0].dtype)
+        return self._stacks[shape]
+
+    def get_field(self, comp):
+        """
+        :param comp: component of the field, 'x', 'y' or 'z'
+        :return: stacked array of the component over all the members
+        """
+        return self._stack(self.members[0].get_field(comp)._data.shape)
+
+    def build(self):
+        for grid in self.members:
+            grid.build()
+
+        first = self.members[0]
+        self._ez, self._hx, self._hy = (self.get_field(comp) for comp in 'zxy')
+        _Block(self, 0, len(self.members))._layout()
+        # Members with the same geometry share a single permittivity map
+        for grid in self.members[1:]:
+            if numpy.array_equal(grid._epsr, first._epsr):
+                grid._epsr = first._epsr
+
+        # Coefficients of the bulk updates, stacked over the members unless the same scalar for
+        # all of them. The members then use views into the stacks
+        inner = tuple(n - 2 for n in self.shape)
+        shapes = (self._hx.shape[1:], self._hy.shape[1:])
+        self._ch = self._coefficients("_ch", shapes, 1.)
+        self._cha = self._coefficients("_cha", shapes, 1.)
+        self._ce = self._coefficients("_cb", inner, 1.)
+        self._ca = self._coefficients("_ca", inner, 1.)
+        self._buf = numpy.empty(2 * min(self.block, len(self.members)) * self._ez[0].size, dtype=self._ez.dtype)
+        self._blocks = [_Block(self, k, min(k + self.block, len(self.members)))
+                        for k in range(0, len(self.members), self.block)]
+        for block in self._blocks:
+            block.build()
+
+        self.time = 0
+        self._next = 0
+
+    def _coefficients(self, name, shape, default):
+        """
+        Gather a coefficient of the bulk updates of the members (see Grid._bake_coefficients).
+        Arrays, or pairs of arrays, are stacked and the members then use views into the stacks
+        :param name: attribute of the grids
+        :param shape: shape of the coefficient arrays, a pair of them for pairs of arrays
+        :param default: value of the coefficient for the members where it is None
+        :return: the common value if scalar or None for all the members, the stacked arrays, or
+            the list of the coefficients of the members if they can not be stacked without
+            turning scalars into arrays (e.g. TE and TM members)
+        """
+        values = [getattr(grid, name) for grid in self.members]
+        if all(v is None for v in values):
+            return None
+        if all(numpy.isscalar(v) for v in values) and len(set(values)) == 1:
+            return values[0]
+        arrays = all(isinstance(v, numpy.ndarray) for v in values)
+        if arrays or (self.block > 1 and all(v is None or isinstance(v, numpy.ndarray) for v in values)):
+            # Members without the coefficient get the default value, unless the kernels take
+            # the members one at a time anyway
+            stack = self._stack_values(values, shape, default)
+            for k, grid in enumerate(self.members):
+                setattr(grid, name, stack[k])
+            return stack
+        if all(isinstance(v, tuple) for v in values):
+            stacks = tuple(self._stack_values([v[i] for v in values], shape[i], default) for i in (0, 1))
+            for k, grid in enumerate(self.members):
+                setattr(grid, name, tuple(stack[k] for stack in stacks))
+            return stacks
+        return values
+
+    def _stack_values(self, values, shape, default):
+        stack = numpy.empty((len(values),) + shape, dtype=self._ez.dtype)
+        for layer, value in zip(stack, values):
+            layer[...] = default if value is None else value
+        return stack
+
+    def _slice(self, coef, k):
+        """
+        :return: the part of a stacked coefficient for the block of members starting at k
+        """
+        if coef is None or numpy.isscalar(coef):
+            return coef
+        if isinstance(coef, list):
+            return coef[k:k + self.block]
+        if isinstance(coef, tuple):
+            return tuple(c[k:k + self.block] for c in coef)
+        return coef[k:k + self.block]
+
+    def step(self, t):
+        """
+        Perform one FDTD step on all the members
+        :param t: index of the step
+        """
+        self.run(1, start=t)
+
+    def run(self, nsteps, start=None):
+        """
+        Perform nsteps FDTD steps on all the members, see Grid.run
+        :param nsteps: number of steps
+        :param start: index of the first step. Defaults to the one following the last step done
+        """
+        if start is None:
+            start = self._next
+        if nsteps <= 0:
+            return
+        # Each block goes through the whole run before the next one, with its fields in cache
+        for block in self._blocks:
+            block.run(start, nsteps)
+
+        self.time = start + nsteps - 1
+        self._next = start + nsteps
+        for grid in self.members:
+            grid.time, grid._next = self.time, self._next
+
+
+class _Block(object):
+    """
+    Members k0 to k1 - 1 of an Ensemble, stepped together: one call of the bulk update kernels
+    per half step for all of them, with the step callbacks of BATCHES merged across them
+    """
+    def __init__(self, ensemble, k0, k1):
+        self.ensemble = ensemble
+        self.members = ensemble.members[k0:k1]
+        self.shape = ensemble.shape
+        self.k0, self.k1 = k0, k1
+        self._abc = None
+
+    def _stack(self, shape):
+        return self.ensemble._stack(shape)[self.k0:self.k1]
+
+    def build(self):
+        ensemble, k = self.ensemble, self.k0
+        self._ez, self._hx, self._hy = (ensemble.get_field(comp)[self.k0:self.k1] for comp in 'zxy')
+        self._ch, self._cha, self._ce, self._ca = (ensemble._slice(coef, k) for coef in (
+            ensemble._ch, ensemble._cha, ensemble._ce, ensemble._ca))
+        if all(getattr(grid, '_abc', None) is not None for grid in self.members):
+            self._abc = _ABCGroup.stack([grid._abc for grid in self.members], self._ez)
+
+    def _layout(self):
+        """
+        Group the step callbacks of each member and phase in runs of the same class. The runs of
+        the classes updated across the members (BATCHES) must be the same for all the members,
+        in the same order; the other callbacks may differ between the runs of BATCHES (e.g. the
+        ones acting on the electric field of TE and TM members, which come in different phases),
+        in which case each member runs its own
+        :return: for each phase, list of (class, list of the callbacks of each member of the
+            block, empty for the members without that run)
+        """
+        layout = []
+        for phase in range(4):
+            # Runs of each member, split into the runs of BATCHES and the lists of runs between them
+            members = []
+            for grid in self.members:
+                member, runs = [], []
+                for callback in grid._schedule[phase]:
+                    kind = type(callback)
+                    if runs and runs[-1][0] is kind:
+                        runs[-1][1].append(callback)
+                    elif kind in BATCHES and not (member and member[-1][0] is kind):
+                        member.extend([(None, runs), (kind, [callback])])
+                        runs = []
+                    elif kind in BATCHES:
+                        member[-1][1].append(callback)
+                    else:
+                        runs.append((kind, [callback]))
+                member.append((None, runs))
+                members.append(member)
+
+            if any([kind for kind, runs in member] != [kind for kind, runs in members[0]] for member in members):
+                raise Exception("Error: members of an Ensemble must have the same step callbacks")
+            layout.append([])
+            for segment in zip(*members):
+                kind = segment[0][0]
+                if kind is not None:
+                    layout[-1].append((kind, [group for k, group in segment]))
+                elif all([k for k, g in runs] == [k for k, g in segment[0][1]] for k, runs in segment):
+                    layout[-1].extend((run[0], [runs[i][1] for k, runs in segment])
+                                      for i, run in enumerate(segment[0][1]))
+                else:
+                    n = len(segment)
+                    layout[-1].extend((kind, [group if j == m else [] for j in range(n)])
+                                      for m, (k, runs) in enumerate(segment) for kind, group in runs)
+        return layout
+
+    def _compile(self, start, nsteps):
+        compiled = []
+        for runs in self._layout():
+            phase = []
+            for kind, groups in runs:
+                if kind in BATCHES:
+                    batched = BATCHES[kind](groups, self, start, nsteps)
+                    if batched is not None:
+                        phase.append(batched)
+                elif hasattr(kind, 'batch'):
+                    for grid, group in zip(self.members, groups):
+                        if not group:
+                            continue
+                        batched = kind.batch(group, grid, start, nsteps)
+                        if batched is not None:
+                            phase.append(batched)
+                else:
+                    phase.extend(callback for group in groups for callback in group)
+            compiled.append(tuple(phase))
+        return tuple(compiled)
+
+    def run(self, start, nsteps):
+        pre_h, post_h, pre_e, post_e = self._compile(start, nsteps)
+        ez, hx, hy, buf, sx = self._ez, self._hx, self._hy, self.ensemble._buf, self.shape[0]
+        ch, cha, ce, ca = self._ch, self._cha, self._ce, self._ca
+
+        for t in range(start, start + nsteps):
+            for callback in pre_h:
+                callback(t)
+            fused_h(ez, hx, hy, ch, buf, 0, sx, ca=cha)
+            for callback in post_h:
+                callback(t)
+            for callback in pre_e:
+                callback(t)
+            fused_e(ez, hx, hy, ce, buf, 0, sx, ca=ca)
+            for callback in post_e:
+                callback(t)
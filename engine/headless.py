@@ -0,0 +1,149 @@
+############################################################
+# Headless batch runner                                    #
+#                                                          #
+############################################################
+#           Copyright (c) 2018 Stefano Guazzotti           #
+############################################################
+
+"""
+Run a scenario file without any rendering, streaming field snapshots and probe time series to
+chunked .npy files:
+
+    python -m engine.headless scenario.json -o output/ [--nsteps N] [--every N]
+
+The output directory contains an index.json file describing the chunk files. See
+engine.scenario for the format of the scenario file.
+"""
+
+import argparse
+import json
+import os
+from datetime import datetime as dt
+import engine.scenario as scenarios
+import numpy
+from engine.monitors import FrequencyMonitor, Monitor
+from engine.output import ChunkedWriter
+
+
+def run(scenario, directory, nsteps=None, every=None, chunk=None, checkpoint_every=0, restart=False):
+    """
+    Run a scenario, streaming its outputs to a directory
+    :param scenario: dictionary describing the scenario
+    :param directory: output directory, created if needed
+    :param nsteps: number of steps, overriding scenario["run"]["nsteps"]
+    :param every: interval between field snapshots, overriding scenario["output"]["every"]
+    :param chunk: number of snapshots per file, overriding scenario["output"]["chunk"]
+    :param checkpoint_every: interval between checkpoints (written in background to
+        directory/checkpoint), 0 for none
+    :param restart: resume from the checkpoint in the output directory
+    :return: dictionary describing the outputs (as written to index.json)
+    """
+    output = scenario.get("output", {})
+    nsteps = nsteps if nsteps is not None else scenario.get("run", {}).get("nsteps", 1000)
+    every = every if every is not None else output.get("every", 0)
+    chunk = chunk if chunk is not None else output.get("chunk", 64)
+
+    os.makedirs(directory, exist_ok=True)
+    grid = scenarios.make_grid(scenario)
+
+    probes = None
+    if output.get("probes"):
+        probes = ChunkedWriter(directory, "probes", (len(output["probes"]),), grid.output_dtype, chunk=4096)
+        monitor = Monitor(grid, points=output["probes"], length=probes.chunk, on_full=probes.extend)
+
+    dft = None
+    if output.get("dft"):
+        dft = FrequencyMonitor(grid, **output["dft"])
+
+    grid.build()
+
+    snapshots = {}
+    if every:
+        for comp in output.get("fields", ["z"]):
+            field = grid.get_field(comp)
+            snapshots[comp] = (field, ChunkedWriter(directory, "F" + comp, field._data.shape, field._data.dtype,
+                                                    chunk=chunk))
+
+    writers = {"F" + comp: writer for comp, (field, writer) in snapshots.items()}
+    if probes is not None:
+        writers["probes"] = probes
+
+    path = os.path.join(directory, "checkpoint")
+    done = 0
+    if restart:
+        extra = grid.load_checkpoint(path)
+        for name, writer in writers.items():
+            writer.resume(extra["writers"][name])
+        done = grid._next
+
+    # Steps before a restart were run (and timed) by an earlier call
+    first = done
+    start = dt.now()
+    while done < nsteps:
+        n = nsteps - done
+        if every:
+            n = min(n, every - done % every)
+        if checkpoint_every:
+            n = min(n, checkpoint_every - done % checkpoint_every)
+        grid.run(n, start=done)
+        done += n
+        if every and done % every == 0:
+            for field, writer in snapshots.values():
+                writer.append(field._data)
+        if checkpoint_every and done % checkpoint_every == 0 and done < nsteps:
+            # Everything written so far must be on disk and consistent with the checkpoint
+            if probes is not None:
+                monitor.flush()
+            for writer in writers.values():
+                writer.close()
+            extra = {"writers": {name: writer.describe() for name, writer in writers.items()}}
+            grid.save_checkpoint(path, background=True, extra=extra)
+    grid.wait_checkpoint()
+    elapsed = dt.now() - start
+
+    index = {
+        "nsteps": nsteps,
+        "ran": nsteps - first,
+        "elapsed": elapsed.total_seconds(),
+        "fields": {},
+    }
+    for comp, (field, writer) in snapshots.items():
+        writer.close()
+        index["fields"][comp] = dict(writer.describe(), first=every - 1, every=every)
+    if probes is not None:
+        monitor.flush()
+        probes.close()
+        index["probes"] = dict(probes.describe(), positions=output["probes"])
+    if dft is not None:
+        index["dft"] = {"frequencies": dft.frequencies.tolist(), "files": {}}
+        for comp, values in dft.dft.items():
+            index["dft"]["files"][comp] = "dft_F{}.npy".format(comp)
+            numpy.save(os.path.join(directory, index["dft"]["files"][comp]), values)
+
+    with open(os.path.join(directory, "index.json"), "w") as f:
+        json.dump(index, f, indent=2)
+    with open(os.path.join(directory, "scenario.json"), "w") as f:
+        json.dump(scenario, f, indent=2)
+
+    return index
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run an FDTD scenario without rendering")
+    parser.add_argument("scenario", help="scenario file (JSON)")
+    parser.add_argument("-o", "--output", default="output", help="output directory")
+    parser.add_argument("--nsteps", type=int, default=None, help="number of steps")
+    parser.add_argument("--every", type=int, default=None, help="steps between field snapshots (0: none)")
+    parser.add_argument("--chunk", type=int, default=None, help="snapshots per output file")
+    parser.add_argument("--checkpoint-every", type=int, default=0, help="steps between checkpoints (0: none)")
+    parser.add_argument("--restart", action="store_true", help="resume from the last checkpoint")
+    args = parser.parse_args(argv)
+
+    index = run(scenarios.load(args.scenario), args.output, args.nsteps, args.every, args.chunk,
+                args.checkpoint_every, args.restart)
+    print("{} steps in {:.2f} s ({:.1f} steps/s)".format(
+        index["ran"], index["elapsed"], index["ran"] / max(index["elapsed"], 1e-9)))
+
+
+if __name__ == '__main__':
+    main()
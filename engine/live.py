@@ -0,0 +1,368 @@
+############################################################
+# Live view of a running simulation                        #
+#                                                          #
+############################################################
+#           Copyright (c) 2018 Stefano Guazzotti           #
+############################################################
+
+"""
+Live views decoupled from the solver. A LiveSolver steps a grid in its own thread (or process)
+and publishes downsampled frames of |F| into a double buffer in shared memory; the front end
+polls the latest frame at its own pace, so that the simulation does not wait for the rendering
+and the rendering does not touch full resolution data:
+
+    live = LiveSolver(grid, nsteps=2000)
+    live.start()
+    ...
+    frame = live.latest()       # None if nothing new, else (step, array of shape (ny, nx))
+    if frame is not None:
+        image.set_data(frame[1])
+    ...
+    live.stop()
+
+Frames are transposed already (y along the rows), ready for imshow. By default a frame is
+published only once the previous one has been picked up, so the solver does no more
+downsampling than the display needs.
+"""
+
+import threading
+import multiprocessing
+import time
+import weakref
+from multiprocessing import shared_memory
+import numpy
+import engine.scenario as scenarios
+import engine.solver as FDTD
+
+# Header of the frame buffer: number of the frame being written, of the last frame published,
+# of the last frame read, step of the frame in each slot, steps done by the solver, solver done
+WRITING, PUBLISHED, CONSUMED, STEP, STEPS, DONE = 0, 1, 2, 3, 5, 6
+HEADER = 7
+
+
+class Downsampler(object):
+    """
+    Reduce a field component to a frame of |F| with one pixel every factor x factor nodes,
+    either the value of one node of the block ("stride") or the largest magnitude in the block
+    ("max", which does not miss features narrower than a block). The trailing nodes that do not
+    fill a block are dropped
+    """
+    modes = ("stride", "max")
+
+    def __init__(self, shape, factor=1, mode="max"):
+        """
+        :param shape: shape of the field component
+        :param factor: size of the blocks of nodes reduced to one pixel
+        :param mode: "stride" or "max"
+        """
+        if mode not in Downsampler.modes:
+            raise Exception("Error: unknown downsampling mode {}".format(mode))
+        self.factor = factor
+        self.mode = mode
+        self._nx, self._ny = shape[0] // factor, shape[1] // factor
+        self.shape = (self._ny, self._nx)
+        if mode == "max" and factor > 1:
+            self._abs = numpy.zeros((self._nx * factor, self._ny * factor), dtype=numpy.float32)
+            self._rows = numpy.zeros((self._nx, self._ny * factor), dtype=numpy.float32)
+            self._max = numpy.zeros((self._nx, self._ny), dtype=numpy.float32)
+
+    @staticmethod
+    def factor_for(shape, size):
+        """
+        :return: smallest factor giving frames of at most size pixels along both axes
+        """
+        return max(1, int(numpy.ceil(max(shape) / size)))
+
+    def __call__(self, data, out):
+        """
+        :param data: field component
+        :param out: frame to fill, of shape self.shape
+        """
+        f = self.factor
+        data = data[:self._nx * f, :self._ny * f]
+        if self.mode == "stride" or f == 1:
+            numpy.abs(data[::f, ::f].T, out=out)
+        else:
+            # Maximum over the blocks as f - 1 elementwise maxima of strided views along each
+            # axis, much faster than reducing a (nx, f, ny, f) view
+            a, rows, m = self._abs, self._rows, self._max
+            numpy.abs(data, out=a)
+            numpy.maximum(a[0::f], a[1::f], out=rows)
+            for i in range(2, f):
+                numpy.maximum(rows, a[i::f], out=rows)
+            numpy.maximum(rows[:, 0::f], rows[:, 1::f], out=m)
+            for i in range(2, f):
+                numpy.maximum(m, rows[:, i::f], out=m)
+            out[...] = m.T
+        return out
+
+
+class FrameBuffer(object):
+    """
+    Two float32 frames in shared memory, written alternately by a single writer and read by a
+    single reader. The writer fills the slot not holding the last published frame; a reader
+    copying a slot that the writer has started overwriting meanwhile (two frames later) reads
+    it again
+    """
+    def __init__(self, shape, name=None):
+        """
+        :param shape: shape of the frames
+        :param name: name of an existing buffer to attach to. A new one is created if None
+        """
+        self.shape = tuple(shape)
+        size = HEADER * 8 + 2 * int(numpy.prod(self.shape)) * 4
+        self._owner = name is None
+        self._shm = shared_memory.SharedMemory(name=name, create=self._owner, size=size)
+        self.name = self._shm.name
+        self._header = numpy.ndarray((HEADER,), dtype=numpy.int64, buffer=self._shm.buf)
+        self._slots = numpy.ndarray((2,) + self.shape, dtype=numpy.float32, buffer=self._shm.buf,
+                                    offset=HEADER * 8)
+        if self._owner:
+            self._header[...] = -1
+            self._header[STEPS] = self._header[DONE] = 0
+
+    @property
+    def wanted(self):
+        """True if the last published frame has been read"""
+        return self._header[CONSUMED] == self._header[PUBLISHED]
+
+    @property
+    def steps(self):
+        """Number of steps done by the solver"""
+        return int(self._header[STEPS])
+
+    @property
+    def done(self):
+        """True once the solver has finished or stopped"""
+        return bool(self._header[DONE])
+
+    def begin(self):
+        """
+        :return: the slot to fill with the next frame, to be published with commit
+        """
+        n = self._header[PUBLISHED] + 1
+        self._header[WRITING] = n
+        return self._slots[n % 2]
+
+    def commit(self, step):
+        """
+        Publish the frame filled after begin
+        :param step: index of the step of the frame
+        """
+        n = self._header[WRITING]
+        self._header[STEP + n % 2] = step
+        self._header[PUBLISHED] = n
+
+    def latest(self, out=None):
+        """
+        :param out: array receiving the frame (allocated if None)
+        :return: (step, frame) for the last published frame, or None if it has been read already
+        """
+        if out is None:
+            out = numpy.empty(self.shape, dtype=numpy.float32)
+        while True:
+            n = self._header[PUBLISHED]
+            if n < 0 or n == self._header[CONSUMED]:
+                return None
+            out[...] = self._slots[n % 2]
+            step = int(self._header[STEP + n % 2])
+            if self._header[WRITING] < n + 2:
+                break
+        self._header[CONSUMED] = n
+        return step, out
+
+    def close(self):
+        del self._header, self._slots
+        self._shm.close()
+        if self._owner:
+            self._shm.unlink()
+
+
+class FramePublisher(object):
+    """
+    Step callback downsampling a field component into a FrameBuffer, either whenever the last
+    frame has been read (every=None) or every so many steps
+    """
+    def __init__(self, grid, buffer, downsampler, comp="z", every=None, priority=-200):
+        """
+        :param grid: FDTDPoC.engine.solver.Grid object
+        :param buffer: FrameBuffer receiving the frames
+        :param downsampler: Downsampler of the field component
+        :param comp: field component shown ('x', 'y' or 'z')
+        :param every: publish a frame every so many steps, instead of on demand
+        :param priority: priority of the post E step callback
+        """
+        self.buffer = buffer
+        self.downsampler = downsampler
+        self.comp = comp
+        self.every = every
+        self._last = None
+        if getattr(grid, '_built', False):
+            self.build(grid)
+        else:
+            grid.register_build_callback(self.build)
+        grid.register_step_callback("post", "e", self, priority=priority)
+
+    def build(self, grid):
+        self._data = grid.get_field(self.comp)._data
+
+    def __call__(self, t):
+        if self.every is None:
+            if not self.buffer.wanted:
+                return
+        elif self._last is not None and t - self._last < self.every:
+            return
+        self.publish(t)
+
+    def publish(self, t):
+        self.downsampler(self._data, self.buffer.begin())
+        self.buffer.commit(t)
+        self._last = t
+
+
+def _solve(grid, buffer, nsteps, chunk, running, stopping, comp, factor, mode, every):
+    """
+    Main loop of the solver thread or process
+    """
+    attached = isinstance(buffer, str)
+    if attached:
+        # Solver process: grid is a scenario, buffer the name of the frame buffer
+        grid = scenarios.make_grid(grid)
+    downsampler = Downsampler(_shape(grid, comp), factor, mode)
+    if attached:
+        buffer = FrameBuffer(downsampler.shape, name=buffer)
+    try:
+        publisher = FramePublisher(grid, buffer, downsampler, comp=comp, every=every)
+        if not getattr(grid, '_built', False):
+            grid.build()
+        done = 0
+        while done < nsteps and not stopping.is_set():
+            running.wait()
+            n = min(chunk, nsteps - done)
+            grid.run(n)
+            done += n
+            buffer._header[STEPS] = done
+        # The final state is always shown
+        if done:
+            publisher.publish(grid.time)
+    finally:
+        buffer._header[DONE] = 1
+        if attached:
+            grid.close()
+            buffer.close()
+
+
+def _shape(grid, comp):
+    """
+    :return: shape of a field component of a grid, built or not
+    """
+    sx, sy = grid.shape
+    if isinstance(comp, int):
+        comp = grid.comps[comp]
+    return {"x": (sx, sy - 1), "y": (sx - 1, sy), "z": (sx, sy)}[comp]
+
+
+def _shutdown(stopping, running, worker, buffer):
+    stopping.set()
+    running.set()
+    if worker.is_alive():
+        worker.join()
+    buffer.close()
+
+
+class LiveSolver(object):
+    """
+    Run a simulation in the background, publishing downsampled frames of a field component for
+    a live view
+    """
+    def __init__(self, grid, nsteps, size=400, factor=None, mode="max", comp="z", every=None,
+                 chunk=10, process=False):
+        """
+        :param grid: FDTDPoC.engine.solver.Grid object, built or not, stepped in a thread. With
+            process=True, dictionary describing a scenario (see engine.scenario), set up and
+            stepped in a separate process
+        :param nsteps: number of steps
+        :param size: largest size of the frames (pixels), if factor is not given
+        :param factor: downsampling factor (see Downsampler)
+        :param mode: downsampling mode, "max" or "stride"
+        :param comp: field component shown
+        :param every: publish a frame every so many steps, instead of whenever the last one has
+            been read
+        :param chunk: steps run between checks for pause and stop requests
+        :param process: run the solver in a separate process rather than in a thread
+        """
+        if process:
+            if not isinstance(grid, dict):
+                raise Exception("Error: a solver process is set up from a scenario dictionary")
+            shape = _shape(FDTD.Grid(**grid.get("grid", {})), comp)
+        else:
+            shape = _shape(grid, comp)
+        self.factor = factor = factor or Downsampler.factor_for(shape, size)
+        self.buffer = FrameBuffer(Downsampler(shape, factor, mode).shape)
+        self.grid = None if process else grid
+        self.nsteps = nsteps
+
+        if process:
+            self._running, self._stopping = multiprocessing.Event(), multiprocessing.Event()
+            target, buffer = multiprocessing.Process, self.buffer.name
+        else:
+            self._running, self._stopping = threading.Event(), threading.Event()
+            target, buffer = threading.Thread, self.buffer
+        self._running.set()
+        self._worker = target(target=_solve, daemon=not process,
+                              args=(grid, buffer, nsteps, chunk, self._running, self._stopping,
+                                    comp, factor, mode, every))
+        self._finalizer = weakref.finalize(self, _shutdown, self._stopping, self._running,
+                                           self._worker, self.buffer)
+        self._started = None
+
+    @property
+    def shape(self):
+        """Shape of the frames, (ny, nx)"""
+        return self.buffer.shape
+
+    def start(self):
+        self._started = time.perf_counter()
+        self._worker.start()
+
+    def latest(self, out=None):
+        """
+        :param out: array receiving the frame (allocated if None)
+        :return: (step, frame) for the last frame published, or None if there is nothing new
+        """
+        return self.buffer.latest(out)
+
+    @property
+    def steps(self):
+        """Number of steps done"""
+        return self.buffer.steps
+
+    @property
+    def rate(self):
+        """Average steps per second since start"""
+        if self._started is None:
+            return 0.
+        return self.steps / max(time.perf_counter() - self._started, 1e-9)
+
+    @property
+    def done(self):
+        """True once all the steps are done, or the solver has been stopped or has failed"""
+        return self.buffer.done or (self._started is not None and not self._worker.is_alive())
+
+    @property
+    def paused(self):
+        return not self._running.is_set()
+
+    def pause(self):
+        self._running.clear()
+
+    def resume(self):
+        self._running.set()
+
+    def join(self, timeout=None):
+        """Wait for the solver to finish"""
+        self._worker.join(timeout)
+
+    def stop(self):
+        """Stop the solver, wait for it and release the frame buffer"""
+        self._finalizer()
@@ -1,8 +1,17 @@
 import numpy
 
 class PassiveMaterial(object):
-    def __init__(self, grid, n, bleft, tright):
+    def __init__(self, grid, n, bleft, tright, sigma=0.):
+        """
+        Rectangular region of constant refractive index and conductivity
+        :param grid: FDTDPoC.engine.solver.Grid object
+        :param n: refractive index
+        :param bleft: bottom left corner (included)
+        :param tright: top right corner (included)
+        :param sigma: conductivity (S/m)
+        """
         self.n = n
+        self.sigma = sigma
         self.bleft = bleft
         self.tright = tright
         grid.add_passive_material(self)
@@ -11,10 +20,9 @@ class PassiveMaterial(object):
     def build(self, grid):
         regionx = slice(self.bleft[0], self.tright[0]+1)
         regiony = slice(self.bleft[1], self.tright[1]+1)
-        grid._epsr[regionx,regiony] = (self.n**2 * numpy.ones((
-            regionx.stop - regionx.start,
-            regiony.stop - regiony.start
-        )))
+        grid._epsr[regionx,regiony] = self.n**2
+        if self.sigma:
+            grid._sigma[regionx,regiony] = self.sigma
 
     def overlap(self, other):
         if self.bleft[0] > other.tright[0] or other.bleft[0] > self.tright[0]:
@@ -24,3 +32,200 @@ class PassiveMaterial(object):
             return False
 
         return True
+
+
+class MaterialIndex(object):
+    """
+    Spatial index of rectangular materials over uniform square bins, so that looking for the
+    materials overlapping a new one only tests those sharing a bin with it
+    """
+    def __init__(self, size=64):
+        """
+        :param size: side of the bins, in cells
+        """
+        self.size = size
+        self._bins = {}
+
+    def _keys(self, material):
+        x0, y0 = (int(v) // self.size for v in material.bleft)
+        x1, y1 = (int(v) // self.size for v in material.tright)
+        return ((i, j) for i in range(x0, x1 + 1) for j in range(y0, y1 + 1))
+
+    def insert(self, material):
+        for key in self._keys(material):
+            self._bins.setdefault(key, []).append(material)
+
+    def overlapping(self, material):
+        """
+        :return: list of the indexed materials overlapping the given one
+        """
+        found = []
+        for key in self._keys(material):
+            for other in self._bins.get(key, ()):
+                if other.overlap(material) and all(other is not f for f in found):
+                    found.append(other)
+        return found
+
+
+class Drude(object):
+    """
+    Drude pole, eps(w) = - omega_p^2 / (w^2 + i gamma w), e.g. the free electrons of a metal.
+    Solved through the polarization current J, dJ/dt + gamma J = eps0 omega_p^2 E, known half a
+    step before E
+    """
+    arrays = 1
+
+    def __init__(self, omega_p, gamma):
+        """
+        :param omega_p: plasma frequency (rad/s)
+        :param gamma: collision rate (1/s)
+        """
+        self.omega_p = omega_p
+        self.gamma = gamma
+
+    def coefficients(self, dt, eps_inf):
+        """
+        :return: coefficients of the update of dt J / (eps0 eps_inf), in units of E
+        """
+        g = self.gamma * dt / 2
+        return (1 - g) / (1 + g), (self.omega_p * dt) ** 2 / (1 + g) / eps_inf
+
+    @staticmethod
+    def step(state, coefs, e, out, tmp):
+        """
+        Update the pole from E at step n and add its contribution to the E update to out
+        :param state: list of the arrays of the pole
+        :param coefs: coefficients of the pole
+        :param e: field at step n
+        :param out: sum of the contributions of the poles
+        :param tmp: scratch array
+        """
+        q = state[0]
+        q *= coefs[0]
+        numpy.multiply(e, coefs[1], out=tmp)
+        q += tmp
+        out += q
+
+
+class Lorentz(object):
+    """
+    Lorentz pole, eps(w) = delta_eps omega_0^2 / (omega_0^2 - 2 i delta w - w^2), e.g. a bound
+    resonance of a dielectric. Solved through the polarization P,
+    d2P/dt2 + 2 delta dP/dt + omega_0^2 P = eps0 delta_eps omega_0^2 E, known at the steps of E
+    """
+    arrays = 2
+
+    def __init__(self, delta_eps, omega_0, delta):
+        """
+        :param delta_eps: strength of the resonance (contribution to the static epsr)
+        :param omega_0: resonance frequency (rad/s)
+        :param delta: damping rate (1/s), half the width of the resonance
+        """
+        self.delta_eps = delta_eps
+        self.omega_0 = omega_0
+        self.delta = delta
+
+    def coefficients(self, dt, eps_inf):
+        """
+        :return: coefficients of the update of P / (eps0 eps_inf), in units of E
+        """
+        if self.omega_0 * dt >= 2:
+            raise Exception("Error: Lorentz pole at {} rad/s not resolved by a time step of {} s".format(
+                self.omega_0, dt))
+        d = 1 + self.delta * dt
+        w = (self.omega_0 * dt) ** 2
+        return (2 - w) / d, (self.delta * dt - 1) / d, self.delta_eps * w / d / eps_inf
+
+    @staticmethod
+    def step(state, coefs, e, out, tmp):
+        """
+        Same as Drude.step. The state is P at steps n and n - 1, the latter being overwritten by
+        P at step n + 1 and the two swapped
+        """
+        p, old = state
+        old *= coefs[1]
+        numpy.multiply(p, coefs[0], out=tmp)
+        old += tmp
+        numpy.multiply(e, coefs[2], out=tmp)
+        old += tmp
+        # dP over the step, i.e. dt J
+        out += old
+        out -= p
+        state[0], state[1] = old, p
+
+
+class DispersiveMaterial(PassiveMaterial):
+    """
+    Rectangular region of dispersive material, epsr(w) = eps_inf + the sum of the
+    susceptibilities of its poles (Drude, Lorentz), solved by auxiliary differential equations.
+    The arrays of the poles cover the bounding box of the material only, so memory and cost scale
+    with the area of the material and not with that of the grid. They are updated by two step
+    callbacks around the bulk update of the electric field (Fz for TE, Fx and Fy for TM): the
+    poles are stepped from E at step n before it, and their contribution is subtracted after it,
+    the bulk update itself seeing eps_inf as epsr. For TM only the edges with both nodes inside
+    the box are dispersive
+    """
+    def __init__(self, grid, eps_inf, poles, bleft, tright, priority=100):
+        """
+        :param grid: FDTDPoC.engine.solver.Grid object
+        :param eps_inf: relative permittivity at high frequency
+        :param poles: list of Drude and Lorentz objects
+        :param bleft: bottom left corner (included)
+        :param tright: top right corner (included)
+        :param priority: priority of the step callbacks, which should come before the ones
+            reading the electric field
+        """
+        if not poles:
+            raise Exception("Error: a dispersive material needs at least one pole, use PassiveMaterial otherwise")
+        super().__init__(grid, numpy.sqrt(eps_inf), bleft, tright)
+        self.eps_inf = eps_inf
+        self.poles = list(poles)
+        self._phase = "e" if grid.polarization == "te" else "h"
+        grid.register_step_callback("pre", self._phase, self.polarize, priority=priority)
+        grid.register_step_callback("post", self._phase, self, priority=priority)
+
+    def _regions(self, grid):
+        """
+        :return: list of (component, region) of the electric field within the material
+        """
+        (x0, y0), (x1, y1) = self.bleft, self.tright
+        if self._phase == "e":
+            # The terminating nodes are never updated
+            sx, sy = grid.shape
+            return [("z", (slice(max(x0, 1), min(x1, sx - 2) + 1), slice(max(y0, 1), min(y1, sy - 2) + 1)))]
+        return [("x", (slice(x0, x1 + 1), slice(y0, y1))), ("y", (slice(x0, x1), slice(y0, y1 + 1)))]
+
+    def build(self, grid):
+        super().build(grid)
+        self._coefs = [pole.coefficients(grid.dt, self.eps_inf) for pole in self.poles]
+        self._targets = []
+        for comp, region in self._regions(grid):
+            e = grid.get_field(comp)._data[region]
+            states = [[numpy.zeros(e.shape, dtype=grid.dtype) for i in range(pole.arrays)] for pole in self.poles]
+            self._targets.append((e, states, numpy.zeros_like(states[0][0]), numpy.empty_like(states[0][0])))
+
+    def polarize(self, t):
+        for e, states, out, tmp in self._targets:
+            out[...] = 0
+            for pole, state, coefs in zip(self.poles, states, self._coefs):
+                pole.step(state, coefs, e, out, tmp)
+
+    def __call__(self, t):
+        for e, states, out, tmp in self._targets:
+            e -= out
+
+    def get_state(self):
+        state = {}
+        for k, (e, states, out, tmp) in enumerate(self._targets):
+            for i, arrays in enumerate(states):
+                for j, a in enumerate(arrays):
+                    state["{}.{}.{}".format(k, i, j)] = a
+            state["{}.sum".format(k)] = out
+        return state
+
+    def set_state(self, state):
+        for k, (e, states, out, tmp) in enumerate(self._targets):
+            for i, arrays in enumerate(states):
+                for j, a in enumerate(arrays):
+                    a[...] = state["{}.{}.{}".format(k, i, j)]
+            out[...] = state["{}.sum".format(k)]
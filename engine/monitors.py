@@ -0,0 +1,368 @@
+############################################################
+# Monitors recording the fields during a simulation        #
+#                                                          #
+############################################################
+#           Copyright (c) 2018 Stefano Guazzotti           #
+############################################################
+
+import numpy
+
+
+class Monitor(object):
+    """
+    Record a field component at any number of points, lines and rectangular regions of the grid.
+    All the probed nodes are gathered with a single numpy.take into a preallocated buffer, so
+    the cost per step barely depends on the number of probes.
+    """
+    def __init__(self, grid, points=(), lines=(), regions=(), comp="z", length=1000, every=1,
+                 ring=False, frequencies=None, on_full=None, priority=-100):
+        """
+        :param grid: FDTDPoC.engine.solver.Grid object
+        :param points: sequence of (x, y) nodes
+        :param lines: sequence of ((x0, y0), (x1, y1)) segments, sampled at every node they cross
+        :param regions: sequence of (bleft, tright) rectangles, both corners included
+        :param comp: field component to record ('x', 'y' or 'z')
+        :param length: number of records kept in the buffer
+        :param every: record one step every so many (decimation)
+        :param ring: when the buffer is full, overwrite the oldest records instead of stopping
+        :param frequencies: frequencies (Hz) of a running DFT of the probed values, if any. It
+            covers every recorded step, also once a buffer without ring or on_full is full
+        :param on_full: callable receiving the buffer every time it gets full. The buffer is
+            then emptied (incompatible with ring)
+        :param priority: priority of the post E step callback
+        """
+        self.comp = comp
+        self.length = length
+        self.every = every
+        self.ring = ring
+        self.on_full = on_full
+        self.frequencies = None if frequencies is None else numpy.atleast_1d(frequencies)
+
+        self.nodes = []
+        self.shapes = []
+        for point in points:
+            self._add(numpy.reshape(point, (1, 2)), ())
+        for start, stop in lines:
+            npoints = int(numpy.abs(numpy.subtract(stop, start)).max()) + 1
+            line = numpy.rint(numpy.linspace(start, stop, npoints)).astype(int)
+            self._add(line, (npoints,))
+        for bleft, tright in regions:
+            xs = numpy.arange(bleft[0], tright[0] + 1)
+            ys = numpy.arange(bleft[1], tright[1] + 1)
+            rect = numpy.stack(numpy.meshgrid(xs, ys, indexing="ij"), axis=-1)
+            self._add(rect.reshape(-1, 2), rect.shape[:2])
+
+        self.nodes = numpy.concatenate(self.nodes) if self.nodes else numpy.zeros((0, 2), dtype=int)
+        self.count = 0
+
+        if getattr(grid, '_built', False):
+            self.build(grid)
+        else:
+            grid.register_build_callback(self.build)
+        grid.register_step_callback("post", "e", self, priority=priority)
+
+    def _add(self, nodes, shape):
+        start = sum(len(n) for n in self.nodes)
+        self.nodes.append(nodes)
+        self.shapes.append((slice(start, start + len(nodes)), shape))
+
+    def build(self, grid):
+        data = grid.get_field(self.comp)._data
+        self._flat = data.reshape(-1)
+        self._index = numpy.ravel_multi_index(tuple(self.nodes.T), data.shape)
+        self._buffer = numpy.zeros((self.length, len(self._index)), dtype=grid.output_dtype)
+        # Values are gathered in the type of the field, then converted (mixed precision)
+        self._staging = None
+        if data.dtype != self._buffer.dtype:
+            self._staging = numpy.zeros(len(self._index), dtype=data.dtype)
+        self._row = 0
+        self.count = 0
+
+        if self.frequencies is not None:
+            # Fz is known at integer steps, Fx and Fy half a step earlier
+            self._offset = 0. if grid.get_field(self.comp)._comp == 2 else -0.5
+            self._omega = 2 * numpy.pi * self.frequencies * grid.dt
+            complex_ = numpy.result_type(grid.output_dtype, numpy.complex64)
+            self._phasor = numpy.zeros(len(self.frequencies), dtype=complex_)
+            self._product = numpy.zeros((len(self.frequencies), len(self._index)), dtype=complex_)
+            self.dft = numpy.zeros((len(self.frequencies), len(self._index)), dtype=complex_)
+            self._scratch = numpy.zeros(len(self._index), dtype=data.dtype)
+
+    def __call__(self, t):
+        if t % self.every:
+            return
+        if self._row == self.length and self.ring:
+            self._row = 0
+
+        if self._row < self.length:
+            values = self._buffer[self._row]
+            if self._staging is None:
+                numpy.take(self._flat, self._index, out=values)
+            else:
+                numpy.take(self._flat, self._index, out=self._staging)
+                values[...] = self._staging
+            self._row += 1
+            self.count += 1
+        elif self.frequencies is not None:
+            # The buffer is full, but the DFT goes on over every recorded step
+            values = self._scratch
+            numpy.take(self._flat, self._index, out=values)
+        else:
+            return
+
+        if self.frequencies is not None:
+            numpy.exp(-1j * self._omega * (t + self._offset), out=self._phasor)
+            numpy.multiply(self._phasor[:, None], values, out=self._product)
+            self.dft += self._product
+
+        if self._row == self.length and self.on_full is not None:
+            self.flush()
+
+    def get_state(self):
+        state = {"buffer": self._buffer, "counters": numpy.array((self._row, self.count))}
+        if self.frequencies is not None:
+            state["dft"] = self.dft
+        return state
+
+    def set_state(self, state):
+        self._buffer[...] = state["buffer"]
+        self._row, self.count = (int(c) for c in state["counters"])
+        if self.frequencies is not None:
+            self.dft[...] = state["dft"]
+
+    def flush(self):
+        """
+        Hand the records collected so far to on_full and empty the buffer
+        """
+        if self.on_full is not None and self._row:
+            self.on_full(self._buffer[:self._row])
+        self._row = 0
+
+    @property
+    def data(self):
+        """
+        Records in the buffer, oldest first, as an array of shape (nrecords, nnodes)
+        """
+        if self.ring and self.count > self.length:
+            return numpy.roll(self._buffer, -self._row, axis=0)
+        return self._buffer[:self._row]
+
+    def get(self, i, data=None):
+        """
+        Records of the i-th probe (points first, then lines, then regions), reshaped to the
+        shape of the probe: (nrecords,) for points, (nrecords, npoints) for lines and
+        (nrecords, nx, ny) for regions
+        :param i: index of the probe
+        :param data: array of records to use instead of self.data (e.g. self.dft)
+        """
+        data = self.data if data is None else data
+        region, shape = self.shapes[i]
+        return data[:, region].reshape((len(data),) + shape)
+
+
+class FrequencyMonitor(object):
+    """
+    Running DFT of field components over the whole grid or a rectangular region of it, at a set
+    of frequencies. Memory is O(nfreq x region), independently of the number of steps.
+    The accumulated quantity is the sum over the steps of F(t) exp(-i omega t).
+    """
+    def __init__(self, grid, frequencies, comps=("z",), region=None, priority=-100):
+        """
+        :param grid: FDTDPoC.engine.solver.Grid object
+        :param frequencies: frequencies (Hz) at which the DFT is accumulated
+        :param comps: field components to transform ('x', 'y' and/or 'z')
+        :param region: (bleft, tright) rectangle, both corners included. Whole grid if None
+        :param priority: priority of the post E step callback
+        """
+        self.frequencies = numpy.atleast_1d(frequencies)
+        self.comps = tuple(comps)
+        self.region = region
+        self.dft = {}
+
+        if getattr(grid, '_built', False):
+            self.build(grid)
+        else:
+            grid.register_build_callback(self.build)
+        grid.register_step_callback("post", "e", self, priority=priority)
+
+    def build(self, grid):
+        self._omega = 2 * numpy.pi * self.frequencies * grid.dt
+        complex_ = numpy.result_type(grid.output_dtype, numpy.complex64)
+        self._phasor = numpy.zeros(len(self.frequencies), dtype=complex_)
+        self._fields = []
+        for comp in self.comps:
+            field = grid.get_field(comp)
+            if self.region is None:
+                data = field._data
+            else:
+                # Region clipped to the (staggered) shape of the component
+                bleft, tright = self.region
+                data = field._data[bleft[0]:tright[0] + 1, bleft[1]:tright[1] + 1]
+            # E is known at integer steps, H half a step earlier
+            offset = 0. if field._comp == 2 else -0.5
+            self.dft[comp] = numpy.zeros((len(self.frequencies),) + data.shape, dtype=complex_)
+            self._fields.append((data, offset, self.dft[comp], numpy.zeros(data.shape, dtype=complex_)))
+
+    def __call__(self, t):
+        for data, offset, dft, product in self._fields:
+            numpy.exp(-1j * self._omega * (t + offset), out=self._phasor)
+            for k in range(len(self._phasor)):
+                numpy.multiply(data, self._phasor[k], out=product)
+                dft[k] += product
+
+    def get_state(self):
+        return {comp: dft for comp, dft in self.dft.items()}
+
+    def set_state(self, state):
+        for comp, dft in self.dft.items():
+            dft[...] = state[comp]
+
+
+class FarFieldMonitor(object):
+    """
+    Near-to-far-field transformation over a rectangular contour of nodes enclosing the sources
+    and scatterers, in vacuum. The tangential fields on the contour are the equivalent surface
+    currents J = n x H and M = - n x E radiating the same fields outside of it: their running
+    DFTs at a set of frequencies are accumulated at every step, with memory O(nfreq x contour),
+    and radiated to any direction with the 2D Green's function in the far field.
+    Along each edge of the contour the z component is taken on its nodes and the tangential
+    in-plane one averaged over the two edges of the grid across each node, all the nodes of the
+    contour being gathered with one numpy.take per component. With the contour in the scattered
+    field region of a SourceTFSF box (e.g. one node outside of it) the scattered field is
+    transformed.
+    The DFTs are the sums over the steps of F(t) exp(-i omega t), as for Monitor, and the far
+    field F(rho, phi) of the z component (Ez for TE, Hz for TM) is given through the pattern
+    P(phi) = F(rho, phi) sqrt(rho) exp(i k rho), independent of rho
+    """
+    def __init__(self, grid, frequencies, bleft, tright, origin=None, priority=-100):
+        """
+        :param grid: FDTDPoC.engine.solver.Grid object
+        :param frequencies: frequencies (Hz) of the far field
+        :param bleft: bottom left node of the contour
+        :param tright: top right node of the contour
+        :param origin: node (possibly fractional) taken as the origin of the phases of the far
+            field, the center of the contour by default
+        :param priority: priority of the post E step callback
+        """
+        (x0, y0), (x1, y1) = bleft, tright
+        if x0 < 1 or y0 < 1 or x1 > grid.shape[0] - 2 or y1 > grid.shape[1] - 2:
+            raise Exception("Error: far field contour {}-{} must be inside the terminating nodes of {}".format(
+                bleft, tright, grid))
+        if x1 <= x0 or y1 <= y0:
+            raise Exception("Error: far field contour {}-{} must enclose some cells".format(bleft, tright))
+        self.frequencies = numpy.atleast_1d(frequencies)
+        self.bleft = (x0, y0)
+        self.tright = (x1, y1)
+        self.origin = ((x0 + x1) / 2, (y0 + y1) / 2) if origin is None else tuple(origin)
+        self.polarization = grid.polarization
+
+        # Edges of the contour: nodes, outward normal and in-plane component tangential to it.
+        # The corners are on two edges, with half of their length on each
+        xs, ys = numpy.arange(x0, x1 + 1), numpy.arange(y0, y1 + 1)
+        self._edges = [
+            (numpy.full(len(ys), x0), ys, (-1, 0), "y"),
+            (numpy.full(len(ys), x1), ys, (1, 0), "y"),
+            (xs, numpy.full(len(xs), y0), (0, -1), "x"),
+            (xs, numpy.full(len(xs), y1), (0, 1), "x"),
+        ]
+        self.nodes = numpy.concatenate([numpy.stack((x, y), axis=-1) for x, y, n, comp in self._edges])
+        self.dft = {}
+
+        if getattr(grid, '_built', False):
+            self.build(grid)
+        else:
+            grid.register_build_callback(self.build)
+        grid.register_step_callback("post", "e", self, priority=priority)
+
+    def build(self, grid):
+        self._dx = grid.dx
+        self._c, self._z0 = grid.c, grid.Z0
+        self._omega = 2 * numpy.pi * self.frequencies * grid.dt
+        complex_ = numpy.result_type(grid.output_dtype, numpy.complex64)
+        self._phasor = numpy.zeros(len(self.frequencies), dtype=complex_)
+        self._product = numpy.zeros((len(self.frequencies), len(self.nodes)), dtype=complex_)
+        self.dft = {name: numpy.zeros((len(self.frequencies), len(self.nodes)), dtype=complex_)
+                    for name in ("z", "t")}
+
+        # Fz on the nodes of the contour, and the tangential component at them as the mean of
+        # the two edges of the grid across them: Fy before and after along x on the x edges
+        # (left, right), Fx before and after along y on the y edges (bottom, top)
+        self._z = numpy.zeros(len(self.nodes), dtype=grid.dtype)
+        self._t = numpy.zeros(len(self.nodes), dtype=grid.dtype)
+        self._gathers = [(grid._Fz._data.reshape(-1), numpy.ravel_multi_index(tuple(self.nodes.T), grid.shape),
+                          None, self._z)]
+        start = 0
+        for edges in (self._edges[:2], self._edges[2:]):
+            comp = edges[0][3]
+            data = grid.get_field(comp)._data
+            x = numpy.concatenate([e[0] for e in edges])
+            y = numpy.concatenate([e[1] for e in edges])
+            before = (x - 1, y) if comp == "y" else (x, y - 1)
+            self._gathers.append((data.reshape(-1), numpy.ravel_multi_index(before, data.shape),
+                                  numpy.ravel_multi_index((x, y), data.shape), self._t[start:start + len(x)]))
+            start += len(x)
+        self._buf = numpy.zeros(len(self.nodes), dtype=grid.dtype)
+
+    def __call__(self, t):
+        for flat, index, after, out in self._gathers:
+            numpy.take(flat, index, out=out)
+            if after is not None:
+                buf = self._buf[:len(out)]
+                numpy.take(flat, after, out=buf)
+                out += buf
+                out *= 0.5
+        # Fz is known at integer steps, Fx and Fy half a step earlier
+        for values, offset, dft in ((self._z, 0., self.dft["z"]), (self._t, -0.5, self.dft["t"])):
+            numpy.exp(-1j * self._omega * (t + offset), out=self._phasor)
+            numpy.multiply(self._phasor[:, None], values, out=self._product)
+            dft += self._product
+
+    def _currents(self):
+        """
+        :return: z, x and y components of the DFTs of the currents at the nodes of the contour
+            times their length, Jz, Mx, My for TE and Mz, Jx, Jy for TM
+        """
+        fz, ft = self.dft["z"], self.dft["t"]
+        nx = numpy.concatenate([numpy.full(len(x), n[0]) for x, y, n, comp in self._edges])
+        ny = numpy.concatenate([numpy.full(len(x), n[1]) for x, y, n, comp in self._edges])
+        length = self._dx * numpy.concatenate([numpy.r_[0.5, numpy.ones(len(x) - 2), 0.5]
+                                               for x, y, n, comp in self._edges])
+        # The tangential component is Fy on the x edges (ny = 0) and Fx on the y ones (nx = 0).
+        # TE: Jz = nx Hy - ny Hx, (Mx, My) = (-ny, nx) Ez
+        # TM: Mz = ny Ex - nx Ey, (Jx, Jy) = (ny, -nx) Hz, the same up to the sign
+        sign = 1 if self.polarization == "te" else -1
+        return sign * (nx - ny) * length * ft, sign * -ny * length * fz, sign * nx * length * fz
+
+    def pattern(self, angles):
+        """
+        :param angles: directions in the plane of the grid, angles from the x axis (rad)
+        :return: complex array of shape (nfreq, nangles) of the far field pattern of the z
+            component, P(phi) = F(rho, phi) sqrt(rho) exp(i k rho) (see the class documentation)
+        """
+        angles = numpy.atleast_1d(angles)
+        cos, sin = numpy.cos(angles), numpy.sin(angles)
+        k = 2 * numpy.pi * self.frequencies / self._c
+        # Positions of the nodes of the contour relative to the origin (m)
+        x = (self.nodes[:, 0] - self.origin[0]) * self._dx
+        y = (self.nodes[:, 1] - self.origin[1]) * self._dx
+        currents = self._currents()
+        result = numpy.zeros((len(k), len(angles)), dtype=currents[0].dtype)
+        for i in range(len(k)):
+            # Radiation integrals, sums over the contour of the currents times exp(i k rho . r')
+            phase = numpy.exp(1j * k[i] * (numpy.outer(cos, x) + numpy.outer(sin, y)))
+            iz, ix, iy = (phase @ current[i] for current in currents)
+            # TE: Ez = sqrt(k / (8 pi rho)) exp(-i (k rho - pi / 4)) (- Z0 Nz + cos Ly - sin Lx)
+            # TM: Hz = - sqrt(k / (8 pi rho)) exp(-i (k rho - pi / 4)) (Lz / Z0 + cos Ny - sin Nx)
+            if self.polarization == "te":
+                result[i] = -self._z0 * iz + cos * iy - sin * ix
+            else:
+                result[i] = -(iz / self._z0 + cos * iy - sin * ix)
+            result[i] *= numpy.sqrt(k[i] / (8 * numpy.pi)) * numpy.exp(1j * numpy.pi / 4)
+        return result
+
+    def get_state(self):
+        return {name: dft for name, dft in self.dft.items()}
+
+    def set_state(self, state):
+        for name, dft in self.dft.items():
+            dft[...] = state[name]
@@ -0,0 +1,110 @@
+############################################################
+# Streaming of simulation outputs to disk                  #
+#                                                          #
+############################################################
+#           Copyright (c) 2018 Stefano Guazzotti           #
+############################################################
+
+import os
+import numpy
+from numpy.lib.format import open_memmap
+
+
+class ChunkedWriter(object):
+    """
+    Append-only writer of a sequence of equally shaped records to a series of .npy files of at
+    most chunk records each (name_00000.npy, name_00001.npy, ...). Only the chunk being written
+    is mapped in memory, so the memory footprint does not depend on the number of records.
+    """
+    def __init__(self, directory, name, shape, dtype="double", chunk=64):
+        """
+        :param directory: output directory
+        :param name: prefix of the chunk files
+        :param shape: shape of a single record
+        :param dtype: type of the records
+        :param chunk: number of records per file
+        """
+        self.directory = directory
+        self.name = name
+        self.shape = tuple(shape)
+        self.dtype = numpy.dtype(dtype)
+        self.chunk = chunk
+        self.files = []
+        self.count = 0
+        self._current = None
+        self._filled = 0
+
+    def _open(self):
+        path = os.path.join(self.directory, "{}_{:05d}.npy".format(self.name, len(self.files)))
+        self.files.append(os.path.basename(path))
+        self._current = open_memmap(path, mode="w+", dtype=self.dtype, shape=(self.chunk,) + self.shape)
+        self._filled = 0
+
+    def _close(self):
+        self._current.flush()
+        path = self._current.filename
+        filled = self._filled
+        if filled < self.chunk:
+            # Shrink the last chunk to the records actually written
+            data = numpy.array(self._current[:filled])
+            del self._current
+            numpy.save(path, data)
+        self._current = None
+
+    def append(self, record):
+        """
+        Write one record
+        :param record: array of shape self.shape
+        """
+        if self._current is None:
+            self._open()
+        self._current[self._filled] = record
+        self._filled += 1
+        self.count += 1
+        if self._filled == self.chunk:
+            self._close()
+
+    def extend(self, records):
+        """
+        Write a block of records
+        :param records: array of shape (nrecords,) + self.shape
+        """
+        done = 0
+        while done < len(records):
+            if self._current is None:
+                self._open()
+            n = min(self.chunk - self._filled, len(records) - done)
+            self._current[self._filled:self._filled + n] = records[done:done + n]
+            self._filled += n
+            self.count += n
+            done += n
+            if self._filled == self.chunk:
+                self._close()
+
+    def close(self):
+        if self._current is not None:
+            self._close()
+
+    def resume(self, description):
+        """
+        Go on appending after the records of a previous writer, e.g. when restarting from a
+        checkpoint. Files written after the description was taken are overwritten
+        :param description: dictionary returned by describe
+        """
+        self.close()
+        self.files = list(description["files"])
+        self.count = description["count"]
+
+    def describe(self):
+        return {"files": self.files, "count": self.count, "shape": list(self.shape),
+                "dtype": self.dtype.str, "chunk": self.chunk}
+
+
+def read_chunks(directory, description):
+    """
+    Read back the records written by a ChunkedWriter, memory mapped
+    :param directory: output directory
+    :param description: dictionary returned by ChunkedWriter.describe
+    :return: list of read-only memory mapped arrays, one per chunk
+    """
+    return [numpy.load(os.path.join(directory, f), mmap_mode="r") for f in description["files"]]
@@ -0,0 +1,241 @@
+############################################################
+# Multi-process domain decomposition                       #
+#                                                          #
+############################################################
+#           Copyright (c) 2018 Stefano Guazzotti           #
+############################################################
+
+"""
+Parallel update engines.
+
+ProcessUpdate ('processes') is a domain decomposed update engine. The field arrays live in shared
+memory and the grid is split along x into bands of rows, each updated by a worker process. The
+workers synchronise with the main process after every half step, so that the rows of the
+neighbouring bands needed by the stencil (the one-cell halos) are always up to date when read.
+Everything else (boundaries, sources, materials, monitors) keeps running in the main process on
+the very same arrays, so it works across band edges without any change.
+
+ThreadUpdate ('threads') splits the grid in tiles updated by a pool of threads within the main
+process, relying on the ufuncs releasing the GIL on large arrays.
+
+Both engines run the same kernels as FusedUpdate, so results are bit-identical to update='fused'.
+"""
+
+import multiprocessing
+import weakref
+from concurrent.futures import ThreadPoolExecutor
+from multiprocessing import shared_memory
+import numpy
+from engine.updates import Update, UPDATES, fused_e, fused_h
+
+
+def _attach(description):
+    name, shape, dtype = description
+    shm = shared_memory.SharedMemory(name=name)
+    return shm, numpy.ndarray(shape, dtype=dtype, buffer=shm.buf)
+
+
+def _worker(conn, arrays, coefficients, a, b):
+    """
+    Main loop of a worker process, updating the rows a to b - 1 on request
+    :param arrays: descriptions of the shared field arrays, Fz, Fx and Fy
+    :param coefficients: dictionary of the coefficients of the updates (see
+        Grid._bake_coefficients), scalars or descriptions of shared arrays
+    """
+    shms = []
+
+    def attach(description):
+        shm, array = _attach(description)
+        shms.append(shm)
+        return array
+
+    ez, hx, hy = (attach(d) for d in arrays)
+    coefs = {}
+    for name, value in coefficients.items():
+        if isinstance(value, tuple) and isinstance(value[0], tuple):
+            coefs[name] = tuple(attach(d) for d in value)
+        elif isinstance(value, tuple):
+            coefs[name] = attach(value)
+        else:
+            coefs[name] = value
+    buf = numpy.empty(2 * (b - a) * ez.shape[1], dtype=ez.dtype)
+
+    while True:
+        cmd = conn.recv()
+        if cmd == "h":
+            fused_h(ez, hx, hy, coefs["ch"], buf, a, b, ca=coefs["cha"])
+        elif cmd == "e":
+            fused_e(ez, hx, hy, coefs["cb"], buf, a, b, ca=coefs["ca"])
+        else:
+            break
+        conn.send(None)
+
+    del ez, hx, hy, coefs
+    for shm in shms:
+        shm.close()
+
+
+def _shutdown(workers, shms):
+    for conn, proc in workers:
+        try:
+            conn.send("stop")
+        except (BrokenPipeError, OSError):
+            pass
+        proc.join()
+    for shm in shms:
+        try:
+            shm.close()
+        except BufferError:
+            # Arrays of the grid still use the memory, which is released with them
+            pass
+        shm.unlink()
+
+
+class ProcessUpdate(Update):
+    """
+    Engine splitting the bulk updates across a pool of worker processes
+    """
+    def __init__(self, grid):
+        super().__init__(grid)
+        self.workers = grid.workers or multiprocessing.cpu_count()
+        self._shms = []
+        self._descriptions = {}
+        self._workers = []
+
+    def zeros(self, shape):
+        dtype = self.grid.dtype
+        shm = shared_memory.SharedMemory(create=True, size=max(int(numpy.prod(shape)), 1) * dtype.itemsize)
+        self._shms.append(shm)
+        data = numpy.ndarray(shape, dtype=dtype, buffer=shm.buf)
+        data[...] = 0
+        self._descriptions[id(data)] = (shm.name, shape, dtype.str)
+        return data
+
+    def _share(self, coef):
+        """
+        :return: the description of a copy of a coefficient array in shared memory, a pair of them
+            for a pair of arrays, or the coefficient itself if scalar or None
+        """
+        if coef is None or numpy.isscalar(coef):
+            return coef
+        if isinstance(coef, tuple):
+            return tuple(self._share(c) for c in coef)
+        shared = self.zeros(coef.shape)
+        shared[...] = coef
+        self._coefficients.append(shared)
+        return self._descriptions[id(shared)]
+
+    def build(self):
+        grid = self.grid
+        sx = grid.shape[0]
+        self._coefficients = []
+        coefficients = {name: self._share(getattr(grid, "_" + name)) for name in ("ch", "cha", "cb", "ca")}
+
+        arrays = [self._descriptions[id(a)] for a in (grid._Fz._data, grid._Fx._data, grid._Fy._data)]
+        bounds = numpy.linspace(0, sx, min(self.workers, sx) + 1).astype(int)
+        for a, b in zip(bounds[:-1], bounds[1:]):
+            parent, child = multiprocessing.Pipe()
+            proc = multiprocessing.Process(target=_worker, args=(child, arrays, coefficients, a, b),
+                                           daemon=True)
+            proc.start()
+            self._workers.append((parent, proc))
+
+        self._finalizer = weakref.finalize(self, _shutdown, self._workers, self._shms)
+
+    def _dispatch(self, cmd):
+        for conn, proc in self._workers:
+            conn.send(cmd)
+        for conn, proc in self._workers:
+            conn.recv()
+
+    def step_h(self, t):
+        self._dispatch("h")
+
+    def step_e(self, t):
+        self._dispatch("e")
+
+    def close(self):
+        """Stop the workers and release the shared memory"""
+        if hasattr(self, '_finalizer'):
+            self._finalizer()
+
+
+class ThreadUpdate(Update):
+    """
+    Engine splitting the bulk updates in tiles processed by a pool of threads. Each thread owns
+    a fixed set of tiles and a scratch buffer sized to a tile, which should fit in cache. With
+    an ActiveRegion the tiles are clipped to its box
+    """
+    tracks_active = True
+
+    def __init__(self, grid):
+        super().__init__(grid)
+        self.workers = grid.workers or multiprocessing.cpu_count()
+        self.tile = grid.tile or (64, grid.shape[1])
+
+    def build(self):
+        grid = self.grid
+        sx, sy = grid.shape
+        self._ch = grid._ch
+        self._cha = grid._cha
+        self._ce = grid._cb
+        self._ca = grid._ca
+
+        rows, cols = min(self.tile[0], sx), min(self.tile[1], sy)
+        tiles = [(a, min(a + rows, sx), c, min(c + cols, sy))
+                 for a in range(0, sx, rows) for c in range(0, sy, cols)]
+        workers = min(self.workers, len(tiles))
+        # Contiguous runs of tiles, so that each thread works on a compact part of the grid
+        bounds = numpy.linspace(0, len(tiles), workers + 1).astype(int)
+        self._tiles = [tiles[i:j] for i, j in zip(bounds[:-1], bounds[1:])]
+        self._bufs = [numpy.empty(2 * rows * cols, dtype=grid.dtype) for i in range(workers)]
+        self._pool = ThreadPoolExecutor(max_workers=workers)
+        self._finalizer = weakref.finalize(self, self._pool.shutdown)
+        self._active = grid._active
+        self._box = (0, sx, 0, sy)
+
+    def _clip(self, k):
+        """
+        :return: the tiles of the k-th thread within the box to update, clipped to it
+        """
+        a0, b0, c0, d0 = self._box
+        for a, b, c, d in self._tiles[k]:
+            a, b, c, d = max(a, a0), min(b, b0), max(c, c0), min(d, d0)
+            if a < b and c < d:
+                yield a, b, c, d
+
+    def _h(self, k):
+        grid = self.grid
+        ez, hx, hy = grid._Fz._data, grid._Fx._data, grid._Fy._data
+        buf = self._bufs[k]
+        for a, b, c, d in self._clip(k):
+            fused_h(ez, hx, hy, self._ch, buf, a, b, c, d, ca=self._cha)
+
+    def _e(self, k):
+        grid = self.grid
+        ez, hx, hy = grid._Fz._data, grid._Fx._data, grid._Fy._data
+        buf = self._bufs[k]
+        for a, b, c, d in self._clip(k):
+            fused_e(ez, hx, hy, self._ce, buf, a, b, c, d, ca=self._ca)
+
+    def step_h(self, t):
+        if self._active is not None:
+            self._box = self._active.grow(t)
+        # Waiting for all the tiles is the barrier between the two half steps
+        for result in self._pool.map(self._h, range(len(self._tiles))):
+            pass
+
+    def step_e(self, t):
+        if self._active is not None:
+            self._box = self._active.grow(t)
+        for result in self._pool.map(self._e, range(len(self._tiles))):
+            pass
+
+    def close(self):
+        """Stop the threads of the pool"""
+        if hasattr(self, '_finalizer'):
+            self._finalizer()
+
+
+UPDATES['processes'] = ProcessUpdate
+UPDATES['threads'] = ThreadUpdate
@@ -0,0 +1,192 @@
+############################################################
+# Opt-in instrumentation of the time loop                  #
+#                                                          #
+############################################################
+#           Copyright (c) 2018 Stefano Guazzotti           #
+############################################################
+
+"""
+Wall time accounting of the phases of the time steps of a Grid: bulk H and E updates and every
+step callback, named after its class or function. Enabled with Grid.enable_profiling, which
+swaps in the instrumented step and run of a Profiler; when disabled the plain ones are used and
+nothing is measured.
+
+    g.enable_profiling(trace=True)
+    g.run(100)
+    g.profile_stats()        # {"update:h": {"calls": 100, "total_s": ...}, ...}
+    g.save_trace("trace.json")
+
+Traces are in the Chrome trace event format, and can be opened with chrome://tracing or
+https://ui.perfetto.dev
+"""
+
+import json
+from time import perf_counter_ns
+
+PHASES = ("pre_h", "post_h", "pre_e", "post_e")
+
+
+def callback_name(callback):
+    """
+    :return: readable name of a step callback, e.g. "SourceDipole", "CPML.step_h" or
+        "SourceDipole.batch" for the callables returned by the batch classmethods
+    """
+    func = getattr(callback, '__func__', None)
+    if func is not None:
+        # Bound method
+        return "{}.{}".format(type(callback.__self__).__name__, func.__name__)
+    name = getattr(callback, '__qualname__', None)
+    if name is not None:
+        return name.split(".<locals>")[0]
+    return type(callback).__name__
+
+
+class Profiler(object):
+    """
+    Instrumented step and run of a Grid, accumulating the calls, total and maximum time of each
+    phase, and optionally recording every one of them as a trace event
+    """
+    def __init__(self, grid, trace=False, trace_limit=1000000):
+        """
+        :param grid: FDTDPoC.engine.solver.Grid object
+        :param trace: record the individual calls, to be exported with save_trace
+        :param trace_limit: maximum number of recorded calls, later ones are only counted
+        """
+        self.grid = grid
+        self.trace = trace
+        self.trace_limit = trace_limit
+        self.reset()
+
+    def reset(self):
+        """Clear the counters and the trace"""
+        self._counters = {}
+        self._events = []
+        self.dropped = 0
+        self._origin = perf_counter_ns()
+        self.invalidate()
+
+    def invalidate(self):
+        """
+        Drop the counters used by step, which are looked up once per frozen schedule (see
+        Grid._freeze_schedule)
+        """
+        self._step_slots = None
+
+    def _slots(self, schedule):
+        """
+        :return: for each phase, the counters of its callbacks. Callbacks with the same name share
+            their counter
+        """
+        slots = []
+        for phase, callbacks in zip(PHASES, schedule):
+            names = ("{}:{}".format(phase, callback_name(callback)) for callback in callbacks)
+            slots.append(tuple(self._counter(name) for name in names))
+        return slots
+
+    def _counter(self, name):
+        # [name, calls, total (ns), max (ns)]
+        if name not in self._counters:
+            self._counters[name] = [name, 0, 0, 0]
+        return self._counters[name]
+
+    def _call(self, counter, func, t):
+        start = perf_counter_ns()
+        func(t)
+        elapsed = perf_counter_ns() - start
+        counter[1] += 1
+        counter[2] += elapsed
+        if elapsed > counter[3]:
+            counter[3] = elapsed
+        if self.trace:
+            if len(self._events) < self.trace_limit:
+                self._events.append((counter[0], start, elapsed, t))
+            else:
+                self.dropped += 1
+
+    def _step(self, t, phases, slots, step_h, step_e, counters):
+        pre_h, post_h, pre_e, post_e = phases
+        c_pre_h, c_post_h, c_pre_e, c_post_e = slots
+        c_h, c_e, c_step = counters
+        call = self._call
+
+        start = perf_counter_ns()
+        for callback, counter in zip(pre_h, c_pre_h):
+            call(counter, callback, t)
+        call(c_h, step_h, t)
+        for callback, counter in zip(post_h, c_post_h):
+            call(counter, callback, t)
+        for callback, counter in zip(pre_e, c_pre_e):
+            call(counter, callback, t)
+        call(c_e, step_e, t)
+        for callback, counter in zip(post_e, c_post_e):
+            call(counter, callback, t)
+        elapsed = perf_counter_ns() - start
+        c_step[1] += 1
+        c_step[2] += elapsed
+        if elapsed > c_step[3]:
+            c_step[3] = elapsed
+
+    def _bulk(self):
+        return self._counter("update:h"), self._counter("update:e"), self._counter("step")
+
+    def step(self, t):
+        """
+        Instrumented equivalent of Grid.step
+        """
+        grid = self.grid
+        grid.time = t
+        if self._step_slots is None:
+            self._step_slots = self._slots(grid._schedule), self._bulk()
+        slots, counters = self._step_slots
+        update = grid._update
+        self._step(t, grid._schedule, slots, update.step_h, update.step_e, counters)
+        grid._next = t + 1
+
+    def run(self, nsteps, start=None):
+        """
+        Instrumented equivalent of Grid.run
+        """
+        grid = self.grid
+        if start is None:
+            start = grid._next
+        if nsteps <= 0:
+            return
+        phases = grid._compile_schedule(start, nsteps)
+        slots = self._slots(phases)
+        update = grid._update
+        counters = self._bulk()
+        for t in range(start, start + nsteps):
+            self._step(t, phases, slots, update.step_h, update.step_e, counters)
+        grid.time = start + nsteps - 1
+        grid._next = start + nsteps
+
+    def stats(self):
+        """
+        :return: dictionary of phase name -> {"calls", "total_s", "mean_s", "max_s", "fraction"},
+            the fraction being of the total time spent in the steps ("step")
+        """
+        steps = self._counters.get("step", [None, 0, 0, 0])[2]
+        stats = {}
+        for name, calls, total, longest in self._counters.values():
+            stats[name] = {
+                "calls": calls,
+                "total_s": total * 1e-9,
+                "mean_s": total * 1e-9 / calls if calls else 0.,
+                "max_s": longest * 1e-9,
+                "fraction": total / steps if steps else 0.,
+            }
+        return stats
+
+    def save_trace(self, path):
+        """
+        Write the recorded calls as a trace file (Chrome trace event format)
+        :param path: path of the JSON file
+        """
+        events = [
+            {"name": name, "cat": name.split(":")[0], "ph": "X", "pid": 0, "tid": 0,
+             "ts": (start - self._origin) / 1000., "dur": elapsed / 1000., "args": {"step": t}}
+            for name, start, elapsed, t in self._events
+        ]
+        with open(path, "w") as f:
+            json.dump({"traceEvents": events, "displayTimeUnit": "ms",
+                       "otherData": {"dropped": self.dropped}}, f)
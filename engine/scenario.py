@@ -0,0 +1,102 @@
+############################################################
+# Description of simulations through scenario files        #
+#                                                          #
+############################################################
+#           Copyright (c) 2018 Stefano Guazzotti           #
+############################################################
+
+"""
+A scenario is a JSON document describing a simulation. Objects are given as dictionaries with a
+"type" key naming the class, the other keys being passed as keyword arguments, e.g.
+
+{
+    "grid": {"sizex": 800, "sizey": 800, "dx": 10e-9},
+    "boundaries": {"xm": "ABC", "xp": "ABC", "ym": "ABC", "yp": {"type": "CPML", "thickness": 20}},
+    "sources": [
+        {"type": "SourceDipole", "position": [600, 400],
+         "pulse": {"type": "PulseGaussian", "E0": 10, "mu": 10e-15, "tau": 2e-15, "omega": 1.8e15}}
+    ],
+    "materials": [
+        {"type": "PassiveMaterial", "n": 2.3, "bleft": [80, 100], "tright": [120, 160]}
+    ],
+    "run": {"nsteps": 400},
+    "output": {"every": 10, "fields": ["z"], "probes": [[400, 400], [500, 400]],
+               "dft": {"frequencies": [2.4e14, 3e14], "comps": ["z"]}}
+}
+"""
+
+import functools
+import json
+import engine.solver as solver
+import engine.boundaries as boundaries
+import engine.sources as sources
+import engine.materials as materials
+
+
+def load(path):
+    """
+    Read a scenario file
+    :param path: path of the JSON file
+    :return: dictionary describing the scenario
+    """
+    with open(path) as f:
+        return json.load(f)
+
+
+def make_object(description, module, *args):
+    """
+    Instantiate the object described by a dictionary with a "type" key. Nested descriptions
+    (e.g. the pulse of a source), alone or in lists, are instantiated from the same module
+    :param description: dictionary describing the object
+    :param module: module where the class is looked up
+    :param args: positional arguments preceding the keyword ones (usually the grid)
+    :return: the new object
+    """
+    kwargs = dict(description)
+    try:
+        cls = getattr(module, kwargs.pop("type"))
+    except KeyError:
+        raise Exception("Error: missing type in {}".format(description))
+    except AttributeError:
+        raise Exception("Error: unknown type {} in {}".format(description["type"], module.__name__))
+
+    for k, v in kwargs.items():
+        if isinstance(v, dict) and "type" in v:
+            kwargs[k] = make_object(v, module)
+        elif isinstance(v, list) and v and all(isinstance(i, dict) and "type" in i for i in v):
+            # e.g. the pulses of a SourceArray
+            kwargs[k] = [make_object(i, module) for i in v]
+    return cls(*args, **kwargs)
+
+
+def make_grid(scenario):
+    """
+    Create the grid described by a scenario, with all its boundaries, sources and materials.
+    The grid is not built, so that more objects (e.g. monitors) can still be added
+    :param scenario: dictionary describing the scenario
+    :return: FDTDPoC.engine.solver.Grid object
+    """
+    grid = solver.Grid(**scenario.get("grid", {}))
+
+    bounds = {}
+    for side, name in scenario.get("boundaries", {}).items():
+        # Either the name of the class or a description with its parameters
+        kwargs = {}
+        if isinstance(name, dict):
+            kwargs = dict(name)
+            name = kwargs.pop("type")
+        try:
+            bounds[side] = getattr(boundaries, name)
+        except AttributeError:
+            raise Exception("Error: unknown boundary {} for side {}".format(name, side))
+        if kwargs:
+            bounds[side] = functools.partial(bounds[side], **kwargs)
+    grid.set_boundaries(**bounds)
+
+    for description in scenario.get("sources", []):
+        make_object(description, sources, grid)
+
+    for description in scenario.get("materials", []):
+        make_object(description, materials, grid)
+
+    return grid
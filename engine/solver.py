@@ -7,6 +7,11 @@
 
 import numpy
 from engine.boundaries import PEC
+from engine.materials import MaterialIndex
+from engine.updates import UPDATES, ActiveRegion
+import engine.parallel  # registers the parallel update engines
+import engine.checkpoint as checkpoint
+from engine.profiling import Profiler
 
 class Grid(object):
     """
@@ -17,20 +22,65 @@ class Grid(object):
     c = 299792458
     C = 1 / numpy.math.sqrt(2)
     Z0 = 377.0
-
-    def __init__(self, sizex=101, sizey=101, dx = 10e-9, **kwargs):
+    # Types of the fields and of the outputs (probes, DFTs) for each precision
+    precisions = {
+        'double': ('float64', 'float64'),
+        'single': ('float32', 'float32'),
+        'mixed': ('float32', 'float64'),
+    }
+    # Types of the z and of the in-plane (x, y) components for each polarization
+    polarizations = {
+        'te': ("E", "H"),
+        'tm': ("H", "E"),
+    }
+
+    def __init__(self, sizex=101, sizey=101, dx = 10e-9, update='default', workers=None, tile=None,
+                 dtype='double', polarization='te', track_active=False, **kwargs):
         """
         Initialize all essential components for a simulation on a (sizex x sizey) grid. This is the
         size for the z component of the field. The x (y) component has sizex - 1 (sizey - 1) points
         in the x (y) direction.
         :param sizex: number of mesh points along x
         :param sizey: number of mesh points along y
+        :param update: name of the engine for the bulk field updates (see engine.updates.UPDATES)
+        :param workers: number of workers of the parallel update engines (default: one per CPU)
+        :param tile: (rows, columns) of the tiles of the threaded update engine
+        :param dtype: precision of the simulation, 'double', 'single' or 'mixed' (fields stepped in
+            single precision, probes and DFTs accumulated in double precision)
+        :param polarization: 'te' (Ez, Hx, Hy) or 'tm' (Hz, Ex, Ey). TM is solved as the dual of
+            TE: the z component is updated second, so every step callback keeps acting on the same
+            components (sources excite Hz, and PEC walls behave as magnetic walls)
+        :param track_active: restrict the bulk updates to a bounding box of the nonzero fields,
+            grown at every half step from the sources until it covers the grid (see
+            engine.updates.ActiveRegion). Results are the same, early steps of localised sources
+            in large grids are much faster. Needs an engine supporting it ('fused', 'threads');
+            fields written directly into the arrays after build are not tracked
         """
         self.shape = (sizex, sizey)
         self._dx = dx
         self._dt = Grid.C * self.dx / Grid.c
+        self.workers = workers
+        self.tile = tile
+
+        if dtype not in Grid.precisions:
+            raise Exception("Unrecognised precision {}".format(dtype))
+        self.precision = dtype
+        self.dtype, self.output_dtype = (numpy.dtype(d) for d in Grid.precisions[dtype])
+
+        if polarization not in Grid.polarizations:
+            raise Exception("Unrecognised polarization {}".format(polarization))
+        self.polarization = polarization
+
+        if update not in UPDATES:
+            raise Exception("Unrecognised update engine {}".format(update))
+        self._update = UPDATES[update](self)
+        if track_active and not getattr(self._update, 'tracks_active', False):
+            raise Exception("Error: update engine {} cannot track the active region".format(update))
+        self.track_active = track_active
+        self._active = None
 
         self._passive_materials = []
+        self._material_index = MaterialIndex()
 
         self.sources = []
 
@@ -47,6 +97,8 @@ class Grid(object):
         self.pre_h = {}
         self.post_h = {}
 
+        self._profiler = None
+
     def __repr__(self):
         return "{}(sizex={}, sizey={})".format("Grid", self.shape[0], self.shape[1])
 
@@ -76,6 +128,9 @@ class Grid(object):
         else:
             cbs[priority] = [func]
 
+        if getattr(self, '_built', False):
+            self._freeze_schedule()
+
     def get_field(self, comp):
         """
         Returns field along direction comp.
@@ -91,9 +146,9 @@ class Grid(object):
         """
         Add a passive material to a region of the simulation
         """
-        for mat in self._passive_materials:
-            if mat.overlap(material):
-                raise Exception("Error: detected overlap of materials when adding {}".format(material))
+        if self._material_index.overlapping(material):
+            raise Exception("Error: detected overlap of materials when adding {}".format(material))
+        self._material_index.insert(material)
         self._passive_materials.append(material)
 
     def set_boundaries(self, **kwargs):
@@ -107,12 +162,16 @@ class Grid(object):
         shape_x = (self.shape[0], self.shape[1] - 1)
         shape_y = (self.shape[0] - 1, self.shape[1])
 
-        # z component of the field. For TE this is an electric field
-        self._Fz = Field(self.shape, field="E", comp=2, bounds=self.bounds)
-        self._epsr = numpy.ones(self.shape)
-        # x,y components of the field. These are magnetic fields
-        self._Fx = Field(shape_x, field="H", comp=0)
-        self._Fy = Field(shape_y, field="H", comp=1)
+        # z component of the field. For TE this is an electric field, for TM a magnetic one
+        zeros = self._update.zeros
+        kind, inplane = Grid.polarizations[self.polarization]
+        self._Fz = Field(self.shape, field=kind, comp=2, bounds=self.bounds, data=zeros(self.shape))
+        self._epsr = numpy.ones(self.shape, dtype=self.dtype)
+        lossy = any(m.sigma for m in self._passive_materials)
+        self._sigma = numpy.zeros(self.shape, dtype=self.dtype) if lossy else None
+        # x,y components of the field. These are magnetic fields for TE, electric ones for TM
+        self._Fx = Field(shape_x, field=inplane, comp=0, data=zeros(shape_x))
+        self._Fy = Field(shape_y, field=inplane, comp=1, data=zeros(shape_y))
 
         for side, bound in self.bounds.items():
             bound(self, side)
@@ -120,41 +179,239 @@ class Grid(object):
         for func in self.build_callbacks:
             func(self)
 
+        self._bake_coefficients()
+        self._active = ActiveRegion(self) if self.track_active else None
+        self._update.build()
+        self._freeze_schedule()
+
         self.time = 0
+        self._next = 0
         self._built = True
-        self.step = self.__step
+        self._bind_step()
+
+    def _bind_step(self):
+        if self._profiler is None:
+            self.step = self.__step
+            self.run = self.__run
+        else:
+            self.step = self._profiler.step
+            self.run = self._profiler.run
+
+    def enable_profiling(self, trace=False):
+        """
+        Time every phase of the steps from now on (see engine.profiling). Profiling has no cost
+        while disabled
+        :param trace: also record every call, see save_trace
+        """
+        self._profiler = Profiler(self, trace)
+        if getattr(self, '_built', False):
+            self._bind_step()
+
+    def disable_profiling(self):
+        """
+        Go back to the plain time loop. The statistics collected so far are dropped
+        """
+        self._profiler = None
+        if getattr(self, '_built', False):
+            self._bind_step()
+
+    def profile_stats(self):
+        """
+        :return: dictionary of phase name -> {"calls", "total_s", "mean_s", "max_s", "fraction"}
+            (see engine.profiling.Profiler.stats)
+        """
+        if self._profiler is None:
+            raise Exception("Error: profiling is not enabled")
+        return self._profiler.stats()
+
+    def save_trace(self, path):
+        """
+        Write the calls recorded since profiling was enabled with trace=True to a trace file
+        :param path: path of the JSON file
+        """
+        if self._profiler is None or not self._profiler.trace:
+            raise Exception("Error: tracing is not enabled")
+        self._profiler.save_trace(path)
+
+    def _bake_coefficients(self):
+        """
+        Compute the coefficients of the updates from the relative permittivity and conductivity
+        maps: Fz = Ca * Fz + Cb * curl(Fx, Fy) over the inner nodes, then Fx = Cha * Fx - Ch * dFz/dy
+        and Fy = Cha * Fy + Ch * dFz/dx. Ca and Cha are None if there are no losses.
+        For TE Ch is the scalar C / Z0. For TM Cb is the scalar -C / Z0 and Ch, Cha are pairs of
+        arrays for Fx and Fy, with the permittivity and conductivity averaged over the two nodes
+        on either side of the edges
+        """
+        if self.polarization == 'tm':
+            self._bake_coefficients_tm()
+            return
+
+        epsr = self._epsr[1:-1, 1:-1]
+        self._ch = Grid.C / Grid.Z0
+        self._cha = None
+        self._cb = Grid.C * Grid.Z0 / epsr
+        self._ca = None
+        if self._sigma is not None:
+            # sigma * dt / (2 * eps0 * epsr), with dt / eps0 = C * Z0 * dx
+            loss = self._sigma[1:-1, 1:-1] * Grid.C * Grid.Z0 * self.dx / (2 * epsr)
+            self._ca = (1 - loss) / (1 + loss)
+            self._cb /= 1 + loss
+            # Permittivity giving the same Cb, for the updates dividing by epsr
+            self._epsr_loss = numpy.ones(self.shape, dtype=self.dtype)
+            self._epsr_loss[1:-1, 1:-1] = epsr * (1 + loss)
+
+    def _bake_coefficients_tm(self):
+        self._cb = -Grid.C / Grid.Z0
+        self._ca = None
+        # Permittivity and conductivity on the nodes of Fx and Fy
+        edges = ((self._epsr[:, 1:] + self._epsr[:, :-1]) / 2, (self._epsr[1:] + self._epsr[:-1]) / 2)
+        self._ch = tuple(-Grid.C * Grid.Z0 / epsr for epsr in edges)
+        self._cha = None
+        self._epsr_edges = edges
+        if self._sigma is not None:
+            sigma = ((self._sigma[:, 1:] + self._sigma[:, :-1]) / 2, (self._sigma[1:] + self._sigma[:-1]) / 2)
+            loss = tuple(s * Grid.C * Grid.Z0 * self.dx / (2 * epsr) for s, epsr in zip(sigma, edges))
+            self._cha = tuple((1 - l) / (1 + l) for l in loss)
+            self._ch = tuple(ch / (1 + l) for ch, l in zip(self._ch, loss))
+            self._epsr_edges = tuple(epsr * (1 + l) for epsr, l in zip(edges, loss))
+
+    def close(self):
+        """
+        Release the resources held by the update engine (e.g. worker processes)
+        """
+        self._update.close()
+
+    def save_checkpoint(self, path, background=False, extra=None):
+        """
+        Write the full state of the simulation to a checkpoint directory (see engine.checkpoint)
+        :param path: checkpoint directory. An existing checkpoint is replaced atomically
+        :param background: write from a separate thread, so that the time loop is not stalled
+        :param extra: JSON serialisable data stored along with the checkpoint
+        """
+        self.wait_checkpoint()
+        self._checkpoint_thread = checkpoint.save(self, path, background, extra)
+
+    def wait_checkpoint(self):
+        """
+        Wait for the checkpoint being written in background, if any
+        """
+        if getattr(self, '_checkpoint_thread', None) is not None:
+            self._checkpoint_thread.join()
+            self._checkpoint_thread = None
+
+    def load_checkpoint(self, path):
+        """
+        Restore the state of the simulation from a checkpoint directory. The grid must be built
+        and set up as the one that wrote the checkpoint. Stepping can then go on from the step
+        following the one at which the checkpoint was written
+        :param path: checkpoint directory
+        :return: the extra data stored with the checkpoint
+        """
+        return checkpoint.load(self, path)
+
+    def _freeze_schedule(self):
+        """
+        Flatten the priority dictionaries of step callbacks into ordered tuples, so that the
+        sorting is done once and not at every step
+        """
+        self._schedule = tuple(
+            tuple(callback for priority in sorted(cbs.keys(), reverse=True) for callback in cbs[priority])
+            for cbs in (self.pre_h, self.post_h, self.pre_e, self.post_e)
+        )
+        if self._active is not None:
+            self._active.seed(self._schedule)
+        if self._profiler is not None:
+            self._profiler.invalidate()
+
+    def _compile_schedule(self, start, nsteps):
+        """
+        Turn the frozen schedule into the one used by run for steps start to start + nsteps - 1.
+        Contiguous callbacks of the same class that provide a batch classmethod are merged into
+        a single callable (or dropped altogether if batch returns None)
+        :param start: index of the first step
+        :param nsteps: number of steps
+        :return: tuple of four tuples of callables (pre_h, post_h, pre_e, post_e)
+        """
+        compiled = []
+        for callbacks in self._schedule:
+            groups = []
+            for callback in callbacks:
+                kind = type(callback)
+                if groups and groups[-1][0] is kind:
+                    groups[-1][1].append(callback)
+                else:
+                    groups.append((kind, [callback]))
+
+            phase = []
+            for kind, group in groups:
+                if hasattr(kind, 'batch'):
+                    batched = kind.batch(group, self, start, nsteps)
+                    if batched is not None:
+                        phase.append(batched)
+                else:
+                    phase.extend(group)
+            compiled.append(tuple(phase))
+        return tuple(compiled)
 
     def __step(self, t):
         """
         Perform one FDTD step, i.e., one electric field update and one magnetic field update on
         the whole grid
         :param t: index of the step
-        :param src: a tuple indicating position and field for the source
         :return: NoneType
         """
         self.time = t
+        pre_h, post_h, pre_e, post_e = self._schedule
 
-        for priority in sorted(self.pre_h.keys(), reverse=True):
-            for callback in self.pre_h[priority]:
-                callback(t)
+        for callback in pre_h:
+            callback(t)
 
-        self._Fx.step(t, self._Fz)
-        self._Fy.step(t, self._Fz)
+        self._update.step_h(t)
 
-        for priority in sorted(self.post_h.keys(), reverse=True):
-            for callback in self.post_h[priority]:
-                callback(t)
+        for callback in post_h:
+            callback(t)
 
-        for priority in sorted(self.pre_e.keys(), reverse=True):
-            for callback in self.pre_e[priority]:
-                callback(t)
+        for callback in pre_e:
+            callback(t)
+
+        self._update.step_e(t)
 
-        self._Fz.step(t, self._Fx, self._Fy, self._epsr)
+        for callback in post_e:
+            callback(t)
 
-        for priority in sorted(self.post_e.keys(), reverse=True):
-            for callback in self.post_e[priority]:
+        self._next = t + 1
+        return
+
+    def __run(self, nsteps, start=None):
+        """
+        Perform nsteps FDTD steps in a single loop, with the step callbacks compiled once for
+        the whole run (see _compile_schedule). Equivalent to calling step for every step index
+        :param nsteps: number of steps
+        :param start: index of the first step. Defaults to the one following the last step done
+        :return: NoneType
+        """
+        if start is None:
+            start = self._next
+        if nsteps <= 0:
+            return
+        pre_h, post_h, pre_e, post_e = self._compile_schedule(start, nsteps)
+        step_h = self._update.step_h
+        step_e = self._update.step_e
+
+        for t in range(start, start + nsteps):
+            for callback in pre_h:
+                callback(t)
+            step_h(t)
+            for callback in post_h:
+                callback(t)
+            for callback in pre_e:
+                callback(t)
+            step_e(t)
+            for callback in post_e:
                 callback(t)
 
+        self.time = start + nsteps - 1
+        self._next = start + nsteps
         return
 
 
@@ -163,34 +420,49 @@ class Field(object):
     Class that represents a single field component over the whole grid or a subset of it
     # TODO next clean up :)
     """
-    def __init__(self, shape, field, comp, bounds=None):
+    def __init__(self, shape, field, comp, bounds=None, data=None, dtype="double"):
         """
         Create an object representing a field component over the grid or a subset of the grid
         :param shape: tuple representing the number of points along x and y
         :param field: electric or magnetic field
         :param comp: x, y, or z component
         :param bounds: dictionary of boundaries on the four edges
+        :param data: zeroed array of the given shape to store the field in (allocated if None)
+        :param dtype: type of the array allocated if data is None
         """
         self._shape = shape
         self._field = field
         self._comp = comp
         self._bounds = bounds
-        self._data = numpy.zeros(self._shape, dtype="double")
+        self._data = numpy.zeros(self._shape, dtype=dtype) if data is None else data
 
     def step(self, i, *other):
         """
         Do a single step for one of the field components over the whole grid
         :param i: step index
-        :param other: set of neighbouring fields
+        :param other: set of neighbouring fields: Fz and the permittivity on the nodes of the
+            component for Fx, Fy of TM, Fz alone for Fx, Fy of TE, Fx, Fy and the permittivity for
+            Fz of TE, Fx and Fy for Fz of TM
         :return: NoneType
         """
-        if self._comp == 0:
-            self._data -= Grid.C / Grid.Z0 * (other[0]._data[:,1:] - other[0]._data[:,:-1])
-        elif self._comp == 1:
-            self._data += Grid.C / Grid.Z0 * (other[0]._data[1:,:] - other[0]._data[:-1,:])
-        elif self._comp == 2:
-            self._data[1:-1, 1:-1] += (
-                    - Grid.C * Grid.Z0 * (other[0]._data[1:-1, 1:] - other[0]._data[1:-1, :-1]) / other[2][1:-1,1:-1]
-                    + Grid.C * Grid.Z0 * (other[1]._data[1:, 1:-1] - other[1]._data[:-1, 1:-1]) / other[2][1:-1,1:-1]
-            )
+        if self._field == "H":
+            if self._comp == 0:
+                self._data -= Grid.C / Grid.Z0 * (other[0]._data[:,1:] - other[0]._data[:,:-1])
+            elif self._comp == 1:
+                self._data += Grid.C / Grid.Z0 * (other[0]._data[1:,:] - other[0]._data[:-1,:])
+            elif self._comp == 2:
+                self._data[1:-1, 1:-1] += Grid.C / Grid.Z0 * (
+                        (other[0]._data[1:-1, 1:] - other[0]._data[1:-1, :-1])
+                        - (other[1]._data[1:, 1:-1] - other[1]._data[:-1, 1:-1])
+                )
+        else:
+            if self._comp == 0:
+                self._data += Grid.C * Grid.Z0 * (other[0]._data[:,1:] - other[0]._data[:,:-1]) / other[1]
+            elif self._comp == 1:
+                self._data -= Grid.C * Grid.Z0 * (other[0]._data[1:,:] - other[0]._data[:-1,:]) / other[1]
+            elif self._comp == 2:
+                self._data[1:-1, 1:-1] += (
+                        - Grid.C * Grid.Z0 * (other[0]._data[1:-1, 1:] - other[0]._data[1:-1, :-1]) / other[2][1:-1,1:-1]
+                        + Grid.C * Grid.Z0 * (other[1]._data[1:, 1:-1] - other[1]._data[:-1, 1:-1]) / other[2][1:-1,1:-1]
+                )
         return
@@ -9,6 +9,22 @@ class Source(object):
 
     def build(self, grid):
         self.pulse.adimensionalise(grid)
+        self._waveform = WaveformCache.of(grid).get(self.pulse)
+        self._table = None
+
+    @staticmethod
+    def samples(sources):
+        """
+        Tabulate the pulses of a set of built sources, see SampleTable. The table is kept on the
+        first source and reused by the following runs as long as the set of waveforms is the same
+        :param sources: sequence of Source objects
+        :return: SampleTable object, indexed by step
+        """
+        waveforms = [src._waveform for src in sources]
+        table = sources[0]._table
+        if table is None or table.waveforms != waveforms:
+            table = sources[0]._table = SampleTable(waveforms)
+        return table
 
 
 class SourceDipole(Source):
@@ -20,7 +36,14 @@ class SourceDipole(Source):
         grid.register_step_callback("post", "e", self)
 
     def __call__(self, t):
-        self._field += self.pulse(t)
+        self._field += self._waveform[t]
+
+    def active_region(self, t):
+        """
+        :return: list of (bleft, tright) rectangles of nodes where the source injects fields at
+            step t (see engine.updates.ActiveRegion)
+        """
+        return [(self.position, self.position)]
 
     def build(self, grid):
         super().build(grid)
@@ -28,19 +51,113 @@ class SourceDipole(Source):
         ypos = slice(self.position[1], self.position[1]+1)
         self._field = grid.get_field("z")._data[xpos,ypos]
 
+    @classmethod
+    def batch(cls, dipoles, grid, start, nsteps):
+        """
+        Merge a group of dipoles into a single scatter-add per step, with the pulses tabulated by
+        chunks of steps
+        """
+        data = grid.get_field("z")._data
+        flat = data.reshape(-1)
+        index = numpy.ravel_multi_index(tuple(zip(*(d.position for d in dipoles))), data.shape)
+        samples = Source.samples(dipoles)
+
+        def inject(t):
+            numpy.add.at(flat, index, samples[t])
+
+        return inject
+
+
+class SourceArray(Source):
+    """
+    Array of dipole sources injected together with a single scatter-add per step, so that the
+    cost of a step hardly depends on the number of sources. Either each source has its own
+    pulse, or all of them share one pulse with per-source amplitudes
+    """
+    def __init__(self, grid, positions, pulse=None, pulses=None, amplitudes=None):
+        """
+        :param grid: FDTDPoC.engine.solver.Grid object
+        :param positions: array of shape (nsources, 2) of the positions of the sources
+        :param pulse: Pulse object shared by all the sources
+        :param pulses: sequence of Pulse objects, one per source (instead of pulse)
+        :param amplitudes: factors the pulses are multiplied by, one per source (default: 1)
+        """
+        positions = numpy.asarray(positions, dtype=int).reshape(-1, 2)
+        if (pulse is None) == (pulses is None):
+            raise Exception("Error: SourceArray needs either a pulse or a sequence of pulses")
+        pulses = [pulse] * len(positions) if pulses is None else list(pulses)
+        if len(pulses) != len(positions):
+            raise Exception("Error: SourceArray needs one pulse per source")
+        super().__init__(grid, positions, pulse)
+        grid.register_step_callback("post", "e", self)
+        self.pulses = pulses
+        self.amplitudes = numpy.ones(len(positions)) if amplitudes is None else \
+            numpy.asarray(amplitudes, dtype="double").reshape(len(positions))
+
+    def __call__(self, t):
+        row = self._samples[t]
+        numpy.take(row, self._columns, out=self._values)
+        numpy.multiply(self._values, self.amplitudes, out=self._values)
+        if self._unique:
+            self._flat[self._index] += self._values
+        else:
+            numpy.add.at(self._flat, self._index, self._values)
+
+    def build(self, grid):
+        cache = WaveformCache.of(grid)
+        waveforms, self._columns = [], numpy.empty(len(self.pulses), dtype=int)
+        for i, pulse in enumerate(self.pulses):
+            pulse.adimensionalise(grid)
+            waveform = cache.get(pulse)
+            # Sources with the same waveform read the same column of the table
+            for j, other in enumerate(waveforms):
+                if other is waveform:
+                    break
+            else:
+                j = len(waveforms)
+                waveforms.append(waveform)
+            self._columns[i] = j
+        self._samples = SampleTable(waveforms)
+        self._values = numpy.empty(len(self.pulses))
+
+        data = grid.get_field("z")._data
+        self._flat = data.reshape(-1)
+        self._index = numpy.ravel_multi_index(tuple(self.position.T), data.shape)
+        # Without repeated positions a plain indexed add is enough, and faster
+        self._unique = len(numpy.unique(self._index)) == len(self._index)
+
+    def active_region(self, t):
+        """Same as SourceDipole.active_region"""
+        return [(self.position.min(axis=0), self.position.max(axis=0))]
+
 
 class SourceTFSF(Source):
     """
     Total Field/Scattered Field box for plane waves with arbitrary propagation
-    direction and temporal shape (Pulse)
-    TODO: extend to arbitrary phi
+    direction and temporal shape (Pulse).
+    The incident field is computed on an auxiliary 1D grid along the propagation direction,
+    starting spacel cells before the first corner of the box reached by the wave and ending
+    spacer cells after the last one, and interpolated linearly onto the nodes along the edges of
+    the box through precomputed indices and weights. For phi a multiple of pi / 2 the nodes fall
+    on the auxiliary grid and no interpolation takes place. The edges of the box should lie in
+    vacuum. For TM the pulse gives the incident Hz.
     """
     def __init__(self, grid, bleft, tright, pulse,
-                 spacel=2, spacer=3):
+                 spacel=2, spacer=3, phi=0.):
+        """
+        :param grid: FDTDPoC.engine.solver.Grid object
+        :param bleft: bottom left corner of the total field region (included)
+        :param tright: top right corner of the total field region (included)
+        :param pulse: Pulse object
+        :param spacel: cells of the auxiliary grid before the box
+        :param spacer: cells of the auxiliary grid after the box
+        :param phi: direction of propagation, angle from the x axis (rad)
+        """
         super().__init__(grid, (bleft, tright), pulse)
         grid.register_step_callback("pre", "e", self)
         self.spacel = spacel
         self.spacer = spacer
+        self.phi = phi
 
         t1 = grid.C
         t2 = 1. / t1 + 2. + t1
@@ -50,25 +167,78 @@ class SourceTFSF(Source):
         return
 
     def __call__(self, t):
-        self._bound_Hl -= self._C / self._Z0 * self._E[self.spacel]
-        self._bound_Hr += self._C / self._Z0 * self._E[-(self.spacer + 1)]
-        self._bound_Hb += self._C / self._Z0 * self._E[self.spacel:-self.spacer]
-        self._bound_Ht -= self._C / self._Z0 * self._E[self.spacel:-self.spacer]
-
-        self._H += self._C / self._Z0 * (self._E[1:] - self._E[:-1])
-        self._E[1:-1] += self._C * self._Z0 * (self._H[1:] - self._H[:-1])
-        self._E[-1] = (
-            self._coef0 * (self._E[-3] + self._auxfield[1][0]) +
-            self._coef1 * (self._auxfield[0][0] + self._auxfield[0][2] - self._E[-2] - self._auxfield[1][1]) +
-            self._coef2 * self._auxfield[0][1] - self._auxfield[1][2]
+        self._update(self._waveform[t])
+
+    def _update(self, pulse):
+        for correction in self._h_corrections:
+            self._correct(*correction)
+
+        # Auxiliary grid, terminated by an ABC (cf. engine.boundaries.ABC)
+        E, H, d = self._E, self._H, self._d
+        numpy.subtract(E[1:], E[:-1], out=d)
+        numpy.multiply(d, self._C / self._Z0, out=d)
+        numpy.add(H, d, out=H)
+        numpy.subtract(H[1:], H[:-1], out=d[:-1])
+        numpy.multiply(d[:-1], self._C * self._Z0, out=d[:-1])
+        numpy.add(E[1:-1], d[:-1], out=E[1:-1])
+        new, old = self._history[self._parity], self._history[1 - self._parity]
+        E[-1] = (
+            self._coef0 * (E[-3] + old[0]) +
+            self._coef1 * (new[0] + new[2] - E[-2] - old[1]) +
+            self._coef2 * new[1] - old[2]
         )
-        self._auxfield.pop()
-        self._auxfield.insert(0, self._E[-1:-4:-1].copy())
+        # The oldest step of history becomes the newest
+        old[...] = E[-1:-4:-1]
+        self._parity = 1 - self._parity
+
+        E[0] = pulse
+
+        for correction in self._e_corrections:
+            self._correct(*correction)
 
-        self._E[0] = self.pulse(t)
+    @staticmethod
+    def _correct(flat, index, aux, i0, i1, w0, w1, coef, a, b, c):
+        """
+        Add coef times the incident field interpolated from the auxiliary grid to some nodes
+        """
+        numpy.take(aux, i0, out=a)
+        if i1 is not None:
+            numpy.multiply(a, w0, out=a)
+            numpy.take(aux, i1, out=b)
+            numpy.multiply(b, w1, out=b)
+            numpy.add(a, b, out=a)
+        numpy.multiply(a, coef, out=a)
+        numpy.take(flat, index, out=c)
+        numpy.add(c, a, out=c)
+        numpy.put(flat, index, c)
 
-        self._bound_El -= self._C * self._Z0 * self._H[self.spacel - 1]
-        self._bound_Er += self._C * self._Z0 * self._H[-self.spacer]
+    def _corrections(self, data, nodes, aux, positions, coefs):
+        """
+        Precompute the interpolation of a correction of the fields along the box
+        :param data: field array to correct
+        :param nodes: (x, y) indices in data of the nodes to correct
+        :param aux: array of the auxiliary grid giving the incident field
+        :param positions: positions of the nodes along the auxiliary grid, in units of its cells
+        :param coefs: coefficients of the incident field for each node
+        :return: tuple of arguments of _correct, or None if there is nothing to correct
+        """
+        keep = coefs != 0
+        if not keep.any():
+            return None
+        positions, coefs = positions[keep], coefs[keep]
+        index = numpy.ravel_multi_index(tuple(n[keep] for n in nodes), data.shape)
+        i0 = numpy.floor(positions).astype(int)
+        w1 = positions - i0
+        # Nodes on the auxiliary grid up to rounding (e.g. for phi = pi / 2)
+        w1[w1 < 1e-9] = 0.
+        up = w1 > 1 - 1e-9
+        w1[up], i0[up] = 0., i0[up] + 1
+        i1 = None
+        if w1.any():
+            i1 = i0 + 1
+        buffers = [numpy.empty(len(index), dtype=data.dtype) for i in range(3)]
+        w0, w1, coefs = ((1. - w1).astype(data.dtype), w1.astype(data.dtype), coefs.astype(data.dtype))
+        return (data.reshape(-1), index, aux, i0, i1, w0, w1, coefs) + tuple(buffers)
 
     def build(self, grid):
         super().build(grid)
@@ -76,33 +246,142 @@ class SourceTFSF(Source):
         self._Z0 = grid.Z0
         xs = tuple(val[0] for val in self.position)
         ys = tuple(val[1] for val in self.position)
-        NP = xs[1] - xs[0] + self.spacel + self.spacer + 1
 
-        self._bound_El = grid.get_field('z')._data[xs[0],ys[0]:ys[1]+1]
-        self._bound_Hl = grid.get_field('y')._data[xs[0]-1,ys[0]:ys[1]+1]
-        self._bound_Er = grid.get_field('z')._data[xs[1],ys[0]:ys[1]+1]
-        self._bound_Hr = grid.get_field('y')._data[xs[1],ys[0]:ys[1]+1]
+        cos, sin = numpy.cos(self.phi), numpy.sin(self.phi)
+        cos, sin = (0. if abs(cos) < 1e-12 else cos), (0. if abs(sin) < 1e-12 else sin)
+        # Corner of the box first reached by the wave, at spacel cells from the start of the
+        # auxiliary grid
+        cx = xs[0] if cos >= 0 else xs[1]
+        cy = ys[0] if sin >= 0 else ys[1]
+        span = (xs[1] - xs[0]) * abs(cos) + (ys[1] - ys[0]) * abs(sin)
+        NP = int(numpy.ceil(span - 1e-9)) + self.spacel + self.spacer + 1
+
+        def depth(x, y):
+            return (x - cx) * cos + (y - cy) * sin + self.spacel
+
+        self._E = numpy.zeros(NP, dtype=grid.dtype)
+        self._H = numpy.zeros(NP - 1, dtype=grid.dtype)
+        self._d = numpy.zeros(NP - 1, dtype=grid.dtype)
+        self._history = numpy.zeros((2, 3), dtype=grid.dtype)
+        self._parity = 0
+
+        ch, ce = self._C / self._Z0, self._C * self._Z0
+        if grid.polarization == 'tm':
+            # The auxiliary grid solves the dual problem as well, with the incident E scaled by
+            # -Z0**2 with respect to its H: only the coefficient of the incident Hz changes
+            ch = -self._C * self._Z0
+        xr = numpy.arange(xs[0], xs[1] + 1)
+        yr = numpy.arange(ys[0], ys[1] + 1)
+        x0, x1 = numpy.full(len(yr), xs[0]), numpy.full(len(yr), xs[1])
+        y0, y1 = numpy.full(len(xr), ys[0]), numpy.full(len(xr), ys[1])
+        ones_x, ones_y = numpy.ones(len(xr)), numpy.ones(len(yr))
+        Fz, Fx, Fy = (grid.get_field(c)._data for c in 'zxy')
+
+        # The H nodes just outside the box see the incident E on the edges of the box. The aux H
+        # at position s stands for the incident field at s + 1/2: Hy = cos H, Hx = - sin H
+        corrections = [
+            (Fy, (numpy.concatenate((x0 - 1, x1)), numpy.concatenate((yr, yr))), self._E,
+             numpy.concatenate((depth(x0, yr), depth(x1, yr))),
+             numpy.concatenate((-ch * ones_y, ch * ones_y))),
+            (Fx, (numpy.concatenate((xr, xr)), numpy.concatenate((y0 - 1, y1))), self._E,
+             numpy.concatenate((depth(xr, y0), depth(xr, y1))),
+             numpy.concatenate((ch * ones_x, -ch * ones_x))),
+        ]
+        self._h_corrections = [c for c in (self._corrections(*args) for args in corrections) if c is not None]
+
+        # The E nodes on the edges of the box see the incident H just outside of it
+        corrections = [
+            (Fz, (numpy.concatenate((x0, x1)), numpy.concatenate((yr, yr))), self._H,
+             numpy.concatenate((depth(x0 - 0.5, yr), depth(x1 + 0.5, yr))) - 0.5,
+             numpy.concatenate((-ce * cos * ones_y, ce * cos * ones_y))),
+            (Fz, (numpy.concatenate((xr, xr)), numpy.concatenate((y0, y1))), self._H,
+             numpy.concatenate((depth(xr, y0 - 0.5), depth(xr, y1 + 0.5))) - 0.5,
+             numpy.concatenate((-ce * sin * ones_x, ce * sin * ones_x))),
+        ]
+        self._e_corrections = [c for c in (self._corrections(*args) for args in corrections) if c is not None]
+
+        # Nodes next to the edges of the box sorted by their depth along the auxiliary grid, with
+        # the bounding box of those up to each of them, for active_region
+        xr, yr = numpy.arange(xs[0] - 1, xs[1] + 2), numpy.arange(ys[0] - 1, ys[1] + 2)
+        x = numpy.concatenate((numpy.full(len(yr), xs[0] - 1), numpy.full(len(yr), xs[1] + 1), xr, xr))
+        y = numpy.concatenate((yr, yr, numpy.full(len(xr), ys[0] - 1), numpy.full(len(xr), ys[1] + 1)))
+        order = numpy.argsort(depth(x, y), kind='stable')
+        x, y = x[order], y[order]
+        self._depths = depth(x, y)
+        self._reached = tuple(f.accumulate(v) for f in (numpy.minimum, numpy.maximum) for v in (x, y))
 
-        self._bound_Et = grid.get_field('z')._data[xs[0]:xs[1]+1,ys[1]]
-        self._bound_Ht = grid.get_field('x')._data[xs[0]:xs[1]+1,ys[1]]
-        self._bound_Eb = grid.get_field('z')._data[xs[0]:xs[1]+1,ys[0]]
-        self._bound_Hb = grid.get_field('x')._data[xs[0]:xs[1]+1,ys[0]-1]
+    def active_region(self, t):
+        """
+        Same as SourceDipole.active_region. The incident field is zero beyond the front of the
+        pulse on the auxiliary grid, which moves by one cell per step from its start
+        """
+        n = numpy.searchsorted(self._depths, t + 3, side='right')
+        if n == 0:
+            return []
+        x0, y0, x1, y1 = (v[n - 1] for v in self._reached)
+        return [((x0, y0), (x1, y1))]
 
-        self._E = numpy.zeros(NP)
-        self._H = numpy.zeros(NP - 1)
-        self._auxfield = [numpy.zeros(3), numpy.zeros(3)]
+    def get_state(self):
+        return {"E": self._E, "H": self._H,
+                "auxfield": self._history[[self._parity, 1 - self._parity]]}
+
+    def set_state(self, state):
+        self._E[:] = state["E"]
+        self._H[:] = state["H"]
+        self._history[...] = state["auxfield"]
+        self._parity = 0
+
+    @classmethod
+    def batch(cls, boxes, grid, start, nsteps):
+        """
+        Drive a group of TFSF boxes with pulses tabulated by chunks of steps
+        """
+        samples = Source.samples(boxes)
+
+        def update(t):
+            for box, pulse in zip(boxes, samples[t]):
+                box._update(pulse)
+
+        return update
 
 
 class Pulse(object):
     """
-    Abstract pulse class. Subclasses should override the update method
+    Abstract pulse class. The parameters of a pulse are given in SI units, and adimensionalise
+    converts them to units of the time step of a grid, in which the pulse is then evaluated.
+    Subclasses should override __call__, and sample when it can be vectorized
     """
     def __call__(self, t):
         """Return value of source at time t"""
         raise NotImplementedError
 
+    def sample(self, t):
+        """
+        Values of the source at an array of times
+        :param t: numpy array of times, in units of the time step
+        :return: numpy array of the same shape
+        """
+        return numpy.array([self(ti) for ti in numpy.ravel(t)], dtype="double").reshape(numpy.shape(t))
+
+    def adimensionalise(self, grid):
+        """
+        Set the time step the pulse is evaluated with. Calling it again (e.g. for a pulse shared
+        by several sources) has no further effect
+        """
+        self._dt = grid.dt
+
+    def key(self):
+        """
+        :return: hashable description of the pulse, equal for pulses giving the same waveform
+        """
+        return (type(self).__name__,) + tuple(sorted(
+            (k, v) for k, v in vars(self).items() if not k.startswith('_')))
+
 
 class PulseGaussian(Pulse):
+    """
+    Gaussian envelope of width tau centered on mu, with a carrier of angular frequency omega
+    """
     # noinspection PyPep8Naming
     def __init__(self, E0, mu, tau, omega):
         self.ampl = E0
@@ -111,10 +390,207 @@ class PulseGaussian(Pulse):
         self.omega = omega
 
     def __call__(self, t):
-        return self.ampl*(numpy.math.exp(-(t - self.mu)**2 / self.tau**2) *
-                          numpy.math.cos(self.omega*t))
+        return self.ampl*(numpy.math.exp(-(t - self._mu)**2 / self._tau**2) *
+                          numpy.math.cos(self._omega*t))
+
+    def sample(self, t):
+        return self.ampl*(numpy.exp(-(t - self._mu)**2 / self._tau**2) * numpy.cos(self._omega*t))
+
+    def adimensionalise(self, grid):
+        super().adimensionalise(grid)
+        self._mu = self.mu / grid.dt
+        self._tau = self.tau / grid.dt
+        self._omega = self.omega * grid.dt
+
+
+class PulseGaussianDerivative(Pulse):
+    """
+    First derivative of a Gaussian of width tau centered on mu, times -tau (a single cycle
+    with a broad spectrum peaked at omega = sqrt(2) / tau), with peak value ~0.86 E0
+    """
+    # noinspection PyPep8Naming
+    def __init__(self, E0, mu, tau):
+        self.ampl = E0
+        self.mu = mu
+        self.tau = tau
+
+    def __call__(self, t):
+        x = (t - self._mu) / self._tau
+        return self.ampl * 2 * x * numpy.math.exp(-x**2)
+
+    def sample(self, t):
+        x = (t - self._mu) / self._tau
+        return self.ampl * 2 * x * numpy.exp(-x**2)
+
+    def adimensionalise(self, grid):
+        super().adimensionalise(grid)
+        self._mu = self.mu / grid.dt
+        self._tau = self.tau / grid.dt
+
+
+class PulseRicker(Pulse):
+    """
+    Ricker wavelet (second derivative of a Gaussian) of peak frequency fp (Hz), centered on delay
+    """
+    # noinspection PyPep8Naming
+    def __init__(self, E0, fp, delay):
+        self.ampl = E0
+        self.fp = fp
+        self.delay = delay
+
+    def __call__(self, t):
+        x = (numpy.pi * self._fp * (t - self._delay))**2
+        return self.ampl * (1 - 2 * x) * numpy.math.exp(-x)
+
+    def sample(self, t):
+        x = (numpy.pi * self._fp * (t - self._delay))**2
+        return self.ampl * (1 - 2 * x) * numpy.exp(-x)
+
+    def adimensionalise(self, grid):
+        super().adimensionalise(grid)
+        self._fp = self.fp * grid.dt
+        self._delay = self.delay / grid.dt
+
+
+class PulseCW(Pulse):
+    """
+    Continuous wave of angular frequency omega, switched on smoothly over a time ramp (raised
+    cosine envelope) to avoid exciting a broad spectrum
+    """
+    # noinspection PyPep8Naming
+    def __init__(self, E0, omega, ramp, phase=0.):
+        self.ampl = E0
+        self.omega = omega
+        self.ramp = ramp
+        self.phase = phase
+
+    def __call__(self, t):
+        return self.sample(numpy.array(t, dtype="double"))[()]
+
+    def sample(self, t):
+        envelope = 0.5 * (1 - numpy.cos(numpy.pi * numpy.clip(t / self._ramp, 0, 1)))
+        return self.ampl * envelope * numpy.cos(self._omega * t + self.phase)
 
     def adimensionalise(self, grid):
-        self.mu = self.mu / grid.dt
-        self.tau = self.tau / grid.dt
-        self.omega = self.omega * grid.dt
+        super().adimensionalise(grid)
+        self._omega = self.omega * grid.dt
+        self._ramp = max(self.ramp / grid.dt, 1.)
+
+
+class PulseTabulated(Pulse):
+    """
+    Arbitrary waveform, linearly interpolated between samples at given times and zero outside
+    """
+    def __init__(self, times, values, E0=1.):
+        """
+        :param times: increasing times of the samples (s)
+        :param values: values of the samples
+        :param E0: amplitude the values are scaled by
+        """
+        self.times = numpy.asarray(times, dtype="double")
+        self.values = numpy.asarray(values, dtype="double")
+        self.ampl = E0
+        if self.times.shape != self.values.shape or self.times.ndim != 1:
+            raise Exception("Error: times and values of a tabulated pulse must be 1D arrays of the same size")
+
+    def __call__(self, t):
+        return self.sample(numpy.array(t, dtype="double"))[()]
+
+    def sample(self, t):
+        return self.ampl * numpy.interp(t, self._times, self.values, left=0., right=0.)
+
+    def adimensionalise(self, grid):
+        super().adimensionalise(grid)
+        self._times = self.times / grid.dt
+
+    def key(self):
+        return (type(self).__name__, self.ampl, self.times.tobytes(), self.values.tobytes())
+
+
+class Waveform(object):
+    """
+    Samples of a pulse at the steps of a grid. They are materialized by windows of consecutive
+    steps aligned to multiples of chunk, the window being replaced when a step outside of it is
+    requested
+    """
+    def __init__(self, pulse, grid, chunk):
+        self.pulse = pulse
+        self.grid = grid
+        self.chunk = chunk
+        self._first = 0
+        self._size = 0
+        self._data = None
+        self.samples(0, chunk)
+
+    def samples(self, start, nsteps):
+        """
+        :return: array of the samples at steps start to start + nsteps - 1
+        """
+        if start < self._first or start + nsteps > self._first + self._size:
+            # The pulse may be shared with a grid with another time step
+            self.pulse.adimensionalise(self.grid)
+            self._first = start - start % self.chunk
+            # Whole chunks, so that the next requests of a run done in pieces fall inside
+            self._size = -(-(start + nsteps - self._first) // self.chunk) * self.chunk
+            self._data = self.pulse.sample(numpy.arange(self._first, self._first + self._size, dtype="double"))
+        return self._data[start - self._first:start - self._first + nsteps]
+
+    def __getitem__(self, t):
+        i = t - self._first
+        if 0 <= i < self._size:
+            return self._data[i]
+        return self.samples(t, 1)[0]
+
+
+class WaveformCache(object):
+    """
+    Waveforms of the sources of a grid, shared by the sources having the same pulse parameters
+    """
+    def __init__(self, grid, chunk=4096):
+        """
+        :param grid: FDTDPoC.engine.solver.Grid object
+        :param chunk: number of steps materialized at once
+        """
+        self.grid = grid
+        self.chunk = chunk
+        self._waveforms = {}
+
+    @staticmethod
+    def of(grid):
+        """
+        :return: the cache of a grid, created on first use
+        """
+        cache = getattr(grid, '_waveforms', None)
+        if cache is None or cache.grid is not grid:
+            cache = grid._waveforms = WaveformCache(grid)
+        return cache
+
+    def get(self, pulse):
+        """
+        :return: Waveform object for the pulse, shared with the pulses with the same key
+        """
+        key = (pulse.key(), self.grid.dt)
+        if key not in self._waveforms:
+            self._waveforms[key] = Waveform(pulse, self.grid, self.chunk)
+        return self._waveforms[key]
+
+
+class SampleTable(object):
+    """
+    Samples of a set of waveforms, as rows indexed by step materialized by chunks of steps. A
+    chunk runs from the step requested to the end of the aligned window of the waveforms holding
+    it, so that refilling it never makes them sample their pulse again
+    """
+    def __init__(self, waveforms):
+        self.waveforms = waveforms
+        self.chunk = max(w.chunk for w in waveforms)
+        self._first = 0
+        self._size = 0
+        self._rows = None
+
+    def __getitem__(self, t):
+        i = t - self._first
+        if not 0 <= i < self._size:
+            self._first, self._size, i = t, self.chunk - t % self.chunk, 0
+            self._rows = numpy.column_stack([w.samples(t, self._size) for w in self.waveforms])
+        return self._rows[i]
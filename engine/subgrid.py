@@ -0,0 +1,253 @@
+############################################################
+# Local mesh refinement of a rectangular region            #
+#                                                          #
+############################################################
+#           Copyright (c) 2018 Stefano Guazzotti           #
+############################################################
+
+"""
+Subgridding: a rectangular patch of a grid is also solved on a finer mesh, with dx and dt divided
+by an odd refinement factor r, so that small features only need the fine cells where they are.
+
+    sub = Subgrid(grid, (300, 380), (340, 420), factor=5)
+    PassiveMaterial(sub.fine, 3.5, sub.to_fine((310, 390)), sub.to_fine((330, 410)))
+
+The fine patch is a Grid of its own (sub.fine), on which materials, sources and monitors are set
+up as usual, in fine coordinates. With r odd, every node and edge of the coarse grid within the
+patch has a node or edge of the fine one at the same place, and the middle of the r fine steps
+done for a coarse step ends at the time of the coarse magnetic field. At every coarse step:
+
+* the coarse grid is stepped everywhere, the patch included
+* the fine grid does r steps, with its terminating nodes interpolated from the coarse ones,
+  linearly along the boundary of the patch and in time between the two coarse steps
+* the coarse fields strictly inside the patch are replaced by averages of the fine ones around
+  them, the x, y components over the r fine edges along each coarse edge after the middle fine
+  step, the z component over the r x r fine nodes around each coarse node after the last one
+
+so the coarse boundary of the patch sees the fine solution inside it. Copying the fine values at
+the coarse places instead would alias the modes that only the fine grid supports back into the
+coarse one, which makes the coupled grids unstable after a few thousand steps. Averaging pushes
+this back by an order of magnitude, but like most schemes interpolating in space and time the
+coupling stays weakly unstable: the residual fields left in the patch pick up a mode of about
+four coarse steps and 1.4 coarse cells, which grows three times every 500 steps once started.
+On a 100x100 grid with a 20x40 patch (r = 5) this starts after about 10^4 coarse steps under a
+continuous source and 1.7 x 10^4 after a pulse, far beyond the time a pulse takes to go through
+it, but runs should stay well below that. The peak of the fine field is checked every `check`
+coarse steps, and the run stops with an exception once it keeps growing (see Subgrid.GROWTH).
+
+Materials of the fine grid should stay off its outermost ring of coarse cells, whose coarse
+update does not see them.
+"""
+
+import numpy
+import engine.boundaries as boundaries
+import engine.checkpoint as checkpoint
+from engine.solver import Grid
+
+
+class Subgrid(object):
+    """
+    Refined rectangular patch of a grid, stepped with r fine steps per coarse step (see the
+    module documentation)
+    """
+    # The coupling is taken as unstable once the peak of the fine field over a window of coarse
+    # steps is more than GROWTH times the one of the previous window, for WINDOWS windows in a
+    # row. Windows starting below FLOOR times the highest peak so far do not count, so that the
+    # arrival of a pulse from zero fields is not mistaken for it
+    GROWTH = 2.
+    WINDOWS = 4
+    FLOOR = 1e-6
+
+    def __init__(self, grid, bleft, tright, factor=3, update='fused', priority=-50, check=500):
+        """
+        :param grid: FDTDPoC.engine.solver.Grid object, refined
+        :param bleft: bottom left node of the patch on the coarse grid (included)
+        :param tright: top right node of the patch on the coarse grid (included)
+        :param factor: refinement factor, odd
+        :param update: update engine of the fine grid
+        :param priority: priority of the post E step callback on the coarse grid, which should
+            come after the sources and boundaries and before the monitors
+        :param check: window, in coarse steps, of the check of the growth of the fine field,
+            raising an exception once the coupling goes unstable (see the module
+            documentation). 0 disables the check
+        """
+        if factor < 1 or factor % 2 == 0:
+            raise Exception("Error: the refinement factor of a subgrid must be odd, not {}".format(factor))
+        (x0, y0), (x1, y1) = bleft, tright
+        if x0 < 1 or y0 < 1 or x1 > grid.shape[0] - 2 or y1 > grid.shape[1] - 2:
+            raise Exception("Error: subgrid {}-{} must be inside the terminating nodes of {}".format(
+                bleft, tright, grid))
+        if x1 - x0 < 2 or y1 - y0 < 2:
+            raise Exception("Error: subgrid {}-{} must span at least two cells along x and y".format(
+                bleft, tright))
+        self.grid = grid
+        self.bleft = (x0, y0)
+        self.tright = (x1, y1)
+        self.factor = r = factor
+        self.check = check
+        self._reset_check()
+
+        # The terminating nodes of the fine grid are set from the coarse ones, never updated
+        self.fine = Grid((x1 - x0) * r + 1, (y1 - y0) * r + 1, dx=grid.dx / r, update=update,
+                         dtype=grid.precision, polarization=grid.polarization,
+                         xm=boundaries.PEC, xp=boundaries.PEC, ym=boundaries.PEC, yp=boundaries.PEC)
+        self.fine.register_step_callback("post", "h", self.restrict_h, priority=-1000)
+        self.fine.register_step_callback("post", "e", self.interpolate, priority=1000)
+        grid.register_build_callback(self.build)
+        grid.register_step_callback("post", "e", self, priority=priority)
+
+    def to_fine(self, position):
+        """
+        :param position: node of the coarse grid, possibly fractional
+        :return: node of the fine grid at the same place
+        """
+        return tuple(int(round((p - o) * self.factor)) for p, o in zip(position, self.bleft))
+
+    def build(self, grid):
+        r = self.factor
+        (x0, y0), (x1, y1) = self.bleft, self.tright
+        nx, ny = x1 - x0, y1 - y0
+
+        # Coarse nodes on the boundary of the patch, and fine nodes on the boundary of the fine
+        # grid, counterclockwise from the bottom left corner
+        coarse = _ring(x0, y0, nx, ny)
+        fine = _ring(0, 0, nx * r, ny * r)
+        self._coarse = numpy.ravel_multi_index(coarse, grid.shape)
+        self._nodes = numpy.ravel_multi_index(fine, self.fine.shape)
+        # Each fine node lies between two consecutive coarse nodes of the ring
+        position = numpy.arange(len(self._nodes)) / r
+        self._lo = numpy.floor(position).astype(int)
+        self._hi = (self._lo + 1) % len(self._coarse)
+        self._w = (position - self._lo).astype(grid.dtype)
+
+        self.fine.build()
+
+        # Coarse fields strictly inside the patch, each with the fine fields averaged into it
+        # given as one strided view for each offset of the fine fields around the coarse ones
+        h = (r - 1) // 2
+        inner = [(slice(r + k, nx * r + k, r), slice(r + k, ny * r + k, r)) for k in range(-h, h + 1)]
+        self._average = [
+            ("z", (slice(x0 + 1, x1), slice(y0 + 1, y1)), [(i, j) for i, _ in inner for _, j in inner]),
+            ("x", (slice(x0 + 1, x1), slice(y0, y1)), [(inner[h][0], slice(k, None, r)) for k in range(r)]),
+            ("y", (slice(x0, x1), slice(y0 + 1, y1)), [(slice(k, None, r), inner[h][1]) for k in range(r)]),
+        ]
+        self._sums = [numpy.empty(self.grid.get_field(comp)._data[coarse].shape, dtype=grid.dtype)
+                      for comp, coarse, views in self._average]
+
+        # Boundary values interpolated along the ring at the previous and current coarse steps
+        self._boundary = grid._Fz._data.ravel()[self._coarse]
+        self._f0 = self._along(self._boundary)
+        self._f1 = numpy.empty_like(self._f0)
+        self._buf = numpy.empty_like(self._f0)
+
+    def _along(self, values, out=None):
+        """
+        :return: values at the coarse nodes of the ring interpolated at the fine nodes
+        """
+        if out is None:
+            out = numpy.empty(len(self._nodes), dtype=values.dtype)
+        numpy.subtract(values[self._hi], values[self._lo], out=out)
+        out *= self._w
+        out += values[self._lo]
+        return out
+
+    def __call__(self, t):
+        """
+        Step the fine grid from coarse step t to t + 1, the coarse one having just been stepped
+        """
+        grid = self.grid
+        grid._Fz._data.ravel().take(self._coarse, out=self._boundary)
+        self._along(self._boundary, out=self._f1)
+        self.fine.run(self.factor, start=t * self.factor)
+        self._restrict(0)
+        self._f0, self._f1 = self._f1, self._f0
+        if self.check:
+            self._watch(t)
+
+    def _reset_check(self):
+        self._peak = 0.
+        self._previous = 0.
+        self._highest = 0.
+        self._growing = 0
+
+    def _watch(self, t):
+        """
+        Keep track of the peak of the fine field over windows of check coarse steps, and raise
+        once it grows as for an unstable coupling (see GROWTH)
+        """
+        data = self.fine._Fz._data
+        self._peak = max(self._peak, data.max(), -data.min())
+        if (t + 1) % self.check:
+            return
+        previous, self._previous, self._peak = self._previous, self._peak, 0.
+        self._highest = max(self._highest, self._previous)
+        if previous > self.FLOOR * self._highest and self._previous > self.GROWTH * previous:
+            self._growing += 1
+        else:
+            self._growing = 0
+        if self._growing >= self.WINDOWS:
+            raise Exception(
+                "Error: subgrid {}-{} unstable, its field grew more than {:.0f} times over the {} "
+                "coarse steps up to step {} (see engine.subgrid)".format(
+                    self.bleft, self.tright, self.GROWTH ** self.WINDOWS, self.WINDOWS * self.check, t))
+
+    def _restrict(self, k):
+        """
+        Replace the coarse fields of the k-th entry of _average by the averages of the fine ones
+        """
+        comp, coarse, views = self._average[k]
+        data, out = self.fine.get_field(comp)._data, self._sums[k]
+        numpy.copyto(out, data[views[0]])
+        for view in views[1:]:
+            out += data[view]
+        out /= len(views)
+        self.grid.get_field(comp)._data[coarse] = out
+
+    def interpolate(self, t):
+        """
+        Set the terminating nodes of the fine grid at fine step t
+        """
+        w = (t % self.factor + 1) / self.factor
+        numpy.subtract(self._f1, self._f0, out=self._buf)
+        self._buf *= w
+        self._buf += self._f0
+        self.fine._Fz._data.ravel()[self._nodes] = self._buf
+
+    def restrict_h(self, t):
+        """
+        Average the x, y components of the fine grid into the coarse one, after the middle fine
+        step
+        """
+        if t % self.factor == (self.factor - 1) // 2:
+            self._restrict(1)
+            self._restrict(2)
+
+    def active_region(self, t):
+        """
+        The fine fields averaged into the coarse grid may be nonzero anywhere in the patch (see
+        engine.updates.ActiveRegion)
+        """
+        return [(self.bleft, self.tright)]
+
+    def get_state(self):
+        metadata, arrays = checkpoint.get_state(self.fine)
+        state = {"fine." + name: value for name, value in arrays.items()}
+        state["boundary"] = self._f0
+        return state
+
+    def set_state(self, state):
+        prefix = "fine."
+        checkpoint.set_state(self.fine, {name[len(prefix):]: value for name, value in state.items()
+                                         if name.startswith(prefix)})
+        self._f0[...] = state["boundary"]
+        self._reset_check()
+
+
+def _ring(x0, y0, nx, ny):
+    """
+    :return: (x, y) indices of the nodes on the boundary of the rectangle of nx x ny cells with
+        bottom left node (x0, y0), counterclockwise from it, each node once
+    """
+    x = numpy.concatenate([numpy.arange(nx), numpy.full(ny, nx), numpy.arange(nx, 0, -1), numpy.zeros(ny, int)])
+    y = numpy.concatenate([numpy.zeros(nx, int), numpy.arange(ny), numpy.full(nx, ny), numpy.arange(ny, 0, -1)])
+    return x + x0, y + y0
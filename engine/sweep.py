@@ -0,0 +1,214 @@
+############################################################
+# Parameter sweeps over a process pool                     #
+#                                                          #
+############################################################
+#           Copyright (c) 2018 Stefano Guazzotti           #
+############################################################
+
+"""
+Run every combination of a set of parameters of a base scenario headless in a process pool, and
+gather the requested outputs in a single .npz file:
+
+    python -m engine.sweep sweep.json -o results.npz [--workers N]
+
+The sweep file gives the base scenario (inline or as a path relative to the sweep file), the
+values of each parameter, addressed by its dotted path in the scenario, and the outputs to keep:
+
+{
+    "base": "scenario.json",
+    "parameters": {
+        "materials.0.n": [1.5, 2.0, 2.5],
+        "sources.0.pulse.omega": [1.2e15, 1.8e15]
+    },
+    "outputs": ["probes", "dft"]
+}
+
+Outputs are "probes" (time series of Fz at scenario["output"]["probes"]) and "dft" (running DFTs
+as set by scenario["output"]["dft"]). Each variant is saved as soon as it completes in a
+<results>.parts directory, so an interrupted sweep resumes where it stopped. A failing variant
+does not stop the sweep: its error is reported, its outputs are NaN, and it is run again when
+the sweep is resumed.
+"""
+
+import argparse
+import copy
+import itertools
+import json
+import os
+import traceback
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import numpy
+import engine.scenario as scenarios
+from engine.monitors import FrequencyMonitor, Monitor
+
+
+def set_parameter(scenario, path, value):
+    """
+    Set a value of a scenario addressed by a dotted path, e.g. "sources.0.pulse.omega"
+    """
+    keys = path.split(".")
+    node = scenario
+    for key in keys[:-1]:
+        node = node[int(key)] if isinstance(node, list) else node[key]
+    if isinstance(node, list):
+        node[int(keys[-1])] = value
+    else:
+        node[keys[-1]] = value
+
+
+def variants(base, parameters):
+    """
+    :param base: dictionary describing the base scenario
+    :param parameters: dictionary of dotted path -> list of values
+    :return: list of (values, scenario), one per combination of the parameters
+    """
+    names = sorted(parameters.keys())
+    result = []
+    for values in itertools.product(*(parameters[name] for name in names)):
+        scenario = copy.deepcopy(base)
+        for name, value in zip(names, values):
+            set_parameter(scenario, name, value)
+        result.append((dict(zip(names, values)), scenario))
+    return result
+
+
+def run_variant(scenario, outputs):
+    """
+    Run a scenario headless and return the requested outputs. Runs in the worker processes
+    :param scenario: dictionary describing the scenario
+    :param outputs: names of the outputs to keep ("probes" and/or "dft")
+    :return: dictionary of numpy arrays
+    """
+    output = scenario.get("output", {})
+    nsteps = scenario.get("run", {}).get("nsteps", 1000)
+    grid = scenarios.make_grid(scenario)
+
+    # Worker processes or threads of the engine are released even if the variant fails
+    try:
+        monitor = dft = None
+        if "probes" in outputs:
+            monitor = Monitor(grid, points=output["probes"], length=nsteps)
+        if "dft" in outputs:
+            dft = FrequencyMonitor(grid, **output["dft"])
+
+        grid.build()
+        grid.run(nsteps)
+    finally:
+        grid.close()
+
+    result = {}
+    if monitor is not None:
+        result["probes"] = numpy.array(monitor.data)
+    if dft is not None:
+        for comp, values in dft.dft.items():
+            result["dft_F" + comp] = values
+    return result
+
+
+def _guarded(index, scenario, outputs):
+    try:
+        return index, run_variant(scenario, outputs), None
+    except Exception:
+        return index, None, traceback.format_exc()
+
+
+def run(sweep, path, workers=None, base_dir="."):
+    """
+    Run a sweep, resuming it if partial results exist
+    :param sweep: dictionary describing the sweep
+    :param path: consolidated result file (.npz)
+    :param workers: number of worker processes (default: one per CPU)
+    :param base_dir: directory against which the path of the base scenario is resolved
+    :return: dictionary of variant index -> error message for the failed variants
+    """
+    base = sweep["base"]
+    if not isinstance(base, dict):
+        base = scenarios.load(os.path.join(base_dir, base))
+    outputs = sweep.get("outputs", ["probes"])
+    todo = variants(base, sweep["parameters"])
+
+    parts = path + ".parts"
+    os.makedirs(parts, exist_ok=True)
+
+    # Partial results are only meaningful for the very same list of variants
+    manifest = os.path.join(parts, "sweep.json")
+    description = {"base": base, "parameters": sweep["parameters"], "outputs": outputs}
+    if os.path.exists(manifest):
+        with open(manifest) as f:
+            if json.load(f) != json.loads(json.dumps(description)):
+                raise Exception("Error: {} holds the results of a different sweep".format(parts))
+    else:
+        with open(manifest, "w") as f:
+            json.dump(description, f, indent=2)
+
+    def part(i):
+        return os.path.join(parts, "variant_{:05d}.npz".format(i))
+
+    pending = [i for i in range(len(todo)) if not os.path.exists(part(i))]
+    print("{} variants, {} already done".format(len(todo), len(todo) - len(pending)))
+
+    failures = {}
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = {pool.submit(_guarded, i, todo[i][1], outputs): i for i in pending}
+        for future in as_completed(futures):
+            i = futures[future]
+            try:
+                i, result, error = future.result()
+            except Exception:
+                # The worker itself died
+                result, error = None, traceback.format_exc()
+            if error is not None:
+                failures[i] = error
+                print("variant {} {} failed:\n{}".format(i, todo[i][0], error))
+                continue
+            # Write then rename, so that an interrupted write does not count as done
+            numpy.savez(part(i) + ".tmp.npz", **result)
+            os.replace(part(i) + ".tmp.npz", part(i))
+            print("variant {} {} done".format(i, todo[i][0]))
+
+    consolidate(todo, part, path)
+    return failures
+
+
+def consolidate(todo, part, path):
+    """
+    Gather the results of the single variants in one .npz file, with one array per output
+    stacked along the first axis (NaN for failed variants), one array per parameter and a
+    boolean "done" array
+    """
+    results = {}
+    done = numpy.zeros(len(todo), dtype=bool)
+    for i in range(len(todo)):
+        if not os.path.exists(part(i)):
+            continue
+        done[i] = True
+        with numpy.load(part(i)) as data:
+            for name in data.files:
+                if name not in results:
+                    results[name] = numpy.full((len(todo),) + data[name].shape, numpy.nan,
+                                               dtype=numpy.result_type(data[name].dtype, float))
+                results[name][i] = data[name]
+
+    arrays = {"output_" + name: values for name, values in results.items()}
+    for name in todo[0][0] if todo else ():
+        arrays["parameter_" + name] = numpy.array([values[name] for values, scenario in todo])
+    arrays["done"] = done
+    numpy.savez(path, **arrays)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run a parameter sweep of an FDTD scenario")
+    parser.add_argument("sweep", help="sweep file (JSON)")
+    parser.add_argument("-o", "--output", default="results.npz", help="consolidated result file")
+    parser.add_argument("--workers", type=int, default=None, help="number of worker processes")
+    args = parser.parse_args(argv)
+
+    with open(args.sweep) as f:
+        sweep = json.load(f)
+    failures = run(sweep, args.output, args.workers, os.path.dirname(os.path.abspath(args.sweep)))
+    if failures:
+        print("{} variants failed: {}".format(len(failures), sorted(failures)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,269 @@
+############################################################
+# Update engines for the bulk H and E field updates        #
+#                                                          #
+############################################################
+#           Copyright (c) 2018 Stefano Guazzotti           #
+############################################################
+
+import numpy
+
+
+class ActiveRegion(object):
+    """
+    Conservative bounding box of the nonzero fields of a grid, to which the engines restrict the
+    bulk updates. The box starts from the regions where the step callbacks inject fields (given
+    by their active_region method, see seed) and grows by one node on every side at every half
+    step, faster than the fields can spread, until it covers the whole grid
+    """
+    def __init__(self, grid):
+        self.shape = grid.shape
+        self.box = None
+        self.full = False
+        self._sources = []
+
+    def seed(self, schedule):
+        """
+        Collect the step callbacks injecting fields, i.e. those with an active_region method
+        :param schedule: callbacks of the grid, as tuples for each phase
+        """
+        self._sources = []
+        for phase in schedule:
+            for callback in phase:
+                if hasattr(callback, 'active_region') and all(callback is not s for s in self._sources):
+                    self._sources.append(callback)
+
+    def fill(self):
+        """Give up tracking, e.g. once the fields have been set from a checkpoint"""
+        self.full = True
+
+    def add(self, bleft, tright):
+        """
+        Extend the box to a rectangle of nodes, both corners included
+        """
+        sx, sy = self.shape
+        x0, y0 = max(int(bleft[0]), 0), max(int(bleft[1]), 0)
+        x1, y1 = min(int(tright[0]), sx - 1), min(int(tright[1]), sy - 1)
+        if self.box is not None:
+            x0, x1 = min(x0, self.box[0]), max(x1, self.box[1])
+            y0, y1 = min(y0, self.box[2]), max(y1, self.box[3])
+        self.box = (x0, x1, y0, y1)
+
+    def grow(self, t):
+        """
+        Grow the box for the next half step of step t
+        :return: (a, b, c, d), the rows a to b - 1 and columns c to d - 1 of nodes to update (see
+            fused_h and fused_e)
+        """
+        sx, sy = self.shape
+        if self.full:
+            return 0, sx, 0, sy
+        for source in self._sources:
+            for bleft, tright in source.active_region(t):
+                self.add(bleft, tright)
+        if self.box is None:
+            return 0, 0, 0, 0
+        x0, x1, y0, y1 = self.box
+        self.box = x0, x1, y0, y1 = max(x0 - 1, 0), min(x1 + 1, sx - 1), max(y0 - 1, 0), min(y1 + 1, sy - 1)
+        if (x0, x1, y0, y1) == (0, sx - 1, 0, sy - 1):
+            self.full = True
+        return x0, x1 + 1, y0, y1 + 1
+
+
+class Update(object):
+    """
+    Abstract update engine. An engine performs the bulk H and E updates of a Grid, everything
+    else (boundaries, sources, materials...) is done by the step callbacks of the grid.
+    """
+    def __init__(self, grid):
+        self.grid = grid
+
+    def zeros(self, shape):
+        """Allocate a zeroed field array"""
+        return numpy.zeros(shape, dtype=self.grid.dtype)
+
+    def build(self):
+        """Prepare the engine. Called by Grid.build once all the build callbacks have run"""
+        pass
+
+    def close(self):
+        """Release the resources held by the engine, if any"""
+        pass
+
+    def step_h(self, t):
+        """Update the x and y components at step t (the magnetic field for TE, electric for TM)"""
+        raise NotImplementedError
+
+    def step_e(self, t):
+        """Update the z component at step t"""
+        raise NotImplementedError
+
+
+class DefaultUpdate(Update):
+    """
+    Reference engine, delegating the updates to Field.step. The first half step updates Fx and
+    Fy (H for TE, E for TM), the second one Fz
+    """
+    def step_h(self, t):
+        grid = self.grid
+        if grid.polarization == 'tm':
+            for field, epsr, ca in zip((grid._Fx, grid._Fy), grid._epsr_edges, grid._cha or (None, None)):
+                if ca is not None:
+                    field._data *= ca
+                field.step(t, grid._Fz, epsr)
+            return
+        grid._Fx.step(t, grid._Fz)
+        grid._Fy.step(t, grid._Fz)
+
+    def step_e(self, t):
+        grid = self.grid
+        if grid.polarization == 'tm':
+            grid._Fz.step(t, grid._Fx, grid._Fy)
+        elif grid._ca is None:
+            grid._Fz.step(t, grid._Fx, grid._Fy, grid._epsr)
+        else:
+            grid._Fz._data[1:-1, 1:-1] *= grid._ca
+            grid._Fz.step(t, grid._Fx, grid._Fy, grid._epsr_loss)
+
+
+def _view(buf, shape, k=0):
+    size = 1
+    for n in shape:
+        size *= n
+    return buf[k * size:(k + 1) * size].reshape(shape)
+
+
+def _pair(coef):
+    """
+    :return: the coefficients of hx and of hy from a coefficient of fused_h
+    """
+    if isinstance(coef, list):
+        return tuple(list(c) for c in zip(*(_pair(c) for c in coef)))
+    if coef is None or numpy.isscalar(coef):
+        return coef, coef
+    return coef
+
+
+def _scale(data, coef, tile):
+    """
+    In place multiplication by a coefficient: a scalar, an array over the whole grid of which the
+    tile is taken, or a list of either, one for each leading index of data (None is skipped)
+    """
+    if isinstance(coef, list):
+        for layer, c in zip(data, coef):
+            _scale(layer, c, tile)
+    elif numpy.isscalar(coef):
+        numpy.multiply(data, coef, out=data)
+    elif coef is not None:
+        numpy.multiply(data, coef[(Ellipsis,) + tile], out=data)
+
+
+def fused_h(ez, hx, hy, ch, buf, a, b, c=0, d=None, ca=None):
+    """
+    In place H update of the tile of rows a to b - 1 (along x) and columns c to d - 1 (along y)
+    of the grid, in terms of the nodes of ez. The arrays may have leading dimensions (e.g. the
+    members of an Ensemble), the tile being taken over the last two. For TM the same update
+    gives Ex, Ey from Hz (see Grid._bake_coefficients)
+    :param ez, hx, hy: field arrays of the whole grid
+    :param ch: C / Z0, or pair of coefficient arrays shaped as hx and hy. With one leading
+        dimension, also a list of them, one for each leading index
+    :param buf: flat scratch buffer of at least (b - a) * (d - c) elements per leading index
+    :param a, b: range of rows
+    :param c, d: range of columns (all of them by default)
+    :param ca: pair of loss coefficient arrays shaped as hx and hy, None without losses (or a
+        list of them, as for ch)
+    """
+    lead = ez.shape[:-2]
+    d = ez.shape[-1] if d is None else d
+    chx, chy = _pair(ch)
+    cax, cay = _pair(ca)
+
+    # hx has one column less than ez
+    dx = min(d, ez.shape[-1] - 1)
+    if dx > c:
+        tile = (slice(a, b), slice(c, dx))
+        s = _view(buf, lead + (b - a, dx - c))
+        numpy.subtract(ez[..., a:b, c + 1:dx + 1], ez[..., a:b, c:dx], out=s)
+        _scale(s, chx, tile)
+        _scale(hx[..., a:b, c:dx], cax, tile)
+        numpy.subtract(hx[..., a:b, c:dx], s, out=hx[..., a:b, c:dx])
+
+    # hy has one row less than ez
+    by = min(b, ez.shape[-2] - 1)
+    if by > a:
+        tile = (slice(a, by), slice(c, d))
+        s = _view(buf, lead + (by - a, d - c))
+        numpy.subtract(ez[..., a + 1:by + 1, c:d], ez[..., a:by, c:d], out=s)
+        _scale(s, chy, tile)
+        _scale(hy[..., a:by, c:d], cay, tile)
+        numpy.add(hy[..., a:by, c:d], s, out=hy[..., a:by, c:d])
+
+
+def fused_e(ez, hx, hy, ce, buf, a, b, c=0, d=None, ca=None):
+    """
+    In place E update of the tile of rows a to b - 1 (along x) and columns c to d - 1 (along y)
+    of the grid. The terminating nodes are never updated. Leading dimensions are handled as in
+    fused_h
+    :param ez, hx, hy: field arrays of the whole grid
+    :param ce: Cb coefficient (C * Z0 / epsr without losses) over the inner nodes of the grid, or
+        a scalar (e.g. -C / Z0 for TM). With one leading dimension, also a list of them, one for
+        each leading index
+    :param buf: flat scratch buffer of at least 2 * (b - a) * (d - c) elements per leading index
+    :param a, b: range of rows
+    :param c, d: range of columns (all of them by default)
+    :param ca: Ca coefficient over the inner nodes of the grid, None without losses (or a list of
+        them, as for ce)
+    """
+    lead = ez.shape[:-2]
+    d = ez.shape[-1] if d is None else d
+    a, b = max(a, 1), min(b, ez.shape[-2] - 1)
+    c, d = max(c, 1), min(d, ez.shape[-1] - 1)
+    if a >= b or c >= d:
+        return
+    s0 = _view(buf, lead + (b - a, d - c), 0)
+    s1 = _view(buf, lead + (b - a, d - c), 1)
+    tile = (slice(a - 1, b - 1), slice(c - 1, d - 1))
+
+    numpy.subtract(hy[..., a:b, c:d], hy[..., a - 1:b - 1, c:d], out=s0)
+    _scale(s0, ce, tile)
+    numpy.subtract(hx[..., a:b, c:d], hx[..., a:b, c - 1:d - 1], out=s1)
+    _scale(s1, ce, tile)
+    numpy.subtract(s0, s1, out=s0)
+    _scale(ez[..., a:b, c:d], ca, tile)
+    numpy.add(ez[..., a:b, c:d], s0, out=ez[..., a:b, c:d])
+
+
+class FusedUpdate(Update):
+    """
+    Engine doing the updates in place through the out= form of the ufuncs, with preallocated
+    scratch buffers and the coefficients baked once at build time (see Grid._bake_coefficients).
+    Results are bit-identical to DefaultUpdate where epsr == 1 and agree to rounding elsewhere.
+    With an ActiveRegion (Grid(..., track_active=True)) only its box is updated.
+    """
+    tracks_active = True
+
+    def build(self):
+        grid = self.grid
+        self._ch = grid._ch
+        self._cha = grid._cha
+        self._ce = grid._cb
+        self._ca = grid._ca
+        self._buf = numpy.empty(2 * grid.shape[0] * grid.shape[1], dtype=grid.dtype)
+        self._active = grid._active
+
+    def step_h(self, t):
+        grid = self.grid
+        a, b, c, d = (0, grid.shape[0], 0, None) if self._active is None else self._active.grow(t)
+        fused_h(grid._Fz._data, grid._Fx._data, grid._Fy._data, self._ch, self._buf, a, b, c, d,
+                ca=self._cha)
+
+    def step_e(self, t):
+        grid = self.grid
+        a, b, c, d = (0, grid.shape[0], 0, None) if self._active is None else self._active.grow(t)
+        fused_e(grid._Fz._data, grid._Fx._data, grid._Fy._data, self._ce, self._buf, a, b, c, d,
+                ca=self._ca)
+
+
+UPDATES = {
+    'default': DefaultUpdate,
+    'fused': FusedUpdate,
+}
@@ -1,6 +1,6 @@
 # Simple driver implementation, whose main purpose is testing.
 
-from datetime import datetime as dt
+import time
 import engine.solver as FDTD
 import matplotlib.animation as animation
 import matplotlib.pyplot as plt
@@ -8,31 +8,34 @@ import numpy
 import engine.boundaries as bounds
 import engine.sources as sources
 import engine.materials as materials
+from engine.live import LiveSolver
+from engine.monitors import Monitor
 from utilities import SafeLogNorm
 
-def to_msec(x):
-    return x.seconds * 1000 + x.microseconds/1000
-
-def run(grid, frames=1000, positions=None):
-
+def run(grid, frames=1000, positions=None, size=400):
+    """
+    Run the simulation for a number of steps in a background thread, showing a live view of
+    |Ez| downsampled to at most size x size pixels. The display only picks up the latest frame,
+    so the simulation runs as fast as it can whatever the frame rate
+    """
     fig = plt.figure()
     plt.subplots_adjust(top=0.8)
     ax = plt.axes(xlim=(-0.5,grid.shape[0]-0.5), ylim=(-0.5,grid.shape[1]-0.5))
     ax.set_aspect('equal')
 
     if positions is not None:
-        save_data = numpy.zeros((positions.shape[0], frames))
+        monitor = Monitor(grid, points=positions, length=frames)
 
-    data = grid.get_field(2)._data
-    im = ax.imshow(numpy.abs(numpy.transpose(data)), cmap=plt.get_cmap('inferno'),
+    live = LiveSolver(grid, frames, size=size)
+    # One pixel of the frames per block of factor x factor nodes
+    ny, nx = live.shape
+    extent = (-0.5, nx * live.factor - 0.5, ny * live.factor - 0.5, -0.5)
+    im = ax.imshow(numpy.zeros(live.shape), cmap=plt.get_cmap('inferno'), extent=extent,
                    norm=SafeLogNorm(vmin=1e-4, vmax=2))
     plt.colorbar(im, ax=ax)
 
-    time = [dt.now(), dt.now()]
-    elaps_gen = [0] * 50; elaps_rend = [0] * 50
-    txt = "frame {:4d}\nTimes: {:.2f} ms (gen.), {:.2f} ms (rend.)\nFPS: {:.1f}"
-    text0 = ax.text(int(shape[0]/2),int(shape[1]*1.20),
-                    txt.format(0, sum(elaps_gen)/len(elaps_gen), sum(elaps_rend)/len(elaps_rend), 0),
+    txt = "step {:4d}\nSolver: {:.0f} steps/s\nDisplay: {:.1f} FPS"
+    text0 = ax.text(int(grid.shape[0]/2),int(grid.shape[1]*1.20), txt.format(0, 0, 0),
                     horizontalalignment="center", verticalalignment="top", color="r", fontsize=16)
 
     max_n = max(grid._passive_materials, key=lambda x: x.n).n
@@ -44,41 +47,27 @@ def run(grid, frames=1000, positions=None):
                           alpha=0.5, color=c)
         )
 
-    def init():
-        data = grid.get_field(2)._data
-        im.set_data(numpy.abs(numpy.transpose(data)))
+    shown = [time.perf_counter()] * 30
 
     def update(i):
-        time[0] = dt.now()
-        elaps_rend.pop(0)
-        elaps_rend.append(to_msec(time[0] - time[1]))
-        grid.step(i)
-        time[1] = dt.now()
-        elaps_gen.pop(0)
-        elaps_gen.append(to_msec(time[1] - time[0]))
-        data = grid.get_field(2)._data
-        im.set_data(numpy.abs(numpy.transpose(data)))
-        text0.set_text(txt.format(
-            i, sum(elaps_gen)/len(elaps_gen), sum(elaps_rend)/len(elaps_rend),
-            1000 / (sum(elaps_rend)/len(elaps_rend) + sum(elaps_gen)/len(elaps_gen))
-        ))
-        if positions is not None:
-            for ind in range(len(positions)):
-                save_data[ind,i] = data[tuple(positions[ind])]
-
-    anim = animation.FuncAnimation(
-        fig,
-        update,
-        init_func=init,
-        frames=frames,
-        repeat=False,
-        interval=int(1000/30),
-        blit=False
-    )
-
+        frame = live.latest()
+        if frame is None:
+            return
+        step, data = frame
+        im.set_data(data)
+        shown.pop(0)
+        shown.append(time.perf_counter())
+        text0.set_text(txt.format(step, live.rate, (len(shown) - 1) / (shown[-1] - shown[0])))
+        if live.done:
+            anim.event_source.stop()
+
+    anim = animation.FuncAnimation(fig, update, interval=int(1000/30), blit=False)
+
+    live.start()
     plt.show()
+    live.stop()
     if positions is not None:
-        return save_data
+        return monitor.data.T
 
 if __name__ == '__main__':
     # Define grid size
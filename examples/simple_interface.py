@@ -6,35 +6,32 @@ import matplotlib
 from matplotlib.figure import Figure
 from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg
 
-from datetime import datetime as dt
+import time
 import engine as FDTD
 import matplotlib.animation as animation
 import matplotlib.pyplot as plt
 import numpy
 import engine.boundaries as bounds
 import engine.sources as sources
+from engine.live import LiveSolver
+from engine.monitors import Monitor
 from utilities import SafeLogNorm
 
 matplotlib.use('TkAgg')
 plt.ion()
 
-def to_msec(x):
-    return x.seconds * 1000 + x.microseconds/1000
-
 class Animation(Frame):
     txt = (
-        "Frame {frame:4d}", "{FPS:.1f} FPS",
-        "Generation time: {gen:.2f} ms", "Rendering time: {rend:.2f} ms"
+        "Step {frame:4d}", "{FPS:.1f} FPS",
+        "Solver: {rate:.0f} steps/s", "Max |Ez|: {fM:.2e}"
     )
-    vals = {"frame":0, "FPS":0, "gen":0, "rend":0}
+    vals = {"frame":0, "FPS":0, "rate":0, "fM":0}
     def __init__(self, grid, nframes=1000):
         super().__init__()
         self.running = False
-        self.elaps_gen = [0] * 50
-        self.elaps_rend = [0] * 50
+        self.shown = [time.perf_counter()] * 30
         self.nframes = nframes
         self.grid = grid
-        self.time = [dt.now(), dt.now()]
         self.tpoints = numpy.arange(0,self.nframes,1)
         self.tdata = numpy.zeros((5,self.nframes), dtype=float) * numpy.nan
 
@@ -42,6 +39,9 @@ class Animation(Frame):
         pm = numpy.array((1,-1), dtype=int)
         self.positions = (center, center + center/2, center + pm*center/2, center - center/2, center - pm*center/2)
         self.positions = tuple((tuple(numpy.int_(i)) for i in self.positions))
+        self.monitor = Monitor(grid, points=self.positions, length=self.nframes)
+        # The solver runs in a background thread, the display only picks up its latest frame
+        self.live = LiveSolver(grid, self.nframes, size=400)
 
         self.initGUI()
 
@@ -52,9 +52,11 @@ class Animation(Frame):
         ax.set_xlim(-0.5,self.grid.shape[0]-0.5)
         ax.set_ylim(-0.5,self.grid.shape[1]-0.5)
         ax.set_aspect('equal')
-        data = self.grid.get_field(2)._data
-        self.im = ax.imshow(numpy.abs(numpy.transpose(data)), cmap=plt.get_cmap('inferno'),
-                                 norm=SafeLogNorm(vmin=1e-5, vmax=2, clip=True))
+        # One pixel of the frames per block of factor x factor nodes
+        ny, nx = self.live.shape
+        extent = (-0.5, nx * self.live.factor - 0.5, ny * self.live.factor - 0.5, -0.5)
+        self.im = ax.imshow(numpy.zeros(self.live.shape), cmap=plt.get_cmap('inferno'), extent=extent,
+                            norm=SafeLogNorm(vmin=1e-5, vmax=2, clip=True))
         self.fig.colorbar(self.im, ax=ax)
 
         self.fig2 = Figure(figsize=(8/CON, 7/CON), dpi=100)
@@ -117,64 +119,64 @@ class Animation(Frame):
 
         self.pack()
 
-    def step(self,i):
-        self.i = i
-        self.time[0] = dt.now()
-        self.elaps_rend.pop(0)
-        self.elaps_rend.append(to_msec(self.time[0] - self.time[1]))
-        self.grid.step(i)
-        self.time[1] = dt.now()
-        self.elaps_gen.pop(0)
-        self.elaps_gen.append(to_msec(self.time[1] - self.time[0]))
-        data = g.get_field(2)._data
-        self.im.set_data(numpy.abs(numpy.transpose(data)))
+    def step(self, i):
+        frame = self.live.latest()
+        if frame is None:
+            return
+        step, data = frame
+        self.im.set_data(data)
 
+        # Probes recorded so far by the solver thread, at every step
+        records = self.monitor.data
         for j in range(5):
-            self.tdata[j,i] = data[self.positions[j]]
+            self.tdata[j, :len(records)] = records[:, j]
             self.plot[j].set_ydata(self.tdata[j])
 
-        try:
-            lim = numpy.abs(self.tdata[:,:i]).max()
-        except ValueError:
-            lim = 0.001
-
+        lim = numpy.abs(records).max() if len(records) else 0
         if lim >= 0.001:
             self.plot[0].axes.set_ylim((-lim,lim))
 
         self.fig_canvas2.draw()
 
-        Animation.vals["frame"] = i
-        Animation.vals["gen"] = sum(self.elaps_gen)/len(self.elaps_gen)
-        Animation.vals["rend"] = sum(self.elaps_rend)/len(self.elaps_rend)
-        Animation.vals["FPS"] = 1000 / (Animation.vals["gen"] + Animation.vals["rend"])
+        self.shown.pop(0)
+        self.shown.append(time.perf_counter())
+        Animation.vals["frame"] = step
+        Animation.vals["rate"] = self.live.rate
+        Animation.vals["FPS"] = (len(self.shown) - 1) / (self.shown[-1] - self.shown[0])
         Animation.vals["fM"] = data.max()
-        Animation.vals["fm"] = data.min()
 
         for var, txt in zip(self.text_var, Animation.txt):
             var.set(txt.format(**Animation.vals))
 
+        if self.live.done:
+            self.anim.event_source.stop()
+
     def run(self):
         if not self.running:
             self.anim = animation.FuncAnimation(
-                self.fig, self.step, frames=self.nframes,
-                repeat=False, interval=int(1000/30), blit=False
+                self.fig, self.step, interval=int(1000/30), blit=False
             )
             self.fig_canvas.draw()
+            self.live.start()
             self.running = True
             self.start.config(state="disabled")
             self.pause_b.config(state="normal")
             self.v_pause.set("Pause")
 
     def quit(self):
-        self.anim.event_source.stop()
+        if self.running:
+            self.anim.event_source.stop()
+        self.live.stop()
         super().quit()
 
     def pause(self):
         if self.running:
+            self.live.pause()
             self.anim.event_source.stop()
             self.v_pause.set("Resume")
             self.running = False
         else:
+            self.live.resume()
             self.anim.event_source.start()
             self.v_pause.set("Pause")
             self.running = True
@@ -185,15 +187,14 @@ if __name__ == '__main__':
     g = FDTD.Grid(*shape)
 
     # Add sources
-    # In this case a set of 5 randomised dipolar sources
+    # In this case an array of 5 randomised dipolar sources
     nsources = 5
-    for i in range(nsources):
-        parms = numpy.random.random(6)
-        sources.SourceDipole(g, (int(parms[0]*shape[0]), int(parms[1]*shape[1])),
-                             sources.PulseGaussian(10 * (1 - 0.5*parms[2]),
-                                                   10e-15 * (1 - 0.5*parms[3]),
-                                                   2e-15 * (1 - 0.5*parms[4]),
-                                                   1.8e15 * (1 - 0.5*parms[5])))
+    parms = numpy.random.random((nsources, 6))
+    sources.SourceArray(g, (parms[:, :2] * shape).astype(int),
+                        pulses=[sources.PulseGaussian(10 * (1 - 0.5*p[2]),
+                                                      10e-15 * (1 - 0.5*p[3]),
+                                                      2e-15 * (1 - 0.5*p[4]),
+                                                      1.8e15 * (1 - 0.5*p[5])) for p in parms])
 
     # Set boundary conditions
     # Here absorbing boundaries to simulate an open system